@@ -1,31 +1,187 @@
 import os
+from typing import Callable, Dict, Iterable, List, Optional
+
+from common.atomic import write_json_atomic
+from common.cache import LRUCache
+from common.logstore import LogStore
+from common.sqlite import SqliteConnectionPool
 from .repo import AccountRepository, Account
 import json
 
 
+def _file_version(stat: os.stat_result):
+    # changes made by other processes show up as a new inode, mtime or size
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
 class JsonAccountRepository(AccountRepository):
-    def __init__(self, folder: str):
+    def __init__(self, folder: str, cache_size: int = 0, sync: bool = False):
         self.folder = folder
+        self._cache = LRUCache(cache_size) if cache_size else None
+        self._sync = sync
     
     def _get_file_name(self, account_id: str):
         return self.folder + "/" + account_id + ".json"
 
+    def _write(self, account: Account):
+        file_name = self._get_file_name(account.id)
+        write_json_atomic(file_name, account.dict(), self._sync)
+        if self._cache is not None:
+            version = _file_version(os.stat(file_name))
+            self._cache.put(account.id, account.copy(), version)
+
     def create(self, account: Account):
-        with open(self._get_file_name(account.id), "w") as f:
-            json.dump(account.dict(), f)
+        self._write(account)
     
     def find(self, account_id: str):
+        if self._cache is not None:
+            return self._find_cached(account_id)
         # check if file not exist
         if not os.path.isfile(self._get_file_name(account_id)):
             return None
         with open(self._get_file_name(account_id), "r") as f:
             data = json.load(f)
             return Account(**data)
+
+    def _find_cached(self, account_id: str):
+        file_name = self._get_file_name(account_id)
+        try:
+            version = _file_version(os.stat(file_name))
+        except FileNotFoundError:
+            self._cache.pop(account_id)
+            return None
+        account = self._cache.get(account_id, version)
+        if account is None:
+            with open(file_name, "r") as f:
+                account = Account(**json.load(f))
+            self._cache.put(account_id, account.copy(), version)
+            return account
+        return account.copy()
     
     def update(self, account: Account):
-        with open(self._get_file_name(account.id), "w") as f:
-            json.dump(account.dict(), f)
+        self._write(account)
         
     def save(self, account: Account):
-        with open(self._get_file_name(account.id), "w") as f:
-            json.dump(account.dict(), f)
+        self._write(account)
+
+    def cache_stats(self) -> Optional[dict]:
+        return self._cache.stats() if self._cache is not None else None
+
+
+class LogAccountRepository(AccountRepository):
+    def __init__(self, folder: str, **store_options):
+        self._store = LogStore(folder, **store_options)
+
+    def _write(self, account: Account):
+        self._store.put(account.id, json.dumps(account.dict()).encode())
+
+    def create(self, account: Account):
+        self._write(account)
+
+    def find(self, account_id: str):
+        data = self._store.get(account_id)
+        if data is None:
+            return None
+        return Account(**json.loads(data))
+
+    def update(self, account: Account):
+        self._write(account)
+
+    def save(self, account: Account):
+        self._write(account)
+
+    def close(self):
+        self._store.close()
+
+
+_CREATE_ACCOUNTS = (
+    "CREATE TABLE IF NOT EXISTS accounts (id TEXT PRIMARY KEY, balance REAL NOT NULL)"
+)
+_UPSERT_ACCOUNT = (
+    "INSERT INTO accounts (id, balance) VALUES (?, ?) "
+    "ON CONFLICT(id) DO UPDATE SET balance = excluded.balance"
+)
+_SELECT_ACCOUNT = "SELECT id, balance FROM accounts WHERE id = ?"
+_DEPOSIT_ACCOUNT = "UPDATE accounts SET balance = balance + ? WHERE id = ?"
+_WITHDRAW_ACCOUNT = (
+    "UPDATE accounts SET balance = balance - ? WHERE id = ? AND balance >= ?"
+)
+# sqlite limits the number of bound parameters per statement
+_FIND_MANY_CHUNK = 500
+
+
+class SqliteAccountRepository(AccountRepository):
+    def __init__(self, path: str):
+        self._pool = SqliteConnectionPool(path)
+        self._pool.connection().execute(_CREATE_ACCOUNTS)
+
+    def create(self, account: Account):
+        self.save(account)
+
+    def find(self, account_id: str):
+        row = self._pool.connection().execute(_SELECT_ACCOUNT, (account_id,)).fetchone()
+        if row is None:
+            return None
+        return Account(id=row[0], balance=row[1])
+
+    def update(self, account: Account):
+        self.save(account)
+
+    def save(self, account: Account):
+        self._pool.connection().execute(_UPSERT_ACCOUNT, (account.id, account.balance))
+
+    def save_many(self, accounts: List[Account]):
+        with self._pool.transaction() as connection:
+            connection.executemany(
+                _UPSERT_ACCOUNT, [(account.id, account.balance) for account in accounts]
+            )
+
+    def find_many(self, account_ids: Iterable[str]) -> Dict[str, Account]:
+        account_ids = list(account_ids)
+        connection = self._pool.connection()
+        accounts = {}
+        for start in range(0, len(account_ids), _FIND_MANY_CHUNK):
+            chunk = account_ids[start : start + _FIND_MANY_CHUNK]
+            rows = connection.execute(
+                "SELECT id, balance FROM accounts WHERE id IN (%s)"
+                % ",".join("?" * len(chunk)),
+                chunk,
+            )
+            for row in rows:
+                accounts[row[0]] = Account(id=row[0], balance=row[1])
+        return accounts
+
+    def modify(
+        self, account_id: str, mutate: Callable[[Optional[Account]], bool]
+    ) -> Optional[Account]:
+        with self._pool.transaction(immediate=True) as connection:
+            row = connection.execute(_SELECT_ACCOUNT, (account_id,)).fetchone()
+            account = Account(id=row[0], balance=row[1]) if row else None
+            if mutate(account):
+                connection.execute(_UPSERT_ACCOUNT, (account.id, account.balance))
+        return account
+
+    def deposit(self, account_id: str, amount: float) -> Account:
+        with self._pool.transaction(immediate=True) as connection:
+            updated = connection.execute(_DEPOSIT_ACCOUNT, (amount, account_id))
+            if updated.rowcount == 0:
+                raise ValueError(f"Account {account_id} not found")
+            row = connection.execute(_SELECT_ACCOUNT, (account_id,)).fetchone()
+        return Account(id=row[0], balance=row[1])
+
+    def withdraw(self, account_id: str, amount: float) -> Account:
+        # the balance check and the update are one statement, so concurrent
+        # withdrawals cannot overdraw the account
+        with self._pool.transaction(immediate=True) as connection:
+            updated = connection.execute(
+                _WITHDRAW_ACCOUNT, (amount, account_id, amount)
+            )
+            row = connection.execute(_SELECT_ACCOUNT, (account_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"Account {account_id} not found")
+        if updated.rowcount == 0:
+            raise ValueError("Cannot deposit more than balance")
+        return Account(id=row[0], balance=row[1])
+
+    def close(self):
+        self._pool.close()
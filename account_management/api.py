@@ -1,10 +1,8 @@
 import os
 
 import pydantic
-from config import settings
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 
-from .adapter import JsonAccountRepository
 from .logic import Account, AccountService
 
 router = APIRouter()
@@ -14,10 +12,14 @@ class CreateAccountRequest(pydantic.BaseModel):
     balance: float = 0.0
 
 
+def get_account_service(request: Request) -> AccountService:
+    return request.app.state.container.get("account_service")
+
+
 @router.get("/{account_id}", response_model=Account)
-def get_account(account_id: str):
-    repo = JsonAccountRepository(settings.account_database_folder)
-    service = AccountService(account_repository=repo)
+def get_account(
+    account_id: str, service: AccountService = Depends(get_account_service)
+):
     account = service.get(account_id)
     if account is None:
         raise HTTPException(status_code=404, detail={"message": "Account not found"})
@@ -25,8 +27,9 @@ def get_account(account_id: str):
 
 
 @router.post("", response_model=Account)
-def create_account(request: CreateAccountRequest):
-    repo = JsonAccountRepository(settings.account_database_folder)
-    service = AccountService(account_repository=repo)
+def create_account(
+    request: CreateAccountRequest,
+    service: AccountService = Depends(get_account_service),
+):
     account = service.create(request.balance)
     return account
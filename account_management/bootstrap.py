@@ -0,0 +1,62 @@
+import os
+from typing import Optional
+
+from common.container import Container, close_resource
+from common.locking import StripedLock
+from config import settings
+
+from .adapter import (
+    JsonAccountRepository,
+    LogAccountRepository,
+    SqliteAccountRepository,
+)
+from .logic import AccountService
+from .repo import AccountRepository
+
+
+def build_account_repository() -> AccountRepository:
+    if settings.account_database_backend == "log":
+        return LogAccountRepository(
+            settings.account_database_folder,
+            compaction_interval=settings.log_store_compaction_interval,
+        )
+    if settings.account_database_backend == "sqlite":
+        return SqliteAccountRepository(
+            os.path.join(settings.account_database_folder, "accounts.sqlite3")
+        )
+    return JsonAccountRepository(
+        settings.account_database_folder,
+        cache_size=settings.account_cache_size,
+        sync=settings.account_database_sync,
+    )
+
+
+def build_account_lock() -> Optional[StripedLock]:
+    # sqlite changes balances atomically, the log store is owned by a single
+    # process and the json files may be shared by several
+    if settings.account_database_backend == "sqlite":
+        return None
+    if settings.account_database_backend == "log":
+        return StripedLock(stripes=settings.account_lock_stripes)
+    return StripedLock(
+        os.path.join(settings.account_database_folder, ".account.lock"),
+        stripes=settings.account_lock_stripes,
+    )
+
+
+def register_account_services(container: Container):
+    container.register(
+        "account_repository",
+        lambda c: build_account_repository(),
+        close=close_resource,
+    )
+    container.register(
+        "account_lock", lambda c: build_account_lock(), close=close_resource
+    )
+    container.register(
+        "account_service",
+        lambda c: AccountService(
+            account_repository=c.get("account_repository"),
+            lock_manager=c.get("account_lock"),
+        ),
+    )
@@ -1,11 +1,41 @@
+from contextlib import nullcontext
+from typing import List, Optional
 from uuid import uuid4
+
+import pydantic
+
+from common.locking import StripedLock
 from .model import Account
 from .repo import AccountRepository
 
 
+class BalanceOperation(pydantic.BaseModel):
+    type: str
+    account_id: str
+    amount: float
+    command_id: Optional[str] = None
+
+
+class BalanceOperationResult(pydantic.BaseModel):
+    command_id: Optional[str] = None
+    status: str
+    account: Optional[Account] = None
+    reason: Optional[str] = None
+
+
 class AccountService:
-    def __init__(self, account_repository: AccountRepository):
+    def __init__(
+        self,
+        account_repository: AccountRepository,
+        lock_manager: Optional[StripedLock] = None,
+    ):
         self.account_repository = account_repository
+        self.lock_manager = lock_manager
+
+    def _lock(self, account_id: str):
+        if self.lock_manager is None:
+            return nullcontext()
+        return self.lock_manager.lock(account_id)
     
     def create(self, balance: float = 0.0):
         account_id = uuid4().hex
@@ -18,13 +48,63 @@ class AccountService:
         return account
     
     def deposit(self, account_id: str, amount: float):
-        account = self.account_repository.find(account_id)
-        account.deposit(amount)
-        self.account_repository.update(account)
-        return account
+        with self._lock(account_id):
+            return self.account_repository.deposit(account_id, amount)
     
     def withdraw(self, account_id: str, amount: float):
-        account = self.account_repository.find(account_id)
-        account.withdraw(amount)
-        self.account_repository.update(account)
-        return account
+        with self._lock(account_id):
+            return self.account_repository.withdraw(account_id, amount)
+
+    def apply_batch(
+        self, operations: List[BalanceOperation]
+    ) -> List[BalanceOperationResult]:
+        # operations on the same account are applied in order to one loaded
+        # account, which is then written once
+        results = [None] * len(operations)
+        groups = {}
+        for index, operation in enumerate(operations):
+            groups.setdefault(operation.account_id, []).append(index)
+
+        for account_id, indexes in groups.items():
+
+            def apply(account: Optional[Account]) -> bool:
+                changed = False
+                for index in indexes:
+                    operation = operations[index]
+                    try:
+                        if account is None:
+                            raise ValueError(f"Account {account_id} not found")
+                        if operation.type == "deposit":
+                            account.deposit(operation.amount)
+                        elif operation.type == "withdraw":
+                            account.withdraw(operation.amount)
+                        else:
+                            raise ValueError(f"Unknown operation {operation.type}")
+                    except ValueError as e:
+                        results[index] = BalanceOperationResult(
+                            command_id=operation.command_id,
+                            status="failed",
+                            reason=str(e),
+                        )
+                    else:
+                        changed = True
+                        results[index] = BalanceOperationResult(
+                            command_id=operation.command_id,
+                            status="succeeded",
+                            account=account.copy(),
+                        )
+                return changed
+
+            with self._lock(account_id):
+                try:
+                    self.account_repository.modify(account_id, apply)
+                except Exception as e:
+                    # the account could not be written, every operation on it
+                    # fails while the other accounts keep their results
+                    for index in indexes:
+                        results[index] = BalanceOperationResult(
+                            command_id=operations[index].command_id,
+                            status="failed",
+                            reason=str(e),
+                        )
+        return results
@@ -1,4 +1,4 @@
-from typing import Union
+from typing import Callable, Dict, Iterable, List, Optional, Union
 from .model import Account
 
 
@@ -14,3 +14,39 @@ class AccountRepository:
     
     def update(self, account: Account):
         raise NotImplementedError()
+
+    def save_many(self, accounts: List[Account]):
+        for account in accounts:
+            self.save(account)
+
+    def find_many(self, account_ids: Iterable[str]) -> Dict[str, Account]:
+        accounts = {}
+        for account_id in account_ids:
+            account = self.find(account_id)
+            if account is not None:
+                accounts[account_id] = account
+        return accounts
+
+    def modify(
+        self, account_id: str, mutate: Callable[[Optional[Account]], bool]
+    ) -> Optional[Account]:
+        # mutate gets the stored account (or None) and returns whether it
+        # changed and has to be written back
+        account = self.find(account_id)
+        if mutate(account):
+            self.update(account)
+        return account
+
+    # read-modify-write by default, backends that can change a balance
+    # atomically override these
+    def deposit(self, account_id: str, amount: float) -> Account:
+        account = self.find(account_id)
+        account.deposit(amount)
+        self.update(account)
+        return account
+
+    def withdraw(self, account_id: str, amount: float) -> Account:
+        account = self.find(account_id)
+        account.withdraw(amount)
+        self.update(account)
+        return account
@@ -1,16 +1,21 @@
 import pika
 
-from account_management.adapter import JsonAccountRepository
-from account_management.logic import AccountService
-from common.publisher import RabbitMQPublisher
+from account_management.bootstrap import register_account_services
+from account_management.logic import BalanceOperation
+from common.container import Container
+from common.publisher import register_publisher
 from common.worker.rabbitmq_worker import RabbitmqWorker
 from config import settings
+from saga.codec import create_codec
+from saga.idempotency import create_idempotency_guard
+from saga.metrics import WorkerMetrics, serve_metrics
 
 
-def deposit_account_balance_factory(publisher, exchange, queue):
+def deposit_account_balance_factory(container, exchange, queue):
+    service = container.get("account_service")
+    publisher = container.get("publisher")
+
     def deposit_account_balance(message: dict):
-        repo = JsonAccountRepository(settings.account_database_folder)
-        service = AccountService(account_repository=repo)
         command_id = message.get("command_id")
         account_id = message["account_id"]
         amount = float(message["amount"])
@@ -38,10 +43,11 @@ def deposit_account_balance_factory(publisher, exchange, queue):
     return deposit_account_balance
 
 
-def withdraw_account_balance_factory(publisher, exchange, queue):
+def withdraw_account_balance_factory(container, exchange, queue):
+    service = container.get("account_service")
+    publisher = container.get("publisher")
+
     def withdraw_account_balance(message: dict):
-        repo = JsonAccountRepository(settings.account_database_folder)
-        service = AccountService(account_repository=repo)
         command_id = message.get("command_id")
         account_id = message["account_id"]
         amount = float(message["amount"])
@@ -69,29 +75,99 @@ def withdraw_account_balance_factory(publisher, exchange, queue):
     return withdraw_account_balance
 
 
+BALANCE_OPERATION_TYPES = {
+    "deposit_account_balance": "deposit",
+    "withdraw_account_balance": "withdraw",
+}
+
+
+def apply_balance_batch_factory(container, exchange, queue):
+    service = container.get("account_service")
+    publisher = container.get("publisher")
+
+    def apply_balance_batch(messages: list):
+        operations = [
+            BalanceOperation(
+                type=BALANCE_OPERATION_TYPES[message["type"]],
+                account_id=message["account_id"],
+                amount=float(message["amount"]),
+                command_id=message.get("command_id"),
+            )
+            for message in messages
+        ]
+        replies = []
+        for result in service.apply_batch(operations):
+            if result.status == "failed":
+                replies.append(
+                    {
+                        "command_id": result.command_id,
+                        "status": "failed",
+                        "reason": result.reason,
+                    }
+                )
+            else:
+                replies.append(
+                    {
+                        "command_id": result.command_id,
+                        "status": "succeeded",
+                        "account": result.account.dict(),
+                    }
+                )
+        publisher.publish_many(replies, exchange, queue)
+        print("APPLIED BALANCE BATCH: ", len(operations))
+
+    return apply_balance_batch
+
+
 def main():
     connection = pika.BlockingConnection(
         pika.URLParameters(settings.account_worker_amqp_uri)
     )
-    publisher_connection = pika.BlockingConnection(
-        pika.URLParameters(settings.saga_amqp_uri)
-    )
-    publisher = RabbitMQPublisher(publisher_connection)
-    worker = RabbitmqWorker(connection, settings.saga_exchange, settings.saga_queue)
-    worker.register_callback(
-        "deposit_account_balance",
-        deposit_account_balance_factory(
-            publisher, settings.saga_exchange, settings.saga_queue
-        ),
-    )
-    worker.register_callback(
-        "withdraw_account_balance",
-        withdraw_account_balance_factory(
-            publisher,
-            settings.saga_exchange,
-            settings.saga_queue,
+    container = Container()
+    register_account_services(container)
+    codec = create_codec(settings.message_codec, settings.message_compress_threshold)
+    register_publisher(container, settings.saga_amqp_uri, codec)
+    metrics = None
+    if settings.account_worker_metrics_port:
+        serve_metrics(settings.account_worker_metrics_port)
+        metrics = WorkerMetrics()
+    worker = RabbitmqWorker(
+        connection,
+        settings.saga_exchange,
+        settings.saga_queue,
+        prefetch_count=settings.account_worker_prefetch_count,
+        max_workers=settings.account_worker_concurrency,
+        ordering_key="account_id",
+        container=container,
+        batch_size=settings.account_worker_batch_size,
+        codec=codec,
+        idempotency_guard=create_idempotency_guard(
+            settings.idempotency_capacity, settings.idempotency_redis_url
         ),
+        metrics=metrics,
     )
+    if settings.account_worker_batch_size:
+        worker.register_batch_callback(
+            list(BALANCE_OPERATION_TYPES),
+            apply_balance_batch_factory(
+                container, settings.saga_exchange, settings.saga_queue
+            ),
+        )
+    else:
+        worker.register_callback(
+            "deposit_account_balance",
+            deposit_account_balance_factory(
+                container, settings.saga_exchange, settings.saga_queue
+            ),
+        )
+        worker.register_callback(
+            "withdraw_account_balance",
+            withdraw_account_balance_factory(
+                container,
+                settings.saga_exchange,
+                settings.saga_queue,
+            ),
+        )
     worker.start()
 
 
@@ -1,10 +1,54 @@
-from fastapi import FastAPI
+import time
+
+from fastapi import FastAPI, Request, Response
 
 from account_management.api import router as account_management_router
+from account_management.bootstrap import register_account_services
+from common.container import Container
+from saga.metrics import CONTENT_TYPE, REGISTRY
 from subscription_management.api import router as subscription_management_router
+from subscription_management.bootstrap import register_subscription_services
 
 app = FastAPI(title="Billing Service")
 
+container = Container()
+register_account_services(container)
+register_subscription_services(container)
+app.state.container = container
+
+request_seconds = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Time spent handling HTTP requests",
+    ("method", "route", "status"),
+)
+
+
+@app.on_event("shutdown")
+def close_container():
+    container.close()
+
+
+@app.middleware("http")
+async def measure_request(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # the route template, not the path, keeps ids out of the labels
+    route = request.scope.get("route")
+    request_seconds.observe(
+        time.perf_counter() - start,
+        (
+            request.method,
+            route.path if route is not None else "unmatched",
+            str(response.status_code),
+        ),
+    )
+    return response
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(REGISTRY.render(), headers={"Content-Type": CONTENT_TYPE})
+
 
 app.include_router(account_management_router, prefix="/accounts", tags=["accounts"])
 app.include_router(
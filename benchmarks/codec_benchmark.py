@@ -0,0 +1,95 @@
+import timeit
+import uuid
+from typing import List
+
+from saga.codec import CODECS, MessageCodec
+
+from .report import result
+
+
+def make_envelope(items: int) -> dict:
+    # shaped like the commands SagaExecutionController sends between steps
+    return {
+        "saga_id": uuid.uuid4().hex,
+        "saga_name": "subscribe",
+        "step_name": "withdraw_account_balance",
+        "step_type": "compensation",
+        "payload": {
+            "account_id": uuid.uuid4().hex,
+            "subscription_id": uuid.uuid4().hex,
+            "amount": "10000",
+            "plan": "premium-monthly",
+            "line_items": [
+                {
+                    "sku": f"sku-{i}",
+                    "description": "Monthly premium subscription",
+                    "quantity": 1,
+                    "unit_price": 9.99,
+                    "discount": 0.0,
+                }
+                for i in range(items)
+            ],
+        },
+        "error_type": "InsufficientBalanceError",
+        "error": "Cannot withdraw more than balance",
+    }
+
+
+ENVELOPES = {
+    "small": make_envelope(0),
+    "medium": make_envelope(10),
+    "large": make_envelope(500),
+}
+
+
+def codecs():
+    for name, codec_class in CODECS.items():
+        try:
+            codec = codec_class()
+        except RuntimeError:
+            print(f"skipping {name}, not installed")
+            continue
+        yield name, MessageCodec(codec)
+        yield f"{name}+deflate", MessageCodec(codec, compress_threshold=1024)
+
+
+def measure(codec: MessageCodec, envelope: dict, number: int):
+    body, content_type, content_encoding = codec.encode(envelope)
+    encode = timeit.timeit(lambda: codec.encode(envelope), number=number)
+    decode = timeit.timeit(
+        lambda: codec.decode(body, content_type, content_encoding), number=number
+    )
+    return len(body), encode / number * 1e6, decode / number * 1e6
+
+
+def run(number: int = 2000) -> List[dict]:
+    return [
+        result(
+            "codec",
+            {"codec": name, "envelope": envelope_name, "number": number},
+            dict(
+                zip(
+                    ("bytes", "encode_us", "decode_us"),
+                    measure(codec, envelope, number),
+                )
+            ),
+        )
+        for name, codec in codecs()
+        for envelope_name, envelope in ENVELOPES.items()
+    ]
+
+
+def main(number: int = 2000):
+    print(
+        f"{'codec':<18}{'envelope':<10}{'bytes':>9}{'encode us':>12}{'decode us':>12}"
+    )
+    for r in run(number):
+        p, m = r["params"], r["metrics"]
+        print(
+            f"{p['codec']:<18}{p['envelope']:<10}{m['bytes']:>9}"
+            f"{m['encode_us']:>12.2f}{m['decode_us']:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
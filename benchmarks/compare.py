@@ -0,0 +1,63 @@
+import argparse
+import json
+import sys
+
+from .report import load_results
+
+# metrics where a larger value is better, for the rest smaller is better
+HIGHER_IS_BETTER = ("_per_second",)
+# counts and sizes that describe a run rather than its speed
+IGNORED = ("steps", "completed", "failed", "compensation_failed", "bytes")
+
+
+def _key(result: dict) -> str:
+    return result["benchmark"] + json.dumps(result["params"], sort_keys=True)
+
+
+def compare(base: dict, head: dict, threshold: float):
+    # yields (key, metric, base value, head value, change, regressed), change
+    # being positive when head is better
+    base_results = {_key(r): r for r in base["results"]}
+    for result in head["results"]:
+        key = _key(result)
+        if key not in base_results:
+            continue
+        base_metrics = base_results[key]["metrics"]
+        for metric, value in result["metrics"].items():
+            if metric in IGNORED or not base_metrics.get(metric):
+                continue
+            change = value / base_metrics[metric] - 1
+            if not metric.endswith(HIGHER_IS_BETTER):
+                change = -change
+            yield key, metric, base_metrics[metric], value, change, change < -threshold
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark results")
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown reported as a regression",
+    )
+    arguments = parser.parse_args()
+    base, head = load_results(arguments.base), load_results(arguments.head)
+    print(
+        f"base {base['environment'].get('commit')} "
+        f"head {head['environment'].get('commit')}"
+    )
+    regressions = 0
+    for key, metric, before, after, change, regressed in compare(
+        base, head, arguments.threshold
+    ):
+        regressions += regressed
+        flag = "REGRESSION" if regressed else ""
+        print(f"{key} {metric}: {before:.6g} -> {after:.6g} ({change:+.1%}) {flag}")
+    print(f"{regressions} regressions above {arguments.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
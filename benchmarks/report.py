@@ -0,0 +1,62 @@
+import json
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+
+def percentiles(
+    samples: Sequence[float], points: Sequence[int] = (50, 90, 99)
+) -> Dict[str, float]:
+    # nearest rank, enough to compare runs with each other
+    if not samples:
+        return {f"p{point}": 0.0 for point in points}
+    ordered = sorted(samples)
+    return {
+        f"p{point}": ordered[min(len(ordered) - 1, len(ordered) * point // 100)]
+        for point in points
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict:
+    return {
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def result(benchmark: str, params: dict, metrics: dict) -> dict:
+    return {"benchmark": benchmark, "params": params, "metrics": metrics}
+
+
+def write_results(path: str, results: List[dict], arguments: dict):
+    with open(path, "w") as f:
+        json.dump(
+            {"environment": environment(), "arguments": arguments, "results": results},
+            f,
+            indent=2,
+            sort_keys=True,
+        )
+        f.write("\n")
+
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,173 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from account_management.adapter import (
+    JsonAccountRepository,
+    LogAccountRepository,
+    SqliteAccountRepository,
+)
+from account_management.model import Account
+from subscription_management.adapter import (
+    JsonSubscriptionAdapter,
+    LogSubscriptionAdapter,
+    SqliteSubscriptionRepository,
+)
+from subscription_management.model import Subscription
+
+from .report import result
+
+
+def _account(entity_id: str) -> Account:
+    return Account(id=entity_id, balance=100.0)
+
+
+def _subscription(entity_id: str) -> Subscription:
+    return Subscription(id=entity_id, account_id=entity_id, price=9.99)
+
+
+def _deposit(account: Account) -> Account:
+    account.deposit(1.0)
+    return account
+
+
+def _toggle_state(subscription: Subscription) -> Subscription:
+    subscription.state = "accepted" if subscription.state == "pending" else "pending"
+    return subscription
+
+
+# name -> (repository factory taking a folder and a cache size, entity
+# factory, method that stores a new entity, change made by an update)
+REPOSITORIES: Dict[str, Tuple[Callable, Callable, str, Callable]] = {
+    "json_account": (
+        lambda folder, cache_size: JsonAccountRepository(folder, cache_size),
+        _account,
+        "create",
+        _deposit,
+    ),
+    "json_subscription": (
+        lambda folder, cache_size: JsonSubscriptionAdapter(folder, cache_size),
+        _subscription,
+        "save",
+        _toggle_state,
+    ),
+    "log_account": (
+        lambda folder, cache_size: LogAccountRepository(folder),
+        _account,
+        "create",
+        _deposit,
+    ),
+    "log_subscription": (
+        lambda folder, cache_size: LogSubscriptionAdapter(folder),
+        _subscription,
+        "save",
+        _toggle_state,
+    ),
+    "sqlite_account": (
+        lambda folder, cache_size: SqliteAccountRepository(
+            os.path.join(folder, "accounts.db")
+        ),
+        _account,
+        "create",
+        _deposit,
+    ),
+    "sqlite_subscription": (
+        lambda folder, cache_size: SqliteSubscriptionRepository(
+            os.path.join(folder, "subscriptions.db")
+        ),
+        _subscription,
+        "save",
+        _toggle_state,
+    ),
+}
+
+
+def run_repository(
+    name: str,
+    entities: int,
+    operations: int = 10000,
+    cache_size: int = 0,
+    seed: int = 0,
+    workdir: Optional[str] = None,
+) -> dict:
+    make_repository, make_entity, store, change = REPOSITORIES[name]
+    rng = random.Random(seed)
+    folder = tempfile.mkdtemp(prefix=f"{name}-", dir=workdir)
+    try:
+        repository = make_repository(folder, cache_size)
+        ids = [uuid.UUID(int=rng.getrandbits(128)).hex for _ in range(entities)]
+        start = time.perf_counter()
+        for entity_id in ids:
+            getattr(repository, store)(make_entity(entity_id))
+        setup = time.perf_counter() - start
+
+        sample = [rng.choice(ids) for _ in range(operations)]
+        start = time.perf_counter()
+        for entity_id in sample:
+            repository.find(entity_id)
+        find = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for entity_id in sample:
+            repository.update(change(repository.find(entity_id)))
+        update = time.perf_counter() - start
+
+        if hasattr(repository, "close"):
+            repository.close()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return result(
+        "repository",
+        {
+            "repository": name,
+            "entities": entities,
+            "operations": operations,
+            "cache_size": cache_size,
+            "seed": seed,
+        },
+        {
+            "setup_seconds": setup,
+            "creates_per_second": entities / setup,
+            "finds_per_second": operations / find,
+            # an update is read, change and write
+            "updates_per_second": operations / update,
+        },
+    )
+
+
+def run(
+    repositories: Sequence[str] = ("json_account", "json_subscription"),
+    sizes: Sequence[int] = (10000,),
+    operations: int = 10000,
+    cache_sizes: Sequence[int] = (0,),
+    seed: int = 0,
+    workdir: Optional[str] = None,
+) -> List[dict]:
+    return [
+        run_repository(name, size, operations, cache_size, seed, workdir)
+        for name in repositories
+        for size in sizes
+        for cache_size in cache_sizes
+    ]
+
+
+def main():
+    print(
+        f"{'repository':<22}{'entities':>10}{'cache':>8}"
+        f"{'creates/s':>12}{'finds/s':>12}{'updates/s':>12}"
+    )
+    for r in run():
+        p, m = r["params"], r["metrics"]
+        print(
+            f"{p['repository']:<22}{p['entities']:>10}{p['cache_size']:>8}"
+            f"{m['creates_per_second']:>12.0f}{m['finds_per_second']:>12.0f}"
+            f"{m['updates_per_second']:>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import time
+
+from . import codec_benchmark, repository_benchmark, saga_benchmark, worker_benchmark
+from .report import write_results
+
+SUITES = ("saga", "worker", "repository", "codec")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Run the benchmarks offline and write the results as JSON"
+    )
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--suites", nargs="+", choices=SUITES, default=list(SUITES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quick", action="store_true", help="smaller runs")
+    saga = parser.add_argument_group("saga")
+    saga.add_argument("--lengths", nargs="+", type=int, default=[1, 5, 20])
+    saga.add_argument("--failure-rates", nargs="+", type=float, default=[0.0, 0.1])
+    saga.add_argument("--sagas", type=int, default=2000)
+    saga.add_argument("--window", type=int, default=100)
+    saga.add_argument(
+        "--state-repositories",
+        nargs="+",
+        choices=("memory", "file"),
+        default=["memory", "file"],
+    )
+    worker = parser.add_argument_group("worker")
+    worker.add_argument("--message-types", nargs="+", type=int, default=[1, 100])
+    worker.add_argument("--dispatches", type=int, default=200000)
+    repository = parser.add_argument_group("repository")
+    repository.add_argument(
+        "--repositories",
+        nargs="+",
+        choices=sorted(repository_benchmark.REPOSITORIES),
+        default=["json_account", "json_subscription"],
+    )
+    repository.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=[10000],
+        help="entities per repository, e.g. 10000 100000 1000000",
+    )
+    repository.add_argument("--operations", type=int, default=10000)
+    repository.add_argument("--cache-sizes", nargs="+", type=int, default=[0])
+    repository.add_argument("--workdir", help="where repositories are created")
+    codec = parser.add_argument_group("codec")
+    codec.add_argument("--codec-number", type=int, default=2000)
+    arguments = parser.parse_args()
+    if arguments.quick:
+        arguments.sagas = 200
+        arguments.dispatches = 20000
+        arguments.sizes = [1000]
+        arguments.operations = 1000
+        arguments.codec_number = 200
+    return arguments
+
+
+def main():
+    arguments = parse_arguments()
+    results = []
+    for suite in arguments.suites:
+        start = time.perf_counter()
+        if suite == "saga":
+            results.extend(
+                saga_benchmark.run(
+                    arguments.lengths,
+                    arguments.failure_rates,
+                    arguments.sagas,
+                    arguments.window,
+                    arguments.state_repositories,
+                    arguments.seed,
+                )
+            )
+        elif suite == "worker":
+            results.extend(
+                worker_benchmark.run(arguments.message_types, arguments.dispatches)
+            )
+        elif suite == "repository":
+            results.extend(
+                repository_benchmark.run(
+                    arguments.repositories,
+                    arguments.sizes,
+                    arguments.operations,
+                    arguments.cache_sizes,
+                    arguments.seed,
+                    arguments.workdir,
+                )
+            )
+        elif suite == "codec":
+            results.extend(codec_benchmark.run(arguments.codec_number))
+        print(f"{suite} done in {time.perf_counter() - start:.1f}s")
+    write_results(arguments.output, results, vars(arguments))
+    print(f"{len(results)} results written to {arguments.output}")
+
+
+if __name__ == "__main__":
+    main()
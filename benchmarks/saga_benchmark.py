@@ -0,0 +1,160 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Sequence
+
+from saga.file_repository import FileSagaStateRepository
+from saga.saga import (
+    FINISHED_STATUSES,
+    CompositeSagaStateRepository,
+    EventSagaStateRepository,
+    Saga,
+    SagaStep,
+)
+
+from .report import percentiles, result
+from .transport import InMemorySagaExecutionController, InMemorySagaIgniter
+
+
+class StepFailed(Exception):
+    pass
+
+
+class NullSagaStateRepository(EventSagaStateRepository):
+    # events are built and dropped, what is left is the engine itself
+    def _record(self, events: List[dict]):
+        pass
+
+
+class LatencyRecorder(EventSagaStateRepository):
+    def __init__(self):
+        super().__init__()
+        self.started: Dict[str, float] = {}
+        self.latencies: List[float] = []
+        self.statuses: Dict[str, int] = {}
+
+    def _record(self, events: List[dict]):
+        now = time.perf_counter()
+        for event in events:
+            status = event["status"]
+            if status == "started":
+                self.started[event["saga_id"]] = now
+            elif status in FINISHED_STATUSES:
+                started = self.started.pop(event["saga_id"])
+                self.latencies.append(now - started)
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+def make_saga(length: int, failure_rate: float, rng: random.Random) -> Saga:
+    def action(message):
+        if failure_rate and rng.random() < failure_rate:
+            raise StepFailed("step failed")
+        return message["payload"]
+
+    def compensation(message):
+        return message["payload"]
+
+    saga = Saga(f"linear_{length}")
+    for index in range(length):
+        saga.add_step(SagaStep(f"step_{index}", action, compensation))
+    return saga
+
+
+def run_sagas(
+    length: int,
+    failure_rate: float,
+    sagas: int = 2000,
+    window: int = 100,
+    repository: str = "memory",
+    seed: int = 0,
+) -> dict:
+    # keeps window sagas in flight and starts a new one as one finishes, so
+    # saga latency includes waiting behind the others like on a busy queue
+    rng = random.Random(seed)
+    folder = None
+    if repository == "file":
+        folder = tempfile.mkdtemp(prefix="saga-benchmark-")
+        storage = FileSagaStateRepository(os.path.join(folder, "state.log"))
+    else:
+        storage = NullSagaStateRepository()
+    recorder = LatencyRecorder()
+    state_repository = CompositeSagaStateRepository([storage, recorder])
+    controller = InMemorySagaExecutionController(state_repository)
+    saga = make_saga(length, failure_rate, rng)
+    controller.add_saga(saga)
+    igniter = InMemorySagaIgniter(state_repository, controller)
+    payload = {"account_id": "a" * 32, "amount": "10000"}
+
+    step_times = []
+    started = 0
+    start = time.perf_counter()
+    while started < sagas or controller.queue:
+        while started < sagas and len(recorder.started) < window:
+            igniter.start(saga, payload, saga_id=f"saga-{seed}-{started}")
+            started += 1
+        step_start = time.perf_counter()
+        controller.run_once()
+        step_times.append(time.perf_counter() - step_start)
+    elapsed = time.perf_counter() - start
+
+    if folder is not None:
+        storage.close()
+        shutil.rmtree(folder, ignore_errors=True)
+    step_us = percentiles([t * 1e6 for t in step_times])
+    saga_ms = percentiles([t * 1e3 for t in recorder.latencies])
+    return result(
+        "saga",
+        {
+            "length": length,
+            "failure_rate": failure_rate,
+            "sagas": sagas,
+            "window": window,
+            "repository": repository,
+            "seed": seed,
+        },
+        dict(
+            elapsed_seconds=elapsed,
+            steps=len(step_times),
+            steps_per_second=len(step_times) / elapsed,
+            sagas_per_second=sagas / elapsed,
+            **{f"step_{k}_us": v for k, v in step_us.items()},
+            **{f"saga_{k}_ms": v for k, v in saga_ms.items()},
+            **{status: count for status, count in recorder.statuses.items()},
+        ),
+    )
+
+
+def run(
+    lengths: Sequence[int] = (1, 5, 20),
+    failure_rates: Sequence[float] = (0.0, 0.1),
+    sagas: int = 2000,
+    window: int = 100,
+    repositories: Sequence[str] = ("memory", "file"),
+    seed: int = 0,
+) -> List[dict]:
+    return [
+        run_sagas(length, failure_rate, sagas, window, repository, seed)
+        for repository in repositories
+        for length in lengths
+        for failure_rate in failure_rates
+    ]
+
+
+def main():
+    print(
+        f"{'repository':<12}{'length':>7}{'fail':>6}{'steps/s':>11}"
+        f"{'step p50 us':>13}{'step p99 us':>13}{'saga p50 ms':>13}{'saga p99 ms':>13}"
+    )
+    for r in run():
+        p, m = r["params"], r["metrics"]
+        print(
+            f"{p['repository']:<12}{p['length']:>7}{p['failure_rate']:>6}"
+            f"{m['steps_per_second']:>11.0f}{m['step_p50_us']:>13.1f}"
+            f"{m['step_p99_us']:>13.1f}{m['saga_p50_ms']:>13.2f}{m['saga_p99_ms']:>13.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
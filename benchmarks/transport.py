@@ -0,0 +1,72 @@
+from collections import deque
+from typing import List, Optional
+
+from saga.codec import MessageCodec
+from saga.saga import (
+    SagaExecutionController,
+    SagaIgniter,
+    SagaStateRepository,
+    encode_command,
+)
+
+
+class InMemorySagaExecutionController(SagaExecutionController):
+    # commands go through a deque instead of RabbitMQ. they are encoded and
+    # decoded like on the wire unless encode is off; delayed commands are
+    # queued right away, nothing waits on the clock
+    def __init__(
+        self,
+        saga_state_repository: SagaStateRepository,
+        inline_local_steps: bool = False,
+        codec: Optional[MessageCodec] = None,
+        encode: bool = True,
+        **options,
+    ):
+        super().__init__(saga_state_repository, inline_local_steps, **options)
+        self._codec = (codec or MessageCodec()) if encode else None
+        self.queue = deque()
+        self.delayed = 0
+
+    def enqueue(self, payload):
+        if self._codec is not None:
+            payload = encode_command(self._codec, payload, self._claim_check)
+        self.queue.append(payload)
+
+    def _send_next_step_command(self, payload):
+        self.enqueue(payload)
+
+    def _send_compensation_command(self, payload):
+        self.enqueue(payload)
+
+    def _send_delayed_command(self, payload, delay: float):
+        self.delayed += 1
+        self.enqueue(payload)
+
+    def run_once(self) -> bool:
+        if not self.queue:
+            return False
+        message = self.queue.popleft()
+        if self._codec is not None:
+            message = self._codec.decode(*message)
+        # taken off the queue is as good as acked
+        self._settled(self._handle_message(message))
+        return True
+
+    def run(self):
+        while self.run_once():
+            pass
+
+
+class InMemorySagaIgniter(SagaIgniter):
+    def __init__(
+        self,
+        saga_state_repository: SagaStateRepository,
+        controller: InMemorySagaExecutionController,
+        batch_size: int = 1000,
+    ):
+        super().__init__(saga_state_repository, batch_size=batch_size)
+        self._controller = controller
+
+    def _send_commands(self, payloads: List[dict]):
+        for payload in payloads:
+            self._controller.enqueue(payload)
@@ -0,0 +1,93 @@
+import timeit
+from types import SimpleNamespace
+from typing import List, Sequence
+
+from common.worker.base import Worker
+from common.worker.rabbitmq_worker import RabbitmqWorker
+from saga.codec import MessageCodec
+
+from .report import result
+
+MESSAGE = {
+    "command_id": "5f0c9a6e0d1f4c2e9b7a3c1d2e4f6a8b",
+    "account_id": "74a35cae933a4e4892d7d49543867ef8",
+    "amount": "10000",
+}
+
+
+class _Channel:
+    # accepts what RabbitmqWorker does to its channel and drops it
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class _Connection:
+    def channel(self):
+        return _Channel()
+
+
+def _register(worker: Worker, message_types: int):
+    for index in range(message_types):
+        worker.register_callback(f"type_{index}", lambda message: None)
+
+
+def dispatch(message_types: int, number: int) -> dict:
+    # Worker.handle_message looking up and calling a callback that does nothing
+    worker = Worker()
+    _register(worker, message_types)
+    message = dict(MESSAGE, type=f"type_{message_types - 1}")
+    seconds = timeit.timeit(lambda: worker.handle_message(message), number=number)
+    return result(
+        "worker_dispatch",
+        {"message_types": message_types, "number": number},
+        {
+            "dispatch_ns": seconds / number * 1e9,
+            "dispatches_per_second": number / seconds,
+        },
+    )
+
+
+def consume(message_types: int, number: int) -> dict:
+    # what a delivery costs RabbitmqWorker on the consumer thread: decoding,
+    # dispatching and acking, without the broker
+    worker = RabbitmqWorker(_Connection(), "exchange", "queue")
+    _register(worker, message_types)
+    codec = MessageCodec()
+    body, content_type, content_encoding = codec.encode(
+        dict(MESSAGE, type=f"type_{message_types - 1}")
+    )
+    channel = _Channel()
+    method = SimpleNamespace(delivery_tag=1, redelivered=False, routing_key="queue")
+    properties = SimpleNamespace(
+        content_type=content_type, content_encoding=content_encoding, headers=None
+    )
+    seconds = timeit.timeit(
+        lambda: worker._callback(channel, method, properties, body), number=number
+    )
+    return result(
+        "worker_consume",
+        {"message_types": message_types, "number": number},
+        {
+            "consume_ns": seconds / number * 1e9,
+            "messages_per_second": number / seconds,
+        },
+    )
+
+
+def run(message_types: Sequence[int] = (1, 100), number: int = 200000) -> List[dict]:
+    results = []
+    for count in message_types:
+        results.append(dispatch(count, number))
+        results.append(consume(count, number))
+    return results
+
+
+def main():
+    print(f"{'benchmark':<18}{'types':>7}{'ns/message':>12}")
+    for r in run():
+        ns = r["metrics"].get("dispatch_ns") or r["metrics"]["consume_ns"]
+        print(f"{r['benchmark']:<18}{r['params']['message_types']:>7}{ns:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import json
+import os
+import tempfile
+
+
+def write_json_atomic(file_name: str, data: dict, sync: bool = False):
+    # readers in other processes see either the old or the new file, never a
+    # truncated one
+    fd, tmp_name = tempfile.mkstemp(
+        dir=os.path.dirname(file_name) or ".", prefix=".", suffix=".tmp"
+    )
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_name, file_name)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
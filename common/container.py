@@ -0,0 +1,46 @@
+import threading
+from typing import Any, Callable, Optional
+
+
+def close_resource(resource: Any):
+    close = getattr(resource, "close", None)
+    if close:
+        close()
+
+
+class Container:
+    def __init__(self):
+        self._providers = {}
+        self._closers = {}
+        self._instances = {}
+        self._created = []
+        # providers may resolve their own dependencies through get()
+        self._lock = threading.RLock()
+
+    def register(
+        self,
+        name: str,
+        factory: Callable[["Container"], Any],
+        close: Optional[Callable[[Any], None]] = None,
+    ):
+        self._providers[name] = factory
+        self._closers[name] = close
+
+    def get(self, name: str) -> Any:
+        with self._lock:
+            if name not in self._instances:
+                if name not in self._providers:
+                    raise LookupError(f"No provider registered for {name}")
+                self._instances[name] = self._providers[name](self)
+                self._created.append(name)
+            return self._instances[name]
+
+    def close(self):
+        with self._lock:
+            # dependents are closed before the things they depend on
+            for name in reversed(self._created):
+                close = self._closers.get(name)
+                if close:
+                    close(self._instances[name])
+            self._instances = {}
+            self._created = []
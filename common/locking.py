@@ -0,0 +1,38 @@
+import fcntl
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Optional
+
+
+class StripedLock:
+    def __init__(self, path: Optional[str] = None, stripes: int = 1024):
+        self._stripes = stripes
+        self._thread_locks = [threading.Lock() for _ in range(stripes)]
+        # without a path the lock only guards threads of this process
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644) if path else None
+
+    def _stripe(self, key: str) -> int:
+        # crc32 rather than hash() so every process picks the same stripe
+        return zlib.crc32(key.encode()) % self._stripes
+
+    @contextmanager
+    def lock(self, key: str):
+        stripe = self._stripe(key)
+        # fcntl locks belong to the process, so threads queue up on their own
+        # lock first and only one of them holds the byte range at a time
+        with self._thread_locks[stripe]:
+            if self._fd is None:
+                yield
+                return
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
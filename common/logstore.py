@@ -0,0 +1,352 @@
+import fcntl
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# crc32, key length, value length (-1 marks a deleted key)
+_RECORD_HEADER = struct.Struct(">IIi")
+# key length, value offset, value length
+_HINT_ENTRY = struct.Struct(">IQi")
+# size of the segment the hint file was written for
+_HINT_HEADER = struct.Struct(">Q")
+_TOMBSTONE = -1
+
+
+def _segment_name(segment_id: int) -> str:
+    return f"{segment_id:010d}.log"
+
+
+def _hint_name(segment_id: int) -> str:
+    return f"{segment_id:010d}.hint"
+
+
+def _encode_record(key: bytes, value: Optional[bytes]) -> bytes:
+    value_len = _TOMBSTONE if value is None else len(value)
+    body = key + (value or b"")
+    crc = zlib.crc32(struct.pack(">Ii", len(key), value_len) + body)
+    return _RECORD_HEADER.pack(crc, len(key), value_len) + body
+
+
+class LogStore:
+    def __init__(
+        self,
+        folder: str,
+        max_segment_size: int = 64 * 1024 * 1024,
+        sync: bool = False,
+        compaction_interval: Optional[float] = None,
+        compaction_threshold: int = 4,
+    ):
+        self.folder = folder
+        self._max_segment_size = max_segment_size
+        self._sync = sync
+        self._compaction_threshold = compaction_threshold
+        # key -> (segment id, value offset, value length)
+        self._index: Dict[str, Tuple[int, int, int]] = {}
+        # key -> segment holding its latest tombstone
+        self._deleted: Dict[str, int] = {}
+        self._readers: Dict[int, int] = {}
+        self._lock = threading.RLock()
+        self._compaction_lock = threading.Lock()
+        self._closed = threading.Event()
+
+        os.makedirs(folder, exist_ok=True)
+        # the index lives in memory, so only one process may own the folder
+        self._lock_file = open(os.path.join(folder, "LOCK"), "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RuntimeError(f"Log store {folder} is used by another process")
+
+        for name in os.listdir(folder):
+            if ".compact" in name:
+                # left behind by a compaction that did not finish
+                os.remove(self._path(name))
+        segment_ids = self._list_segments()
+        entries = []
+        for segment_id in segment_ids:
+            entries = self._load_segment(
+                segment_id, is_last=segment_id == segment_ids[-1]
+            )
+        self._open_active(segment_ids[-1] if segment_ids else 1, entries)
+        if self._active_size >= self._max_segment_size:
+            self._rotate()
+
+        self._compaction_thread = None
+        if compaction_interval:
+            self._compaction_thread = threading.Thread(
+                target=self._compact_periodically,
+                args=(compaction_interval,),
+                daemon=True,
+            )
+            self._compaction_thread.start()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.folder, name)
+
+    def _list_segments(self) -> List[int]:
+        return sorted(
+            int(name[:-4]) for name in os.listdir(self.folder) if name.endswith(".log")
+        )
+
+    def _apply(self, key: str, segment_id: int, offset: int, value_len: int):
+        if value_len == _TOMBSTONE:
+            self._index.pop(key, None)
+            self._deleted[key] = segment_id
+        else:
+            self._index[key] = (segment_id, offset, value_len)
+            self._deleted.pop(key, None)
+
+    def _load_segment(self, segment_id: int, is_last: bool) -> List[tuple]:
+        path = self._path(_segment_name(segment_id))
+        size = os.path.getsize(path)
+        if not is_last and self._load_hint(segment_id, size):
+            self._readers[segment_id] = os.open(path, os.O_RDONLY)
+            return []
+        with open(path, "rb") as f:
+            data = f.read()
+        entries = []
+        offset = 0
+        while offset + _RECORD_HEADER.size <= len(data):
+            crc, key_len, value_len = _RECORD_HEADER.unpack_from(data, offset)
+            body_start = offset + _RECORD_HEADER.size
+            end = body_start + key_len + max(value_len, 0)
+            if end > len(data):
+                break
+            if crc != zlib.crc32(data[offset + 4 : end]):
+                break
+            key = data[body_start : body_start + key_len].decode()
+            self._apply(key, segment_id, body_start + key_len, value_len)
+            entries.append((key, body_start + key_len, value_len))
+            offset = end
+        if offset != len(data):
+            # a write torn by a crash; everything after it is unusable
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+        self._readers[segment_id] = os.open(path, os.O_RDONLY)
+        return entries
+
+    def _load_hint(self, segment_id: int, segment_size: int) -> bool:
+        try:
+            with open(self._path(_hint_name(segment_id)), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return False
+        if len(data) < _HINT_HEADER.size:
+            return False
+        (hinted_size,) = _HINT_HEADER.unpack_from(data, 0)
+        if hinted_size != segment_size:
+            return False
+        offset = _HINT_HEADER.size
+        while offset < len(data):
+            key_len, value_offset, value_len = _HINT_ENTRY.unpack_from(data, offset)
+            offset += _HINT_ENTRY.size
+            key = data[offset : offset + key_len].decode()
+            offset += key_len
+            self._apply(key, segment_id, value_offset, value_len)
+        return True
+
+    def _write_hint(self, path: str, segment_size: int, entries: Iterable[tuple]):
+        chunks = [_HINT_HEADER.pack(segment_size)]
+        for key, value_offset, value_len in entries:
+            encoded = key.encode()
+            chunks.append(_HINT_ENTRY.pack(len(encoded), value_offset, value_len))
+            chunks.append(encoded)
+        with open(path, "wb") as f:
+            f.write(b"".join(chunks))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _open_active(self, segment_id: int, entries: Optional[List[tuple]] = None):
+        path = self._path(_segment_name(segment_id))
+        self._active_id = segment_id
+        self._active_fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._active_size = os.fstat(self._active_fd).st_size
+        # what the hint file of this segment will contain once it is sealed
+        self._active_entries = entries or []
+        if segment_id not in self._readers:
+            self._readers[segment_id] = os.open(path, os.O_RDONLY)
+
+    def _rotate(self):
+        os.fsync(self._active_fd)
+        os.close(self._active_fd)
+        # sealed segments never change, a hint file lets restarts skip scanning
+        self._write_hint(
+            self._path(_hint_name(self._active_id)),
+            self._active_size,
+            self._active_entries,
+        )
+        self._open_active(self._active_id + 1)
+
+    def _append(self, items: List[Tuple[str, Optional[bytes]]]):
+        records = []
+        positions = []
+        offset = self._active_size
+        for key, value in items:
+            encoded = key.encode()
+            record = _encode_record(encoded, value)
+            value_offset = offset + _RECORD_HEADER.size + len(encoded)
+            positions.append(
+                (key, value_offset, _TOMBSTONE if value is None else len(value))
+            )
+            records.append(record)
+            offset += len(record)
+        data = memoryview(b"".join(records))
+        while data:
+            data = data[os.write(self._active_fd, data) :]
+        if self._sync:
+            os.fsync(self._active_fd)
+        self._active_size = offset
+        for key, value_offset, value_len in positions:
+            self._apply(key, self._active_id, value_offset, value_len)
+            self._active_entries.append((key, value_offset, value_len))
+        if self._active_size >= self._max_segment_size:
+            self._rotate()
+
+    def put(self, key: str, value: bytes):
+        with self._lock:
+            self._append([(key, value)])
+
+    def put_many(self, items: Iterable[Tuple[str, bytes]]):
+        # one sequential write for the whole batch
+        items = list(items)
+        if not items:
+            return
+        with self._lock:
+            self._append(items)
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._index:
+                self._append([(key, None)])
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            location = self._index.get(key)
+            if location is None:
+                return None
+            segment_id, offset, length = location
+            return os.pread(self._readers[segment_id], length, offset)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._index)
+
+    def compact(self):
+        with self._compaction_lock:
+            with self._lock:
+                sealed = [i for i in sorted(self._readers) if i != self._active_id]
+                if len(sealed) < 2:
+                    return
+                sealed_set = set(sealed)
+                live = [
+                    (key, location)
+                    for key, location in self._index.items()
+                    if location[0] in sealed_set
+                ]
+                deleted = [
+                    key
+                    for key, segment_id in self._deleted.items()
+                    if segment_id in sealed_set
+                ]
+                readers = {i: self._readers[i] for i in sealed}
+
+            # sealed segments are immutable, so they are copied without the lock
+            outputs = []
+            records, entries, size = [], [], 0
+
+            def add(key: str, value: Optional[bytes]):
+                nonlocal records, entries, size
+                encoded = key.encode()
+                record = _encode_record(encoded, value)
+                value_len = _TOMBSTONE if value is None else len(value)
+                entries.append(
+                    (key, size + _RECORD_HEADER.size + len(encoded), value_len)
+                )
+                records.append(record)
+                size += len(record)
+                # never produce more segments than are being replaced
+                if size >= self._max_segment_size and len(outputs) < len(sealed) - 1:
+                    outputs.append((records, entries, size))
+                    records, entries, size = [], [], 0
+
+            for key, (segment_id, offset, length) in live:
+                add(key, os.pread(readers[segment_id], length, offset))
+            # tombstones are kept so older copies of a key cannot come back if
+            # the swap below is interrupted
+            for key in deleted:
+                add(key, None)
+            if records or not outputs:
+                outputs.append((records, entries, size))
+
+            # merged data takes over the newest sealed ids so it still replays
+            # before anything written to later segments
+            targets = sealed[-len(outputs) :]
+            for target, (records, entries, size) in zip(targets, outputs):
+                tmp = self._path(_segment_name(target) + ".compact")
+                with open(tmp, "wb") as f:
+                    f.write(b"".join(records))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._write_hint(tmp + ".hint", size, entries)
+
+            with self._lock:
+                moved = {}
+                for target, (records, entries, size) in zip(targets, outputs):
+                    tmp = self._path(_segment_name(target) + ".compact")
+                    hint = self._path(_hint_name(target))
+                    if os.path.exists(hint):
+                        os.remove(hint)
+                    os.replace(tmp, self._path(_segment_name(target)))
+                    os.replace(tmp + ".hint", hint)
+                    for key, value_offset, value_len in entries:
+                        moved[key] = (target, value_offset, value_len)
+                for key, location in live:
+                    # keys rewritten while compacting keep their newer location
+                    if self._index.get(key) == location:
+                        self._index[key] = moved[key]
+                for key in deleted:
+                    if key in self._deleted and self._deleted[key] in sealed_set:
+                        self._deleted[key] = moved[key][0]
+                for segment_id in sealed:
+                    os.close(self._readers.pop(segment_id))
+                for segment_id in sealed:
+                    if segment_id in targets:
+                        self._readers[segment_id] = os.open(
+                            self._path(_segment_name(segment_id)), os.O_RDONLY
+                        )
+                    else:
+                        os.remove(self._path(_segment_name(segment_id)))
+                        hint = self._path(_hint_name(segment_id))
+                        if os.path.exists(hint):
+                            os.remove(hint)
+
+    def _compact_periodically(self, interval: float):
+        while not self._closed.wait(interval):
+            with self._lock:
+                sealed = len(self._readers) - 1
+            if sealed >= self._compaction_threshold:
+                self.compact()
+
+    def close(self):
+        self._closed.set()
+        if self._compaction_thread:
+            self._compaction_thread.join()
+        with self._lock:
+            if self._active_fd is None:
+                return
+            os.fsync(self._active_fd)
+            os.close(self._active_fd)
+            self._active_fd = None
+            for fd in self._readers.values():
+                os.close(fd)
+            self._readers = {}
+            self._lock_file.close()
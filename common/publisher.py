@@ -1,19 +1,88 @@
-import json
+import threading
+from typing import List, Optional
+
 import pika
+from saga.codec import MessageCodec
+from saga.metrics import sent_at_headers
 
 
 class RabbitMQPublisher:
-    def __init__(self, connection: pika.BlockingConnection):
+    def __init__(
+        self, connection: pika.BlockingConnection, codec: Optional[MessageCodec] = None
+    ):
         self._connection = connection
-        self._channel = connection.channel()
+        self._codec = codec or MessageCodec()
+        self._channel = None
+        self._declared = set()
+        # handlers may publish from worker threads, pika channels are not
+        # thread safe
+        self._lock = threading.Lock()
 
-    def publish(self, message: dict, exchange: str, queue: str):
-        self._channel.exchange_declare(exchange=exchange, exchange_type="direct")
-        self._channel.queue_declare(queue=queue)
-        self._channel.queue_bind(exchange=exchange, queue=queue, routing_key=queue)
-        self._channel.basic_publish(
-            exchange=exchange, routing_key=queue, body=json.dumps(message)
+    def _get_channel(self):
+        if self._channel is None or self._channel.is_closed:
+            self._channel = self._connection.channel()
+            # declarations are only remembered for the channel that made them
+            self._declared = set()
+        return self._channel
+
+    def _declare(self, channel, exchange: str, queue: str):
+        if (exchange, queue) in self._declared:
+            return
+        channel.exchange_declare(exchange=exchange, exchange_type="direct")
+        channel.queue_declare(queue=queue)
+        channel.queue_bind(exchange=exchange, queue=queue, routing_key=queue)
+        self._declared.add((exchange, queue))
+
+    def _encode(self, message: dict):
+        body, content_type, content_encoding = self._codec.encode(message)
+        properties = pika.BasicProperties(
+            content_type=content_type,
+            content_encoding=content_encoding,
+            headers=sent_at_headers(),
         )
+        return body, properties
+
+    def publish(self, message: dict, exchange: str, queue: str):
+        body, properties = self._encode(message)
+        with self._lock:
+            channel = self._get_channel()
+            self._declare(channel, exchange, queue)
+            channel.basic_publish(
+                exchange=exchange, routing_key=queue, body=body, properties=properties
+            )
         print(" [x] Sent %r" % message)
-        self._channel.close()
         return True
+
+    def publish_many(self, messages: List[dict], exchange: str, queue: str):
+        encoded = [self._encode(message) for message in messages]
+        with self._lock:
+            channel = self._get_channel()
+            self._declare(channel, exchange, queue)
+            for body, properties in encoded:
+                channel.basic_publish(
+                    exchange=exchange,
+                    routing_key=queue,
+                    body=body,
+                    properties=properties,
+                )
+        print(" [x] Sent %d messages" % len(messages))
+        return True
+
+    def close(self):
+        with self._lock:
+            if self._channel is not None and self._channel.is_open:
+                self._channel.close()
+            self._channel = None
+
+
+def register_publisher(container, amqp_uri: str, codec: Optional[MessageCodec] = None):
+    container.register(
+        "publisher_connection",
+        lambda c: pika.BlockingConnection(pika.URLParameters(amqp_uri)),
+        close=lambda connection: connection.close(),
+    )
+    container.register(
+        "publisher",
+        lambda c: RabbitMQPublisher(c.get("publisher_connection"), codec),
+        close=lambda publisher: publisher.close(),
+    )
@@ -1,10 +1,23 @@
+from typing import Optional
+
+from common.container import Container
+
+
 class Worker:
-    def __init__(self):
+    def __init__(self, container: Optional[Container] = None):
         self.callbacks = {}
+        self.batch_callbacks = {}
+        self.container = container or Container()
 
     def register_callback(self, message_type, callback):
         self.callbacks[message_type] = callback
 
+    def register_batch_callback(self, message_types, callback):
+        # the callback receives a list of messages of any of these types, in
+        # the order they arrived
+        for message_type in message_types:
+            self.batch_callbacks[message_type] = callback
+
     def handle_message(self, message):
         message_type = message.get("type")
         if message_type in self.callbacks:
@@ -14,3 +27,6 @@ class Worker:
 
     def start(self):
         raise NotImplementedError()
+
+    def close(self):
+        self.container.close()
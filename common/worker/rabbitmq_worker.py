@@ -1,13 +1,37 @@
-import json
+import functools
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 import pika
+from common.container import Container
 from common.worker.base import Worker
+from saga.codec import MessageCodec
+from saga.idempotency import IdempotencyGuard, message_key
+from saga.metrics import WorkerMetrics
 
 
 class RabbitmqWorker(Worker):
-    def __init__(self, connection: pika.BlockingConnection, exchange: str, queue: str):
+    def __init__(
+        self,
+        connection: pika.BlockingConnection,
+        exchange: str,
+        queue: str,
+        prefetch_count: int = 1,
+        max_workers: int = 0,
+        ordering_key: Optional[str] = None,
+        container: Optional[Container] = None,
+        batch_size: int = 100,
+        batch_interval: float = 0.01,
+        codec: Optional[MessageCodec] = None,
+        idempotency_guard: Optional[IdempotencyGuard] = None,
+        metrics: Optional[WorkerMetrics] = None,
+    ):
 
-        super().__init__()
+        super().__init__(container)
 
         self._connection = connection
         self._channel = connection.channel()
@@ -16,14 +40,170 @@ class RabbitmqWorker(Worker):
         self._channel.exchange_declare(exchange=exchange, exchange_type="direct")
         self._channel.queue_declare(queue=self._queue)
         self._channel.queue_bind(exchange=exchange, queue=self._queue, routing_key=queue)
+        # messages whose handler raised are parked here instead of being lost
+        self._dead_letter_queue = f"{queue}.dead"
+        self._channel.queue_declare(queue=self._dead_letter_queue)
+
+        self._prefetch_count = prefetch_count
+        # with max_workers=0 messages are handled on the consumer thread
+        self._executor = ThreadPoolExecutor(max_workers) if max_workers else None
+        # messages sharing the same value of this field are handled one at a time
+        self._ordering_key = ordering_key
+        self._lock = threading.Lock()
+        self._waiting = {}
+        self._batch_size = batch_size
+        self._batch_interval = batch_interval
+        self._batches = {}
+        self._batch_timer = None
+        self._codec = codec or MessageCodec()
+        self._idempotency_guard = idempotency_guard
+        self._metrics = metrics
 
     def start(self):
         # graceful shutdown of the worker
-        self._channel.basic_qos(prefetch_count=1)
+        self._channel.basic_qos(prefetch_count=self._prefetch_count)
         self._channel.basic_consume(self._queue, self._callback)
-        self._channel.start_consuming()
+        try:
+            self._channel.start_consuming()
+        finally:
+            if self._executor:
+                self._executor.shutdown(wait=True)
+            if self._connection.is_open:
+                self._flush_batches()
+                # acks scheduled by the pool run with the connection's events
+                self._connection.process_data_events(time_limit=0)
+            self.close()
 
     def _callback(self, ch, method, properties, body):
-        message = json.loads(body)
-        self.handle_message(message)
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        if self._metrics is not None:
+            self._metrics.consumed(method.routing_key, properties.headers)
+        message = self._codec.decode(
+            body, properties.content_type, properties.content_encoding
+        )
+        if self._idempotency_guard is not None:
+            key = message_key(message)
+            if self._idempotency_guard.seen(key, method.redelivered):
+                if self._metrics is not None:
+                    self._metrics.duplicates.inc((method.routing_key,))
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
+        batch_callback = self.batch_callbacks.get(message.get("type"))
+        if batch_callback is not None:
+            self._add_to_batch(batch_callback, message, method.delivery_tag)
+            return
+        if self._executor is None:
+            self._process(message, method.delivery_tag)
+            return
+
+        key = message.get(self._ordering_key) if self._ordering_key else None
+        if key is not None:
+            with self._lock:
+                if key in self._waiting:
+                    self._waiting[key].append((message, method.delivery_tag))
+                    return
+                self._waiting[key] = deque()
+        self._executor.submit(self._run, key, message, method.delivery_tag)
+
+    def _run(self, key, message, delivery_tag):
+        # keeps draining messages queued behind this one for the same key
+        while True:
+            self._process(message, delivery_tag)
+            if key is None:
+                return
+            with self._lock:
+                waiting = self._waiting[key]
+                if not waiting:
+                    del self._waiting[key]
+                    return
+                message, delivery_tag = waiting.popleft()
+
+    def _process(self, message, delivery_tag):
+        try:
+            self._handle(message)
+        except Exception as e:
+            traceback.print_exc()
+            settle = functools.partial(self._dead_letter, [(message, delivery_tag)], e)
+        else:
+            self._record_handled(message)
+            settle = functools.partial(
+                self._channel.basic_ack, delivery_tag=delivery_tag
+            )
+        if self._executor is None:
+            settle()
+            return
+        # the channel belongs to the consumer thread
+        self._connection.add_callback_threadsafe(settle)
+
+    def _dead_letter(self, batch, error: Exception):
+        # the same in both modes: the message is moved to the dead letter
+        # queue with the error and acked, the consumer goes on
+        for message, delivery_tag in batch:
+            body, content_type, content_encoding = self._codec.encode(message)
+            properties = pika.BasicProperties(
+                content_type=content_type,
+                content_encoding=content_encoding,
+                headers={"x-error-type": type(error).__name__, "x-error": str(error)},
+            )
+            self._channel.basic_publish(
+                exchange="",
+                routing_key=self._dead_letter_queue,
+                body=body,
+                properties=properties,
+            )
+            self._channel.basic_ack(delivery_tag=delivery_tag)
+
+    def _handle(self, message):
+        self._measure(self.handle_message, message, [message])
+
+    def _handle_batch(self, callback, messages):
+        self._measure(callback, messages, messages)
+
+    def _measure(self, function, argument, messages):
+        if self._metrics is None:
+            function(argument)
+            return
+        self._metrics.in_flight.inc(amount=len(messages))
+        outcome = "failed"
+        start = time.perf_counter()
+        try:
+            function(argument)
+            outcome = "succeeded"
+        finally:
+            self._metrics.in_flight.dec(amount=len(messages))
+            self._metrics.handled(
+                [message.get("type") for message in messages],
+                outcome,
+                time.perf_counter() - start,
+            )
+
+    def _add_to_batch(self, callback, message, delivery_tag):
+        # batches collect whatever has been prefetched and are handled on the
+        # consumer thread, one after another
+        batch = self._batches.setdefault(callback, [])
+        batch.append((message, delivery_tag))
+        if len(batch) >= self._batch_size:
+            self._flush_batches()
+        elif self._batch_timer is None:
+            self._batch_timer = self._connection.call_later(
+                self._batch_interval, self._flush_batches
+            )
+
+    def _flush_batches(self):
+        if self._batch_timer is not None:
+            self._connection.remove_timeout(self._batch_timer)
+            self._batch_timer = None
+        batches, self._batches = self._batches, {}
+        for callback, batch in batches.items():
+            try:
+                self._handle_batch(callback, [message for message, _ in batch])
+            except Exception as e:
+                traceback.print_exc()
+                self._dead_letter(batch, e)
+                continue
+            for message, delivery_tag in batch:
+                self._record_handled(message)
+                self._channel.basic_ack(delivery_tag=delivery_tag)
+
+    def _record_handled(self, message):
+        if self._idempotency_guard is not None:
+            self._idempotency_guard.record(message_key(message))
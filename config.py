@@ -1,4 +1,6 @@
 import os
+from typing import Optional
+
 import pydantic
 
 
@@ -7,17 +9,58 @@ class Settings(pydantic.BaseSettings):
     account_worker_exchange: str = "account_management"
     account_worker_queue: str
     account_database_folder: str
+    account_database_backend: str = "json"
+    account_cache_size: int = 0
+    account_database_sync: bool = False
+    account_lock_stripes: int = 1024
     account_withdraw_response_exchange: str
     account_withdraw_response_queue: str
+    account_worker_prefetch_count: int = 1
+    account_worker_concurrency: int = 0
+    # port of the worker's /metrics listener, 0 turns it off
+    account_worker_metrics_port: int = 0
+    account_worker_batch_size: int = 0
 
     subscription_database_folder: str
+    subscription_database_backend: str = "json"
+    subscription_cache_size: int = 0
     subscription_worker_amqp_uri: str
     subscription_worker_exchange: str = "subscription_management"
     subscription_worker_queue: str
+    subscription_worker_prefetch_count: int = 1
+    subscription_worker_concurrency: int = 0
+    subscription_worker_metrics_port: int = 0
+
+    # the log backend keeps its index in the memory of the one process that
+    # opens the folder, while api.py and the workers each open it. it does not
+    # work in the usual deployment of separate processes and can only be
+    # chosen for one that runs them in a single process, see README.rst
+    log_store_single_process: bool = False
+    log_store_compaction_interval: float = 60.0
+
+    message_codec: str = "json"
+    message_compress_threshold: int = 0
+
+    # 0 turns the idempotency guard off
+    idempotency_capacity: int = 0
+    idempotency_redis_url: Optional[str] = None
 
     saga_amqp_uri: str
     saga_exchange: str = "saga"
     saga_queue: str
+    # port of the saga controller's /metrics listener, 0 turns it off
+    saga_controller_metrics_port: int = 0
+
+    @pydantic.root_validator(skip_on_failure=True)
+    def check_log_store_owner(cls, values):
+        for backend in ("account_database_backend", "subscription_database_backend"):
+            if values[backend] == "log" and not values["log_store_single_process"]:
+                raise ValueError(
+                    f"{backend}=log needs a single process owning the database "
+                    "folder, the api and the worker would both open it; set "
+                    "log_store_single_process if that is the case"
+                )
+        return values
 
 
 if os.getenv("DEBUG", "0") == "1":
@@ -0,0 +1,424 @@
+import asyncio
+import contextvars
+import inspect
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from .codec import MessageCodec
+from .idempotency import IdempotencyGuard, message_key
+from .metrics import SagaMetrics, sent_at_headers
+from .tracing import SagaTracer
+from .saga import (
+    SagaExecutionController,
+    SagaStateRepository,
+    SagaStep,
+    StepTimeoutError,
+    _sent,
+    encode_command,
+)
+
+try:
+    import aio_pika
+except ImportError:
+    aio_pika = None
+
+
+# publishes produced while handling one message, awaited before it is acked
+_outbox = contextvars.ContextVar("outbox")
+
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+class AsyncSagaExecutionController(SagaExecutionController):
+    def __init__(
+        self,
+        saga_state_repository: SagaStateRepository,
+        inline_local_steps: bool = False,
+        max_in_flight: int = 256,
+        claim_check=None,
+        journal=None,
+        metrics: Optional[SagaMetrics] = None,
+        tracer: Optional[SagaTracer] = None,
+        offload_repository: bool = True,
+        timeout_workers: int = 4,
+    ):
+        super().__init__(
+            saga_state_repository,
+            inline_local_steps,
+            claim_check,
+            journal,
+            metrics,
+            tracer,
+            timeout_workers,
+        )
+        self._max_in_flight = max_in_flight
+        # repository, journal and claim check calls may block on storage and
+        # run in the loop's executor; repositories that never block, such as
+        # a SagaWatcher alone, can be called on the loop instead
+        self._offload_repository = offload_repository
+        self._in_flight = None
+        self._tasks = set()
+
+    async def _send_next_step_command(self, payload):
+        raise NotImplementedError()
+
+    async def _send_compensation_command(self, payload):
+        raise NotImplementedError()
+
+    async def _send_delayed_command(self, payload, delay: float):
+        raise NotImplementedError()
+
+    async def _blocking(self, function, *args):
+        if not self._offload_repository:
+            return function(*args)
+        # the copied context carries the outbox of the message being handled
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            None, context.run, function, *args
+        )
+
+    def _forward_delayed(self, payload, delay: float):
+        _outbox.get().append(
+            self._send_delayed_command(self._prepare_command(payload, delay), delay)
+        )
+
+    def _dispatch(self, send, *args):
+        _outbox.get().append(send(*args))
+
+    async def _execute(self, step: SagaStep, function, message):
+        if not step.timeout:
+            return await _maybe_await(function(message))
+        if inspect.iscoroutinefunction(function):
+            call = function(message)
+        else:
+            # a blocking function would hold up the loop and the timeout with it.
+            # it gets its own timeout_workers threads: a step that hangs keeps
+            # its thread, and must not take those of the repository calls
+            if self._timeout_executor is None:
+                self._timeout_executor = ThreadPoolExecutor(self._timeout_workers)
+            call = asyncio.get_running_loop().run_in_executor(
+                self._timeout_executor, function, message
+            )
+        try:
+            return await asyncio.wait_for(call, step.timeout)
+        except asyncio.TimeoutError:
+            raise StepTimeoutError(
+                f"[{message['saga_id']}]Step {step.name} timed out after "
+                f"{step.timeout}s"
+            )
+
+    async def _run_step(self, step: SagaStep, function, message):
+        if self._metrics is None and self._tracer is None:
+            return await self._execute(step, function, message)
+        self._step_started(message)
+        outcome = "failed"
+        start = time.perf_counter()
+        try:
+            result = await self._execute(step, function, message)
+            outcome = "succeeded"
+            return result
+        finally:
+            self._step_finished(step, message, outcome, start)
+
+    def _forward_step(self, step: SagaStep, payload, send) -> List[dict]:
+        if self._inline_local_steps and not step.remote:
+            return [payload]
+        _outbox.get().append(send(self._prepare_command(payload)))
+        return []
+
+    async def _run_action_command(self, step: SagaStep, message):
+        await self._blocking(
+            self._state_repository.action_started, message["saga_id"], step.name
+        )
+        try:
+            result = await self._run_step(step, step.action, message)
+        except Exception as e:
+            return await self._blocking(self._action_failed, step, message, e)
+        else:
+            return await self._blocking(self._action_succeeded, step, message, result)
+
+    async def _run_compensation_command(self, step: SagaStep, message):
+        await self._blocking(
+            self._state_repository.compensation_started, message["saga_id"], step.name
+        )
+        try:
+            result = await self._run_step(step, step.compensation, message)
+        except Exception as e:
+            return await self._blocking(self._compensation_failed, step, message, e)
+        else:
+            return await self._blocking(
+                self._compensation_succeeded, step, message, result
+            )
+
+    async def _handle_step_message(self, message) -> List[dict]:
+        if self._claim_check is not None:
+            message = self._claim_check.wrap(message)
+        step = self._get_step(message)
+        if self._journal is None:
+            return await self._run_command(step, message)
+        # see SagaExecutionController._handle_step_message
+        sent = await self._blocking(self._journal.replay, message)
+        if sent is not None:
+            return self._resend(sent)
+        sent = []
+        token = _sent.set(sent)
+        try:
+            forwarded = await self._run_command(step, message)
+        finally:
+            _sent.reset(token)
+        inline = [{"command": m, "inline": True} for m in forwarded]
+        await self._blocking(self._journal.command_handled, message, sent + inline)
+        return forwarded
+
+    async def _run_command(self, step: SagaStep, message) -> List[dict]:
+        step_type = message["step_type"]
+        if step_type == "action":
+            return await self._run_action_command(step, message)
+        elif step_type == "compensation":
+            return await self._run_compensation_command(step, message)
+        else:
+            raise ValueError(f"[{message['saga_id']}]Unknown step type {step_type}")
+
+    async def _handle_message(self, message) -> List[dict]:
+        outbox = []
+        handled = []
+        token = _outbox.set(outbox)
+        try:
+            pending = [message]
+            while pending:
+                handled.extend(pending)
+                results = await asyncio.gather(
+                    *(self._handle_step_message(m) for m in pending)
+                )
+                pending = [m for result in results for m in result]
+        except Exception:
+            for publish in outbox:
+                publish.close()
+            raise
+        else:
+            if outbox:
+                await self._blocking(self._state_repository.flush)
+                await asyncio.gather(*outbox)
+        finally:
+            _outbox.reset(token)
+        return handled
+
+    async def submit(self, message, on_done=None):
+        # waits while max_in_flight messages are being handled, then handles the
+        # message in its own task
+        if self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(self._max_in_flight)
+        await self._in_flight.acquire()
+        task = asyncio.create_task(self._process(message, on_done))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _process(self, message, on_done):
+        # on_done settles the delivery of the message, e.g. acks it
+        error = None
+        handled = []
+        try:
+            handled = await self._handle_message(message)
+        except Exception as e:
+            error = e
+            traceback.print_exc()
+        finally:
+            self._in_flight.release()
+        if on_done:
+            await _maybe_await(on_done(error))
+        if error is None:
+            self._settled(handled)
+
+    async def join(self):
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def run(self):
+        raise NotImplementedError()
+
+
+class AioPikaSagaExecutionController(AsyncSagaExecutionController):
+    def __init__(
+        self,
+        saga_state_repository: SagaStateRepository,
+        rabbitmq_connection: "aio_pika.abc.AbstractConnection",
+        exchange: str,
+        queue: str,
+        inline_local_steps: bool = False,
+        max_in_flight: int = 256,
+        codec: Optional[MessageCodec] = None,
+        claim_check=None,
+        idempotency_guard: Optional[IdempotencyGuard] = None,
+        journal=None,
+        metrics: Optional[SagaMetrics] = None,
+        tracer: Optional[SagaTracer] = None,
+        offload_repository: bool = True,
+        timeout_workers: int = 4,
+    ):
+        if aio_pika is None:
+            raise RuntimeError(
+                "aio-pika is required for AioPikaSagaExecutionController, install the aio extra"
+            )
+        super().__init__(
+            saga_state_repository,
+            inline_local_steps,
+            max_in_flight,
+            claim_check,
+            journal,
+            metrics,
+            tracer,
+            offload_repository,
+            timeout_workers,
+        )
+        self._rabbitmq_connection = rabbitmq_connection
+        self._exchange_name = exchange
+        self._queue = queue
+        # commands whose handling raised are parked here instead of being lost
+        self._dead_letter_queue = f"{queue}.dead"
+        self._codec = codec or MessageCodec()
+        self._idempotency_guard = idempotency_guard
+        self._channel = None
+        self._exchange = None
+        self._delay_queues = set()
+
+    def _message(self, payload, expiration: Optional[float] = None):
+        body, content_type, content_encoding = encode_command(
+            self._codec, payload, self._claim_check
+        )
+        return aio_pika.Message(
+            body=body,
+            content_type=content_type,
+            content_encoding=content_encoding,
+            expiration=expiration,
+            headers=sent_at_headers(expiration or 0),
+        )
+
+    async def _timed_publish(
+        self,
+        exchange,
+        payload,
+        routing_key: str,
+        kind: str,
+        expiration: Optional[float] = None,
+    ):
+        if self._metrics is None and self._tracer is None:
+            await exchange.publish(
+                self._message(payload, expiration), routing_key=routing_key
+            )
+            return
+        saga_id = payload["saga_id"]
+        traced = self._tracer is not None and self._tracer.sampled(saga_id)
+        start = time.perf_counter()
+        message = self._message(payload, expiration)
+        published = time.perf_counter()
+        if traced:
+            self._tracer.record(
+                saga_id,
+                "encode",
+                "codec",
+                start,
+                published - start,
+                args={"bytes": len(message.body)},
+                flow_out=payload.get("trace"),
+            )
+        await exchange.publish(message, routing_key=routing_key)
+        elapsed = time.perf_counter() - published
+        if self._metrics is not None:
+            self._metrics.publish_seconds.observe(elapsed, (kind,))
+        if traced:
+            self._tracer.record(saga_id, "publish", "publish", published, elapsed)
+
+    async def _publish(self, payload):
+        await self._timed_publish(self._exchange, payload, self._queue, "command")
+
+    async def _send_delayed_command(self, payload, delay: float):
+        # same power of two delay buckets as RabbitMQSagaExecutionController
+        delay_ms = max(1, int(delay * 1000))
+        queue = f"{self._queue}.delay.{1 << (delay_ms - 1).bit_length()}"
+        if queue not in self._delay_queues:
+            await self._channel.declare_queue(
+                queue,
+                arguments={
+                    "x-dead-letter-exchange": self._exchange_name,
+                    "x-dead-letter-routing-key": self._queue,
+                },
+            )
+            self._delay_queues.add(queue)
+        await self._timed_publish(
+            self._channel.default_exchange,
+            payload,
+            queue,
+            "delayed",
+            expiration=delay_ms / 1000,
+        )
+
+    async def _send_next_step_command(self, payload):
+        await self._publish(payload)
+
+    async def _send_compensation_command(self, payload):
+        await self._publish(payload)
+
+    async def _callback(self, message: "aio_pika.abc.AbstractIncomingMessage"):
+        if self._metrics is not None:
+            self._metrics.consumed(message.routing_key, message.headers)
+        payload = self._codec.decode(
+            message.body, message.content_type, message.content_encoding
+        )
+        guard = self._idempotency_guard
+        key = message_key(payload) if guard else None
+        if key is not None and guard.seen(key, message.redelivered):
+            if self._metrics is not None:
+                self._metrics.duplicates.inc((message.routing_key,))
+            await message.ack()
+            return
+
+        async def settle(error):
+            if error is None:
+                if key is not None:
+                    guard.record(key)
+            else:
+                await self._dead_letter(message, error)
+            await message.ack()
+
+        await self.submit(payload, settle)
+
+    async def _dead_letter(
+        self, message: "aio_pika.abc.AbstractIncomingMessage", error: Exception
+    ):
+        # like the workers: the command is moved to the dead letter queue
+        # with the error, rather than rejected and dropped
+        await self._channel.default_exchange.publish(
+            aio_pika.Message(
+                body=message.body,
+                content_type=message.content_type,
+                content_encoding=message.content_encoding,
+                headers=dict(
+                    message.headers or {},
+                    **{"x-error-type": type(error).__name__, "x-error": str(error)},
+                ),
+            ),
+            routing_key=self._dead_letter_queue,
+        )
+
+    async def run(self):
+        channel = await self._rabbitmq_connection.channel()
+        await channel.set_qos(prefetch_count=self._max_in_flight)
+        self._channel = channel
+        self._exchange = await channel.declare_exchange(self._exchange_name)
+        queue = await channel.declare_queue(self._queue)
+        await queue.bind(self._exchange, routing_key=self._queue)
+        await channel.declare_queue(self._dead_letter_queue)
+        try:
+            async with queue.iterator() as messages:
+                async for message in messages:
+                    await self._callback(message)
+            await self.join()
+        finally:
+            self._shutdown()
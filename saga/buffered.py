@@ -0,0 +1,145 @@
+import threading
+import traceback
+from typing import Dict, Optional
+
+from .saga import SagaStateRepository
+
+
+class BufferedSagaStateRepository(SagaStateRepository):
+    def __init__(
+        self,
+        repository: SagaStateRepository,
+        max_batch_size: int = 512,
+        flush_interval: float = 0.01,
+    ):
+        self._repository = repository
+        self._max_batch_size = max_batch_size
+        self._condition = threading.Condition()
+        self._pending = []
+        # number of calls queued and written so far
+        self._queued = 0
+        self._written = 0
+        self._writing = False
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._flush_periodically, args=(flush_interval,), daemon=True
+        )
+        self._thread.start()
+
+    def _enqueue(self, name: str, *args):
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Saga state repository is closed")
+            self._pending.append((name, args))
+            self._queued += 1
+            if len(self._pending) >= self._max_batch_size:
+                self._condition.notify_all()
+
+    def _write_pending(self):
+        # must be called holding the condition; returns once every call queued
+        # before it has been written. whoever finds no write in progress writes
+        # everything queued so far, the others wait for it (group commit)
+        target = self._queued
+        while self._written < target:
+            if self._writing:
+                self._condition.wait()
+                continue
+            calls, self._pending = self._pending, []
+            self._writing = True
+            self._condition.release()
+            try:
+                with self._repository.batch():
+                    for name, args in calls:
+                        getattr(self._repository, name)(*args)
+                self._repository.flush()
+            except BaseException:
+                self._condition.acquire()
+                # retried by the next flush, part of it may be written twice
+                self._pending[:0] = calls
+                self._writing = False
+                self._condition.notify_all()
+                raise
+            self._condition.acquire()
+            self._written += len(calls)
+            self._writing = False
+            self._condition.notify_all()
+
+    def _flush_periodically(self, interval: float):
+        with self._condition:
+            while not self._closed:
+                self._condition.wait_for(
+                    lambda: self._closed or len(self._pending) >= self._max_batch_size,
+                    interval,
+                )
+                if not self._pending:
+                    continue
+                try:
+                    self._write_pending()
+                except Exception:
+                    traceback.print_exc()
+
+    def flush(self):
+        with self._condition:
+            self._write_pending()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self.flush()
+
+    def saga_started(self, saga_id: str, saga_name: str, step_name: str):
+        self._enqueue("saga_started", saga_id, saga_name, step_name)
+
+    def action_started(self, saga_id: str, step_name: str):
+        self._enqueue("action_started", saga_id, step_name)
+
+    def action_succeeded(self, saga_id: str, step_name: str):
+        self._enqueue("action_succeeded", saga_id, step_name)
+
+    def action_failed(self, saga_id: str, step_name: str, error_type: str, error: str):
+        self._enqueue("action_failed", saga_id, step_name, error_type, error)
+
+    def compensation_started(self, saga_id: str, step_name: str):
+        self._enqueue("compensation_started", saga_id, step_name)
+
+    def compensation_succeeded(self, saga_id: str, step_name: str):
+        self._enqueue("compensation_succeeded", saga_id, step_name)
+
+    def compensation_failed(
+        self, saga_id: str, step_name: str, error_type: str, error: str
+    ):
+        self._enqueue("compensation_failed", saga_id, step_name, error_type, error)
+
+    def saga_compensate_failed(
+        self, saga_id: str, step_name: str, error_type: str, error: str
+    ):
+        self._enqueue("saga_compensate_failed", saga_id, step_name, error_type, error)
+
+    def saga_completed(self, saga_id: str):
+        self._enqueue("saga_completed", saga_id)
+
+    def saga_failed(self, saga_id: str, step_name: str, error_type: str, error: str):
+        self._enqueue("saga_failed", saga_id, step_name, error_type, error)
+
+    def step_retried(
+        self,
+        saga_id: str,
+        step_name: str,
+        step_type: str,
+        attempt: int,
+        error_type: str,
+        error: str,
+    ):
+        self._enqueue(
+            "step_retried", saga_id, step_name, step_type, attempt, error_type, error
+        )
+
+    def group_step_finished(
+        self, saga_id: str, group_name: str, phase: str, step_name: str, outcome: dict
+    ) -> Optional[Dict[str, dict]]:
+        # the caller acts on the answer, so this one is not buffered
+        return self._repository.group_step_finished(
+            saga_id, group_name, phase, step_name, outcome
+        )
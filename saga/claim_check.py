@@ -0,0 +1,186 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Any, List, Optional, Tuple
+
+import redis
+
+from .codec import Codec, JsonCodec, MessageCodec
+from .saga import FINISHED_STATUSES, EventSagaStateRepository
+
+REFERENCE_KEY = "$claim_check"
+
+
+class BlobStore:
+    def put(self, saga_id: str, digest: str, data: bytes):
+        raise NotImplementedError()
+
+    def get(self, saga_id: str, digest: str) -> Optional[bytes]:
+        raise NotImplementedError()
+
+    def delete_saga(self, saga_id: str):
+        raise NotImplementedError()
+
+
+class FileBlobStore(BlobStore):
+    def __init__(self, folder: str):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, saga_id: str, digest: str) -> str:
+        return os.path.join(self.folder, saga_id, digest)
+
+    def put(self, saga_id: str, digest: str, data: bytes):
+        path = self._path(saga_id, digest)
+        if os.path.exists(path):
+            # blobs are named by their content
+            return
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def get(self, saga_id: str, digest: str) -> Optional[bytes]:
+        try:
+            with open(self._path(saga_id, digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete_saga(self, saga_id: str):
+        shutil.rmtree(os.path.join(self.folder, saga_id), ignore_errors=True)
+
+
+class RedisBlobStore(BlobStore):
+    def __init__(
+        self,
+        client: redis.Redis,
+        prefix: str = "saga",
+        ttl: Optional[int] = 7 * 24 * 3600,
+    ):
+        self._client = client
+        self._prefix = prefix
+        # a safety net for sagas that never finish
+        self._ttl = ttl
+
+    def _blob_key(self, saga_id: str, digest: str) -> str:
+        return f"{self._prefix}:{saga_id}:blob:{digest}"
+
+    def _blobs_key(self, saga_id: str) -> str:
+        return f"{self._prefix}:{saga_id}:blobs"
+
+    def put(self, saga_id: str, digest: str, data: bytes):
+        key = self._blob_key(saga_id, digest)
+        pipeline = self._client.pipeline(transaction=False)
+        pipeline.set(key, data, ex=self._ttl)
+        pipeline.sadd(self._blobs_key(saga_id), key)
+        if self._ttl:
+            pipeline.expire(self._blobs_key(saga_id), self._ttl)
+        pipeline.execute()
+
+    def get(self, saga_id: str, digest: str) -> Optional[bytes]:
+        return self._client.get(self._blob_key(saga_id, digest))
+
+    def delete_saga(self, saga_id: str):
+        keys = self._client.smembers(self._blobs_key(saga_id))
+        self._client.delete(self._blobs_key(saga_id), *keys)
+
+
+class ClaimCheck(EventSagaStateRepository):
+    # payloads of at least threshold bytes are kept in the blob store and
+    # commands only carry a reference to them. as a state repository it drops
+    # the blobs of every saga that finishes
+    def __init__(
+        self,
+        store: BlobStore,
+        threshold: int = 64 * 1024,
+        codec: Optional[Codec] = None,
+    ):
+        super().__init__()
+        self._store = store
+        self._threshold = threshold
+        self._codec = codec or JsonCodec()
+
+    def _record(self, events: List[dict]):
+        for event in events:
+            if event["status"] in FINISHED_STATUSES:
+                self._store.delete_saga(event["saga_id"])
+
+    def check_in(self, message: dict) -> dict:
+        payload = dict.get(message, "payload")
+        if payload is None or is_reference(payload):
+            return message
+        data = self._codec.encode(payload)
+        if len(data) < self._threshold:
+            return message
+        digest = hashlib.sha256(data).hexdigest()
+        self._store.put(message["saga_id"], digest, data)
+        return dict(message, payload={REFERENCE_KEY: digest, "size": len(data)})
+
+    def encode(
+        self, codec: MessageCodec, message: dict
+    ) -> Tuple[bytes, str, Optional[str]]:
+        # decides on the transport's own encoding of the message, so one below
+        # the threshold is encoded once; only the payload of a larger one is
+        # encoded again for the store, and the envelope with the reference.
+        # with compression on, the compressed size is what is compared
+        encoded = codec.encode(message)
+        if len(encoded[0]) < self._threshold:
+            return encoded
+        checked = self.check_in(message)
+        return encoded if checked is message else codec.encode(checked)
+
+    def check_out(self, saga_id: str, reference: dict) -> Any:
+        digest = reference[REFERENCE_KEY]
+        data = self._store.get(saga_id, digest)
+        if data is None:
+            raise LookupError(f"[{saga_id}]Payload {digest} not found")
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"[{saga_id}]Payload {digest} is corrupted")
+        return self._codec.decode(data)
+
+    def wrap(self, message: dict) -> dict:
+        if not is_reference(dict.get(message, "payload")):
+            return message
+        return ClaimedMessage(message, self)
+
+
+def is_reference(payload: Any) -> bool:
+    return isinstance(payload, dict) and REFERENCE_KEY in payload
+
+
+_MISSING = object()
+
+
+class ClaimedMessage(dict):
+    # loads the payload the first time a step reads it. copies made with
+    # dict(message) keep the reference instead, so commands that pass the
+    # payload on do not load it
+    def __init__(self, message: dict, claim_check: ClaimCheck):
+        super().__init__(message)
+        self._claim_check = claim_check
+        self._payload = _MISSING
+
+    def _load(self):
+        if self._payload is _MISSING:
+            self._payload = self._claim_check.check_out(
+                dict.__getitem__(self, "saga_id"), dict.__getitem__(self, "payload")
+            )
+        return self._payload
+
+    def __getitem__(self, key):
+        if key == "payload":
+            return self._load()
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        if key == "payload":
+            return self._load()
+        return super().get(key, default)
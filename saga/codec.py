@@ -0,0 +1,137 @@
+import json
+import zlib
+from typing import Any, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+DEFLATE = "deflate"
+
+
+class Codec:
+    content_type: str = None
+
+    def encode(self, message: Any) -> bytes:
+        raise NotImplementedError()
+
+    def decode(self, body: bytes) -> Any:
+        raise NotImplementedError()
+
+
+class JsonCodec(Codec):
+    content_type = JSON
+
+    def encode(self, message: Any) -> bytes:
+        return json.dumps(message).encode()
+
+    def decode(self, body: bytes) -> Any:
+        return json.loads(body)
+
+
+class OrjsonCodec(Codec):
+    # same wire format as JsonCodec, consumers cannot tell them apart
+    content_type = JSON
+
+    def __init__(self):
+        if orjson is None:
+            raise RuntimeError(
+                "orjson is required for OrjsonCodec, install the orjson extra"
+            )
+
+    def encode(self, message: Any) -> bytes:
+        return orjson.dumps(message)
+
+    def decode(self, body: bytes) -> Any:
+        return orjson.loads(body)
+
+
+class MsgpackCodec(Codec):
+    content_type = MSGPACK
+
+    def __init__(self):
+        if msgpack is None:
+            raise RuntimeError(
+                "msgpack is required for MsgpackCodec, install the msgpack extra"
+            )
+
+    def encode(self, message: Any) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, body: bytes) -> Any:
+        return msgpack.unpackb(body, raw=False)
+
+
+CODECS = {
+    "json": JsonCodec,
+    "orjson": OrjsonCodec,
+    "msgpack": MsgpackCodec,
+}
+
+
+class MessageCodec:
+    # what a transport encodes with is configured, what it decodes follows
+    # the content type and encoding headers of each message, so producers
+    # can switch codecs while older messages are still queued
+    def __init__(
+        self,
+        codec: Optional[Codec] = None,
+        compress_threshold: int = 0,
+        compress_level: int = 1,
+    ):
+        self.codec = codec or JsonCodec()
+        # bodies at least this large are deflated, 0 turns compression off
+        self._compress_threshold = compress_threshold
+        self._compress_level = compress_level
+        self._decoders = {self.codec.content_type: self.codec}
+
+    def _decoder(self, content_type: Optional[str]) -> Codec:
+        # messages without a content type come from producers that predate
+        # the header and are JSON
+        content_type = content_type or JSON
+        decoder = self._decoders.get(content_type)
+        if decoder is None:
+            if content_type == JSON:
+                decoder = OrjsonCodec() if orjson is not None else JsonCodec()
+            elif content_type == MSGPACK:
+                decoder = MsgpackCodec()
+            else:
+                raise ValueError(f"Unsupported content type {content_type}")
+            self._decoders[content_type] = decoder
+        return decoder
+
+    def encode(self, message: Any) -> Tuple[bytes, str, Optional[str]]:
+        body = self.codec.encode(message)
+        if self._compress_threshold and len(body) >= self._compress_threshold:
+            return (
+                zlib.compress(body, self._compress_level),
+                self.codec.content_type,
+                DEFLATE,
+            )
+        return body, self.codec.content_type, None
+
+    def decode(
+        self,
+        body: bytes,
+        content_type: Optional[str] = None,
+        content_encoding: Optional[str] = None,
+    ) -> Any:
+        if content_encoding == DEFLATE:
+            body = zlib.decompress(body)
+        elif content_encoding:
+            raise ValueError(f"Unsupported content encoding {content_encoding}")
+        return self._decoder(content_type).decode(body)
+
+
+def create_codec(name: str = "json", compress_threshold: int = 0) -> MessageCodec:
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec {name}")
+    return MessageCodec(CODECS[name](), compress_threshold)
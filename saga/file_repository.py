@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .saga import FINISHED_STATUSES, EventSagaStateRepository
+
+
+class FileSagaStateRepository(EventSagaStateRepository):
+    def __init__(self, file_name: str, sync: bool = False):
+        super().__init__()
+        self._file_name = file_name
+        self._sync = sync
+        self._lock = threading.Lock()
+        # saga_id -> (group_name, phase) -> {step_name: outcome}
+        self._groups: Dict[str, Dict[tuple, Dict[str, dict]]] = {}
+        self._load_groups()
+        self._fd = os.open(file_name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _load_groups(self):
+        # step groups of unfinished sagas are picked up where they were left
+        if not os.path.exists(self._file_name):
+            return
+        with open(self._file_name, "rb") as f:
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            # a write torn by a crash, later appends must start on a new line
+            with open(self._file_name, "r+b") as f:
+                f.truncate(end)
+        finished = set()
+        for line in data[:end].splitlines():
+            event = json.loads(line)
+            if event["status"] in FINISHED_STATUSES:
+                finished.add(event["saga_id"])
+            elif event.get("step_status") == "group_step_finished":
+                groups = self._groups.setdefault(event["saga_id"], {})
+                outcomes = groups.setdefault((event["group_name"], event["phase"]), {})
+                outcomes.setdefault(event["step_name"], event["outcome"])
+        for saga_id in finished:
+            self._groups.pop(saga_id, None)
+
+    def _write(self, events: List[dict]):
+        data = memoryview(
+            "".join(json.dumps(event) + "\n" for event in events).encode()
+        )
+        while data:
+            data = data[os.write(self._fd, data) :]
+        if self._sync:
+            os.fsync(self._fd)
+
+    def _record(self, events: List[dict]):
+        # the file stays open and a batch is a single append
+        with self._lock:
+            self._write(events)
+            for event in events:
+                if event["status"] in FINISHED_STATUSES:
+                    self._groups.pop(event["saga_id"], None)
+
+    def group_step_finished(
+        self, saga_id: str, group_name: str, phase: str, step_name: str, outcome: dict
+    ) -> Optional[Dict[str, dict]]:
+        with self._lock:
+            groups = self._groups.setdefault(saga_id, {})
+            outcomes = groups.setdefault((group_name, phase), {})
+            if step_name in outcomes:
+                return None
+            self._write(
+                [
+                    {
+                        "status": "running" if phase == "action" else "compensation",
+                        "step_status": "group_step_finished",
+                        "saga_id": saga_id,
+                        "step_name": step_name,
+                        "group_name": group_name,
+                        "phase": phase,
+                        "outcome": outcome,
+                        "time": time.time(),
+                    }
+                ]
+            )
+            outcomes[step_name] = outcome
+            return dict(outcomes)
+
+    def close(self):
+        with self._lock:
+            if self._fd is None:
+                return
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,157 @@
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import redis
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.count = 0
+        self._size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self._hashes = max(1, round(self._size / capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+
+    def _positions(self, key: str):
+        # double hashing, k positions out of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self._size for i in range(self._hashes)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+class RotatingBloomFilter:
+    # two generations of capacity keys each; when the current one is full the
+    # older one is dropped, so memory stays constant and the filter remembers
+    # at least the last capacity keys
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous = BloomFilter(capacity, error_rate)
+
+    def add(self, key: str):
+        if self._current.count >= self._capacity:
+            self._previous = self._current
+            self._current = BloomFilter(self._capacity, self._error_rate)
+        self._current.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._current or key in self._previous
+
+
+class IdempotencyStore:
+    def contains(self, key: str) -> bool:
+        raise NotImplementedError()
+
+    def add(self, key: str):
+        raise NotImplementedError()
+
+
+class RedisIdempotencyStore(IdempotencyStore):
+    def __init__(
+        self,
+        client: redis.Redis,
+        prefix: str = "idempotency",
+        ttl: Optional[int] = 7 * 24 * 3600,
+    ):
+        self._client = client
+        self._prefix = prefix
+        self._ttl = ttl
+
+    def contains(self, key: str) -> bool:
+        return bool(self._client.exists(f"{self._prefix}:{key}"))
+
+    def add(self, key: str):
+        self._client.set(f"{self._prefix}:{key}", 1, ex=self._ttl)
+
+
+def message_key(message: dict) -> Optional[str]:
+    if message.get("command_id"):
+        return f"command:{message['command_id']}"
+    if "saga_id" in message and "step_name" in message:
+        # every retry is a new attempt and has to run
+        return ":".join(
+            [
+                "step",
+                str(message["saga_id"]),
+                str(message["step_name"]),
+                str(message.get("step_type")),
+                str(message.get("attempt", 1)),
+            ]
+        )
+    return None
+
+
+class IdempotencyGuard:
+    # keys are recorded once a message has been handled. the bloom filter
+    # rules out keys this process never handled, the lru answers exactly for
+    # recent ones and only the rest goes to the store. the store is also
+    # asked for redelivered messages, which may have been handled by a
+    # process that died before acking them. without a store a bloom positive
+    # is not trusted: nothing is dropped on a false positive
+    def __init__(
+        self,
+        capacity: int = 100000,
+        error_rate: float = 0.001,
+        store: Optional[IdempotencyStore] = None,
+    ):
+        self._capacity = capacity
+        self._recent = OrderedDict()
+        self._filter = RotatingBloomFilter(capacity, error_rate)
+        self._store = store
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def seen(self, key: Optional[str], redelivered: bool = False) -> bool:
+        if key is None:
+            return False
+        with self._lock:
+            if key in self._filter and key in self._recent:
+                self._recent.move_to_end(key)
+                self.duplicates += 1
+                return True
+            if key not in self._filter and not redelivered:
+                return False
+        if self._store is not None and self._store.contains(key):
+            with self._lock:
+                self.duplicates += 1
+            return True
+        return False
+
+    def record(self, key: Optional[str]):
+        if key is None:
+            return
+        if self._store is not None:
+            self._store.add(key)
+        with self._lock:
+            self._recent[key] = None
+            self._recent.move_to_end(key)
+            while len(self._recent) > self._capacity:
+                self._recent.popitem(last=False)
+            self._filter.add(key)
+
+
+def create_idempotency_guard(
+    capacity: int, redis_url: Optional[str] = None
+) -> Optional[IdempotencyGuard]:
+    if not capacity:
+        return None
+    store = None
+    if redis_url:
+        store = RedisIdempotencyStore(redis.Redis.from_url(redis_url))
+    return IdempotencyGuard(capacity, store=store)
@@ -0,0 +1,334 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# milliseconds since the epoch at which a message was meant to be consumed
+SENT_AT_HEADER = "x-sent-at"
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+# sagas span several steps, retries and queues
+SAGA_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    type: str = None
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # label values -> value, label values are passed as a tuple in the
+        # order of labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterable[Tuple[str, Tuple[str, ...], Tuple, float]]:
+        # (suffix, label names, label values, value)
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield "", self.labels, label_values, value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, names, values, value in self.samples():
+            labels = _format_labels(names, values)
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, labels: Tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, labels: Tuple = ()) -> float:
+        return self._values.get(labels, 0)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, labels: Tuple = ()):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, labels: Tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels: Tuple = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+    def get(self, labels: Tuple = ()) -> float:
+        return self._values.get(labels, 0)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, labels: Tuple = ()):
+        # counts are kept per bucket and only made cumulative when rendered
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def count(self, labels: Tuple = ()) -> int:
+        state = self._values.get(labels)
+        return sum(state[0]) if state else 0
+
+    def samples(self):
+        with self._lock:
+            values = [(k, (list(v[0]), v[1])) for k, v in self._values.items()]
+        names = self.labels + ("le",)
+        for label_values, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _format_value(bound)
+                yield "_bucket", names, label_values + (le,), cumulative
+            yield "_sum", self.labels, label_values, total
+            yield "_count", self.labels, label_values, cumulative
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name: str, *args) -> Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, *args)
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f"Metric {name} is already a {metric.type}")
+            return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labels)
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labels, buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def sent_at_headers(delay: float = 0) -> Dict[str, int]:
+    return {SENT_AT_HEADER: int((time.time() + delay) * 1000)}
+
+
+def queue_lag(headers: Optional[dict]) -> Optional[float]:
+    # seconds a message waited in its queue, None for messages from
+    # producers that do not stamp them
+    sent_at = (headers or {}).get(SENT_AT_HEADER)
+    if sent_at is None:
+        return None
+    return max(0.0, time.time() - sent_at / 1000)
+
+
+class SagaMetrics:
+    def __init__(self, registry: MetricsRegistry = REGISTRY):
+        self.step_seconds = registry.histogram(
+            "saga_step_duration_seconds",
+            "Time spent running a step action or compensation",
+            ("saga", "step", "step_type"),
+        )
+        self.steps = registry.counter(
+            "saga_steps_total",
+            "Steps run, by outcome",
+            ("saga", "step", "step_type", "outcome"),
+        )
+        self.steps_in_flight = registry.gauge(
+            "saga_steps_in_flight", "Steps currently running", ("saga", "step_type")
+        )
+        self.sagas = registry.counter(
+            "saga_finished_total", "Sagas finished, by status", ("status",)
+        )
+        self.saga_seconds = registry.histogram(
+            "saga_duration_seconds",
+            "Time from a saga being started to it finishing, by outcome",
+            ("saga", "status"),
+            SAGA_BUCKETS,
+        )
+        self.repository_seconds = registry.histogram(
+            "saga_state_repository_duration_seconds",
+            "Time spent in state repository calls",
+            ("call",),
+        )
+        self.publish_seconds = registry.histogram(
+            "saga_publish_duration_seconds",
+            "Time spent publishing commands",
+            ("kind",),
+        )
+        self.queue_lag = registry.histogram(
+            "saga_queue_lag_seconds",
+            "Time commands waited in their queue before being consumed",
+            ("queue",),
+        )
+        self.duplicates = registry.counter(
+            "saga_duplicates_total",
+            "Commands skipped by the idempotency guard",
+            ("queue",),
+        )
+
+    def step_started(self, saga_name: str, step_type: str):
+        self.steps_in_flight.inc((saga_name, step_type))
+
+    def step_finished(
+        self,
+        saga_name: str,
+        step_name: str,
+        step_type: str,
+        outcome: str,
+        seconds: float,
+    ):
+        self.steps_in_flight.dec((saga_name, step_type))
+        self.step_seconds.observe(seconds, (saga_name, step_name, step_type))
+        self.steps.inc((saga_name, step_name, step_type, outcome))
+
+    def saga_finished(self, saga_name: str, status: str, seconds: float):
+        self.saga_seconds.observe(seconds, (saga_name, status))
+
+    def consumed(self, queue: str, headers: Optional[dict]):
+        lag = queue_lag(headers)
+        if lag is not None:
+            self.queue_lag.observe(lag, (queue,))
+
+
+class WorkerMetrics:
+    def __init__(self, registry: MetricsRegistry = REGISTRY):
+        self.handler_seconds = registry.histogram(
+            "worker_handler_duration_seconds",
+            "Time spent handling a message, by message type",
+            ("type",),
+        )
+        self.messages = registry.counter(
+            "worker_messages_total",
+            "Messages handled, by message type and outcome",
+            ("type", "outcome"),
+        )
+        self.in_flight = registry.gauge(
+            "worker_messages_in_flight", "Messages currently being handled"
+        )
+        self.queue_lag = registry.histogram(
+            "worker_queue_lag_seconds",
+            "Time messages waited in their queue before being consumed",
+            ("queue",),
+        )
+        self.duplicates = registry.counter(
+            "worker_duplicates_total",
+            "Messages skipped by the idempotency guard",
+            ("queue",),
+        )
+
+    def consumed(self, queue: str, headers: Optional[dict]):
+        lag = queue_lag(headers)
+        if lag is not None:
+            self.queue_lag.observe(lag, (queue,))
+
+    def handled(self, message_types: Iterable, outcome: str, seconds: float):
+        # a batch counts once per message and its time is spread over them
+        message_types = list(message_types)
+        for message_type in message_types:
+            labels = (str(message_type),)
+            self.handler_seconds.observe(seconds / len(message_types), labels)
+            self.messages.inc(labels + (outcome,))
+
+
+def serve_metrics(
+    port: int, registry: MetricsRegistry = REGISTRY, host: str = "0.0.0.0"
+) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(" [x] Serving metrics on %s:%d" % (host, port))
+    return server
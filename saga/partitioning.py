@@ -0,0 +1,82 @@
+import hashlib
+import time
+import zlib
+from typing import Dict, List
+
+import redis
+
+
+def partition_for(saga_id: str, partitions: int) -> int:
+    return zlib.crc32(saga_id.encode()) % partitions
+
+
+def partition_queue(queue: str, partition: int) -> str:
+    return f"{queue}.{partition}"
+
+
+def _weight(member: str, partition: int) -> int:
+    digest = hashlib.blake2b(f"{member}:{partition}".encode(), digest_size=8)
+    return int.from_bytes(digest.digest(), "big")
+
+
+def assign_partitions(partitions: int, members: List[str]) -> Dict[str, List[int]]:
+    # rendezvous hashing: a partition goes to the member with the highest
+    # weight for it, so a member joining or leaving only moves the partitions
+    # it gains or gives up
+    assignment = {member: [] for member in members}
+    if not members:
+        return assignment
+    for partition in range(partitions):
+        owner = max(members, key=lambda member: _weight(member, partition))
+        assignment[owner].append(partition)
+    return assignment
+
+
+class PartitionMembership:
+    def heartbeat(self, member_id: str):
+        raise NotImplementedError()
+
+    def members(self) -> List[str]:
+        raise NotImplementedError()
+
+    def leave(self, member_id: str):
+        raise NotImplementedError()
+
+
+class StaticMembership(PartitionMembership):
+    def __init__(self, members: List[str]):
+        self._members = sorted(members)
+
+    def heartbeat(self, member_id: str):
+        pass
+
+    def members(self) -> List[str]:
+        return self._members
+
+    def leave(self, member_id: str):
+        pass
+
+
+class RedisMembership(PartitionMembership):
+    # members are kept in a sorted set scored by their last heartbeat and
+    # drop out once they miss heartbeats for ttl seconds
+    def __init__(
+        self, client: redis.Redis, key: str = "saga:members", ttl: float = 15.0
+    ):
+        self._client = client
+        self._key = key
+        self._ttl = ttl
+
+    def heartbeat(self, member_id: str):
+        self._client.zadd(self._key, {member_id: time.time()})
+
+    def members(self) -> List[str]:
+        now = time.time()
+        pipeline = self._client.pipeline(transaction=False)
+        pipeline.zremrangebyscore(self._key, "-inf", now - self._ttl)
+        pipeline.zrange(self._key, 0, -1)
+        _, members = pipeline.execute()
+        return sorted(m.decode() if isinstance(m, bytes) else m for m in members)
+
+    def leave(self, member_id: str):
+        self._client.zrem(self._key, member_id)
@@ -0,0 +1,177 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+SNAPSHOT_FILE = "snapshot.json"
+
+
+def _command_key(message: dict) -> str:
+    return f"{message['step_name']}:{message['step_type']}:{message.get('attempt', 1)}"
+
+
+class RecoveryJournal:
+    # keeps what handling a command produced until the delivery that brought
+    # the command is acked. a controller that dies between recording a step's
+    # outcome and publishing the commands that follow it gets the command
+    # delivered again by the broker after a restart; the journal then hands
+    # back the commands to send instead of running the step a second time.
+    # the journal is a log cut into segments; every snapshot_interval records
+    # the unacked commands are written to a snapshot and older segments are
+    # dropped, so loading it reads one snapshot and the tail written after
+    # it, whatever the history
+    def __init__(
+        self, folder: str, snapshot_interval: int = 100000, sync: bool = False
+    ):
+        self.folder = folder
+        self._snapshot_interval = snapshot_interval
+        self._sync = sync
+        self._lock = threading.Lock()
+        # saga_id -> {command key -> commands it produced}
+        self._sagas: Dict[str, Dict[str, List[dict]]] = {}
+        self._records = 0
+        os.makedirs(folder, exist_ok=True)
+        self._segment = self._load()
+        self._fd = self._open_segment(self._segment)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.folder, f"{segment:08d}.log")
+
+    def _segments(self) -> List[int]:
+        return sorted(
+            int(name[:-4])
+            for name in os.listdir(self.folder)
+            if name.endswith(".log") and name[:-4].isdigit()
+        )
+
+    def _open_segment(self, segment: int) -> int:
+        return os.open(
+            self._segment_path(segment), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+        )
+
+    def _load(self) -> int:
+        segment = 0
+        path = os.path.join(self.folder, SNAPSHOT_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                snapshot = json.load(f)
+            self._sagas = snapshot["sagas"]
+            segment = snapshot["segment"]
+        segments = [s for s in self._segments() if s >= segment]
+        for s in segments:
+            self._replay(s)
+        return segments[-1] if segments else segment
+
+    def _replay(self, segment: int):
+        path = self._segment_path(segment)
+        with open(path, "rb") as f:
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            # a write torn by a crash, later appends must start on a new line
+            with open(path, "r+b") as f:
+                f.truncate(end)
+        for line in data[:end].splitlines():
+            self._apply(json.loads(line))
+            self._records += 1
+
+    def _apply(self, record: dict):
+        saga_id = record["saga_id"]
+        handled = record.get("handled")
+        if handled is not None:
+            self._sagas.setdefault(saga_id, {})[handled] = record["sent"]
+            return
+        commands = self._sagas.get(saga_id)
+        if commands is None:
+            return
+        for key in record["settled"]:
+            commands.pop(key, None)
+        if not commands:
+            del self._sagas[saga_id]
+
+    def _append(self, records: List[dict]):
+        data = memoryview(
+            "".join(json.dumps(record) + "\n" for record in records).encode()
+        )
+        with self._lock:
+            while data:
+                data = data[os.write(self._fd, data) :]
+            if self._sync:
+                os.fsync(self._fd)
+            for record in records:
+                self._apply(record)
+            self._records += len(records)
+            if self._records >= self._snapshot_interval:
+                self._snapshot()
+
+    def command_handled(self, message: dict, sent: List[dict]):
+        # called once a command has its outcome, before anything it sent is
+        # published. sent holds the commands as {"command": ...} along with
+        # "delay" for delayed ones or "inline" for those run in-process
+        self._append(
+            [
+                {
+                    "saga_id": message["saga_id"],
+                    "handled": _command_key(message),
+                    "sent": sent,
+                }
+            ]
+        )
+
+    def replay(self, message: dict) -> Optional[List[dict]]:
+        # what handling a command sent, if it was handled and never acked
+        with self._lock:
+            return self._sagas.get(message["saga_id"], {}).get(_command_key(message))
+
+    def commands_settled(self, messages: List[dict]):
+        # called once the deliveries that brought these commands are acked,
+        # what they sent is published by then
+        keys = {}
+        with self._lock:
+            for message in messages:
+                key = _command_key(message)
+                if key in self._sagas.get(message["saga_id"], {}):
+                    keys.setdefault(message["saga_id"], []).append(key)
+        if keys:
+            self._append(
+                [
+                    {"saga_id": saga_id, "settled": settled}
+                    for saga_id, settled in keys.items()
+                ]
+            )
+
+    def _snapshot(self):
+        # later records go to a new segment, the snapshot says where to
+        # replay from; segments before it are dropped once it is in place
+        segment = self._segment + 1
+        fd = self._open_segment(segment)
+        path = os.path.join(self.folder, SNAPSHOT_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"segment": segment, "sagas": self._sagas}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        os.close(self._fd)
+        self._fd, self._segment, self._records = fd, segment, 0
+        for s in self._segments():
+            if s < segment:
+                os.unlink(self._segment_path(s))
+
+    def snapshot(self):
+        with self._lock:
+            self._snapshot()
+
+    def handled_commands(self) -> Dict[str, List[str]]:
+        # saga_id -> keys of the commands handled and not acked yet
+        with self._lock:
+            return {saga_id: list(keys) for saga_id, keys in self._sagas.items()}
+
+    def close(self):
+        with self._lock:
+            if self._fd is None:
+                return
+            # a clean restart only reads the snapshot
+            self._snapshot()
+            os.close(self._fd)
+            self._fd = None
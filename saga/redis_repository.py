@@ -0,0 +1,91 @@
+import json
+from typing import Dict, List, Optional
+
+import redis
+
+from .saga import FINISHED_STATUSES, EventSagaStateRepository
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class RedisSagaStateRepository(EventSagaStateRepository):
+    def __init__(
+        self,
+        client: redis.Redis,
+        prefix: str = "saga",
+        finished_ttl: Optional[int] = 7 * 24 * 3600,
+        max_events: Optional[int] = None,
+    ):
+        super().__init__()
+        self._client = client
+        self._prefix = prefix
+        self._finished_ttl = finished_ttl
+        self._max_events = max_events
+
+    def _status_key(self, saga_id: str) -> str:
+        return f"{self._prefix}:{saga_id}"
+
+    def _events_key(self, saga_id: str) -> str:
+        return f"{self._prefix}:{saga_id}:events"
+
+    def _groups_key(self, saga_id: str) -> str:
+        return f"{self._prefix}:{saga_id}:groups"
+
+    def _record(self, events: List[dict]):
+        # every event of the batch goes out in one round-trip, in a MULTI so
+        # that a status hash is never read half replaced
+        pipeline = self._client.pipeline(transaction=True)
+        for event in events:
+            saga_id = event["saga_id"]
+            fields = {key: str(value) for key, value in event.items()}
+            status_key = self._status_key(saga_id)
+            events_key = self._events_key(saga_id)
+            # the status is the latest event alone, fields such as error must
+            # not outlive the event that set them
+            pipeline.delete(status_key)
+            pipeline.hset(status_key, mapping=fields)
+            if self._max_events:
+                pipeline.xadd(
+                    events_key, fields, maxlen=self._max_events, approximate=True
+                )
+            else:
+                pipeline.xadd(events_key, fields)
+            if self._finished_ttl and event["status"] in FINISHED_STATUSES:
+                pipeline.expire(status_key, self._finished_ttl)
+                pipeline.expire(events_key, self._finished_ttl)
+                pipeline.expire(self._groups_key(saga_id), self._finished_ttl)
+        pipeline.execute()
+
+    def group_step_finished(
+        self, saga_id: str, group_name: str, phase: str, step_name: str, outcome: dict
+    ) -> Optional[Dict[str, dict]]:
+        # one hash per saga, fields are "<group>:<phase>:<step>"
+        prefix = f"{group_name}:{phase}:"
+        pipeline = self._client.pipeline(transaction=True)
+        pipeline.hsetnx(
+            self._groups_key(saga_id), prefix + step_name, json.dumps(outcome)
+        )
+        pipeline.hgetall(self._groups_key(saga_id))
+        added, fields = pipeline.execute()
+        if not added:
+            return None
+        return {
+            _decode(field)[len(prefix) :]: json.loads(value)
+            for field, value in fields.items()
+            if _decode(field).startswith(prefix)
+        }
+
+    def get_status(self, saga_id: str) -> Optional[dict]:
+        fields = self._client.hgetall(self._status_key(saga_id))
+        if not fields:
+            return None
+        return {_decode(key): _decode(value) for key, value in fields.items()}
+
+    def get_events(self, saga_id: str) -> List[dict]:
+        entries = self._client.xrange(self._events_key(saga_id))
+        return [
+            {_decode(key): _decode(value) for key, value in fields.items()}
+            for _, fields in entries
+        ]
@@ -1,10 +1,47 @@
-import json
-from typing import Callable, List, Optional
+import asyncio
+import contextvars
+import heapq
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import ExitStack, contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type, Union
 
 import pika
 
+from .codec import MessageCodec
+from .idempotency import IdempotencyGuard, message_key
+from .metrics import SagaMetrics, sent_at_headers
+from .tracing import SagaTracer
+from .partitioning import (
+    PartitionMembership,
+    assign_partitions,
+    partition_for,
+    partition_queue,
+)
+
+FINISHED_STATUSES = ("completed", "failed", "compensation_failed")
+
+# commands sent while handling one command, for the recovery journal
+_sent = contextvars.ContextVar("sent")
+
+
+def encode_command(codec: MessageCodec, payload: dict, claim_check=None):
+    # how transports encode commands; the claim check looks at the encoded
+    # command rather than encoding the payload a second time to size it
+    if claim_check is None:
+        return codec.encode(payload)
+    return claim_check.encode(codec, payload)
+
 
 class SagaStateRepository:
+    def saga_started(self, saga_id: str, saga_name: str, step_name: str):
+        raise NotImplementedError()
+
     def action_started(self, saga_id: str, step_name: str):
         raise NotImplementedError()
 
@@ -36,6 +73,353 @@ class SagaStateRepository:
     def saga_failed(self, saga_id: str, step_name: str, error_type: str, error: str):
         raise NotImplementedError()
 
+    def step_retried(
+        self,
+        saga_id: str,
+        step_name: str,
+        step_type: str,
+        attempt: int,
+        error_type: str,
+        error: str,
+    ):
+        raise NotImplementedError()
+
+    def group_step_finished(
+        self, saga_id: str, group_name: str, phase: str, step_name: str, outcome: dict
+    ) -> Optional[Dict[str, dict]]:
+        # records the outcome of one member of a step group and returns the
+        # outcomes of every member finished so far in that phase, atomically.
+        # returns None if the member had already been recorded
+        raise NotImplementedError()
+
+    def batch(self):
+        # repositories that can write several events in one round-trip collect
+        # everything recorded inside the block and write it on exit
+        return nullcontext()
+
+    def flush(self):
+        # called before a command is published, so that the events leading up
+        # to it are durable; only buffering repositories have work to do here
+        pass
+
+
+class EventSagaStateRepository(SagaStateRepository):
+    def __init__(self):
+        self._batches = threading.local()
+
+    def _record(self, events: List[dict]):
+        raise NotImplementedError()
+
+    def _emit(self, event: dict):
+        event["time"] = time.time()
+        pending = getattr(self._batches, "events", None)
+        if pending is None:
+            self._record([event])
+        else:
+            pending.append(event)
+
+    @contextmanager
+    def batch(self):
+        if getattr(self._batches, "events", None) is not None:
+            yield
+            return
+        self._batches.events = []
+        try:
+            yield
+        finally:
+            events = self._batches.events
+            self._batches.events = None
+            if events:
+                self._record(events)
+
+    def saga_started(self, saga_id: str, saga_name: str, step_name: str):
+        self._emit(
+            {
+                "status": "started",
+                "saga_id": saga_id,
+                "saga_name": saga_name,
+                "step_name": step_name,
+            }
+        )
+
+    def action_started(self, saga_id: str, step_name: str):
+        self._emit(
+            {
+                "status": "running",
+                "step_status": "action_started",
+                "saga_id": saga_id,
+                "step_name": step_name,
+            }
+        )
+
+    def action_succeeded(self, saga_id: str, step_name: str):
+        self._emit(
+            {
+                "status": "running",
+                "step_status": "action_succeeded",
+                "saga_id": saga_id,
+                "step_name": step_name,
+            }
+        )
+
+    def action_failed(self, saga_id: str, step_name: str, error_type: str, error: str):
+        self._emit(
+            {
+                "status": "running",
+                "step_status": "action_failed",
+                "saga_id": saga_id,
+                "step_name": step_name,
+                "error_type": error_type,
+                "error": error,
+            }
+        )
+
+    def compensation_started(self, saga_id: str, step_name: str):
+        self._emit(
+            {
+                "status": "compensation",
+                "step_status": "compensation_started",
+                "saga_id": saga_id,
+                "step_name": step_name,
+            }
+        )
+
+    def compensation_succeeded(self, saga_id: str, step_name: str):
+        self._emit(
+            {
+                "status": "compensation",
+                "step_status": "compensation_succeeded",
+                "saga_id": saga_id,
+                "step_name": step_name,
+            }
+        )
+
+    def compensation_failed(
+        self, saga_id: str, step_name: str, error_type: str, error: str
+    ):
+        self._emit(
+            {
+                "status": "compensation",
+                "step_status": "compensation_failed",
+                "saga_id": saga_id,
+                "step_name": step_name,
+                "error_type": error_type,
+                "error": error,
+            }
+        )
+
+    def saga_compensate_failed(
+        self, saga_id: str, step_name: str, error_type: str, error: str
+    ):
+        self._emit(
+            {
+                "status": "compensation_failed",
+                "saga_id": saga_id,
+                "step_name": step_name,
+                "error_type": error_type,
+                "error": error,
+            }
+        )
+
+    def saga_completed(self, saga_id: str):
+        self._emit({"saga_id": saga_id, "status": "completed"})
+
+    def saga_failed(self, saga_id: str, step_name: str, error_type: str, error: str):
+        self._emit(
+            {
+                "status": "failed",
+                "saga_id": saga_id,
+                "step_name": step_name,
+                "error_type": error_type,
+                "error": error,
+            }
+        )
+
+    def step_retried(
+        self,
+        saga_id: str,
+        step_name: str,
+        step_type: str,
+        attempt: int,
+        error_type: str,
+        error: str,
+    ):
+        self._emit(
+            {
+                "status": "running" if step_type == "action" else "compensation",
+                "step_status": f"{step_type}_retried",
+                "saga_id": saga_id,
+                "step_name": step_name,
+                "attempt": attempt,
+                "error_type": error_type,
+                "error": error,
+            }
+        )
+
+
+class CompositeSagaStateRepository(SagaStateRepository):
+    # hands every event to several repositories, e.g. storage and a watcher
+    def __init__(self, repositories: List[SagaStateRepository]):
+        self._repositories = repositories
+
+    def _call(self, name: str, *args):
+        for repository in self._repositories:
+            getattr(repository, name)(*args)
+
+    @contextmanager
+    def batch(self):
+        with ExitStack() as stack:
+            for repository in self._repositories:
+                stack.enter_context(repository.batch())
+            yield
+
+    def flush(self):
+        self._call("flush")
+
+    def saga_started(self, saga_id: str, saga_name: str, step_name: str):
+        self._call("saga_started", saga_id, saga_name, step_name)
+
+    def action_started(self, saga_id: str, step_name: str):
+        self._call("action_started", saga_id, step_name)
+
+    def action_succeeded(self, saga_id: str, step_name: str):
+        self._call("action_succeeded", saga_id, step_name)
+
+    def action_failed(self, saga_id: str, step_name: str, error_type: str, error: str):
+        self._call("action_failed", saga_id, step_name, error_type, error)
+
+    def compensation_started(self, saga_id: str, step_name: str):
+        self._call("compensation_started", saga_id, step_name)
+
+    def compensation_succeeded(self, saga_id: str, step_name: str):
+        self._call("compensation_succeeded", saga_id, step_name)
+
+    def compensation_failed(
+        self, saga_id: str, step_name: str, error_type: str, error: str
+    ):
+        self._call("compensation_failed", saga_id, step_name, error_type, error)
+
+    def saga_compensate_failed(
+        self, saga_id: str, step_name: str, error_type: str, error: str
+    ):
+        self._call("saga_compensate_failed", saga_id, step_name, error_type, error)
+
+    def saga_completed(self, saga_id: str):
+        self._call("saga_completed", saga_id)
+
+    def saga_failed(self, saga_id: str, step_name: str, error_type: str, error: str):
+        self._call("saga_failed", saga_id, step_name, error_type, error)
+
+    def step_retried(
+        self,
+        saga_id: str,
+        step_name: str,
+        step_type: str,
+        attempt: int,
+        error_type: str,
+        error: str,
+    ):
+        self._call(
+            "step_retried", saga_id, step_name, step_type, attempt, error_type, error
+        )
+
+    def group_step_finished(
+        self, saga_id: str, group_name: str, phase: str, step_name: str, outcome: dict
+    ) -> Optional[Dict[str, dict]]:
+        # group state is kept by the first repository only
+        return self._repositories[0].group_step_finished(
+            saga_id, group_name, phase, step_name, outcome
+        )
+
+
+class InstrumentedSagaStateRepository(CompositeSagaStateRepository):
+    # times the calls made to a repository for metrics and traces, and counts
+    # the sagas finishing
+    FINISHED_CALLS = {
+        "saga_completed": "completed",
+        "saga_failed": "failed",
+        "saga_compensate_failed": "compensation_failed",
+    }
+
+    def __init__(
+        self,
+        repository: SagaStateRepository,
+        metrics: Optional[SagaMetrics] = None,
+        tracer: Optional[SagaTracer] = None,
+    ):
+        super().__init__([repository])
+        self._metrics = metrics
+        self._tracer = tracer
+
+    def _observe(self, name: str, start: float, saga_id: Optional[str] = None):
+        elapsed = time.perf_counter() - start
+        if self._metrics is not None:
+            self._metrics.repository_seconds.observe(elapsed, (name,))
+        if self._tracer is not None and saga_id and self._tracer.sampled(saga_id):
+            self._tracer.record(saga_id, f"state {name}", "state", start, elapsed)
+
+    def _call(self, name: str, *args):
+        start = time.perf_counter()
+        try:
+            super()._call(name, *args)
+        finally:
+            self._observe(name, start, args[0] if args else None)
+        if self._metrics is not None and name in self.FINISHED_CALLS:
+            self._metrics.sagas.inc((self.FINISHED_CALLS[name],))
+
+    @contextmanager
+    def batch(self):
+        with ExitStack() as stack:
+            stack.enter_context(super().batch())
+            yield
+            # events of a batch are written as it closes
+            start = time.perf_counter()
+        self._observe("batch", start)
+
+    def group_step_finished(
+        self, saga_id: str, group_name: str, phase: str, step_name: str, outcome: dict
+    ) -> Optional[Dict[str, dict]]:
+        start = time.perf_counter()
+        try:
+            return super().group_step_finished(
+                saga_id, group_name, phase, step_name, outcome
+            )
+        finally:
+            self._observe("group_step_finished", start, saga_id)
+
+
+class StepTimeoutError(TimeoutError):
+    pass
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        initial_delay: float = 0.5,
+        max_delay: float = 60.0,
+        multiplier: float = 2.0,
+        jitter: float = 0.5,
+        retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+    ):
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        # share of the delay that is randomized, so retries of sagas that
+        # failed together do not all come back at the same moment
+        self.jitter = jitter
+        self.retry_on = retry_on
+
+    def should_retry(self, attempt: int, error: Exception) -> bool:
+        return attempt < self.max_attempts and isinstance(error, self.retry_on)
+
+    def delay(self, attempt: int) -> float:
+        delay = min(
+            self.max_delay, self.initial_delay * self.multiplier ** (attempt - 1)
+        )
+        return delay * (1 - self.jitter * random.random())
+
 
 class SagaStep:
     def __init__(
@@ -45,12 +429,41 @@ class SagaStep:
         compensation: Callable,
         previous_step: Optional["SagaStep"] = None,
         next_step: Optional["SagaStep"] = None,
+        remote: bool = False,
+        retry_policy: Optional[RetryPolicy] = None,
+        timeout: Optional[float] = None,
     ) -> None:
         self.name = name
         self.action = action
         self.compensation = compensation
         self.previous_step = previous_step
         self.next_step = next_step
+        # remote steps are always handed off through the broker, even when the
+        # controller runs local steps inline
+        self.remote = remote
+        # set for the members of a SagaStepGroup
+        self.group: Optional["SagaStepGroup"] = None
+        self.retry_policy = retry_policy
+        # seconds an action or compensation may run before it counts as failed
+        self.timeout = timeout
+
+
+class SagaStepGroup:
+    # steps that run concurrently; the next step starts once all of them have
+    # succeeded and receives their results keyed by step name
+    def __init__(
+        self,
+        name: str,
+        steps: List[SagaStep],
+        previous_step: Optional[SagaStep] = None,
+        next_step: Optional[SagaStep] = None,
+    ) -> None:
+        self.name = name
+        self.steps = steps
+        self.previous_step = previous_step
+        self.next_step = next_step
+        for step in steps:
+            step.group = self
 
 
 class Saga:
@@ -68,30 +481,369 @@ class Saga:
     def last_step(self) -> SagaStep:
         return self._steps[-1]
 
-    def get_step(self, name: str) -> SagaStep:
-        return self._steps[self._steps_map[name]]
+    def get_step(self, name: str) -> Optional[SagaStep]:
+        return self._steps_map.get(name)
 
-    def add_step(self, step: SagaStep) -> None:
+    def add_step(self, step: Union[SagaStep, SagaStepGroup]) -> None:
         self._steps.append(step)
         index = len(self._steps) - 1
-        self._steps_map[step.name] = index
+        self._steps_map[step.name] = step
+        if isinstance(step, SagaStepGroup):
+            for member in step.steps:
+                self._steps_map[member.name] = member
         if index != 0:
             step.previous_step = self._steps[index - 1]
             self._steps[index - 1].next_step = step
 
 
-class SagaWatcher:
-    pass
+class SagaWatcher(EventSagaStateRepository):
+    def __init__(
+        self,
+        step_deadlines: Optional[Dict[str, float]] = None,
+        default_deadline: Optional[float] = None,
+        max_finished: Optional[int] = 100000,
+    ):
+        super().__init__()
+        # seconds a saga may stay on a step before it is reported as stuck
+        self._step_deadlines = step_deadlines or {}
+        self._default_deadline = default_deadline
+        # finished sagas are kept for queries up to this many, the ones that
+        # finished first are dropped beyond it; None keeps all of them
+        self._max_finished = max_finished
+        self._finished = OrderedDict()
+        self._lock = threading.Lock()
+        # saga_id -> (status, step_name, step_status, time, transition number)
+        self._sagas = {}
+        self._transitions = 0
+        self._by_status: Dict[str, set] = {}
+        # (deadline, saga_id, transition number); entries left behind by a
+        # later transition are skipped when they come up
+        self._deadlines = []
+        self._stuck: Dict[str, set] = {}
+        self._done_callbacks: Dict[str, List[Callable]] = {}
+
+    def _record(self, events: List[dict]):
+        finished = []
+        with self._lock:
+            for event in events:
+                if self._apply(event):
+                    finished.append(event["saga_id"])
+        self._notify(finished)
+
+    def apply(self, event: dict):
+        # for events read back from a state log or a redis stream
+        self._record([event])
+
+    def _notify(self, saga_ids: List[str]):
+        # callbacks run outside the lock, they may query the watcher
+        for saga_id in saga_ids:
+            with self._lock:
+                callbacks = self._done_callbacks.pop(saga_id, [])
+            state = self.get(saga_id)
+            for callback in callbacks:
+                callback(state)
+
+    def add_done_callback(self, saga_id: str, callback: Callable[[dict], Any]):
+        with self._lock:
+            state = self._sagas.get(saga_id)
+            if state is None or state[0] not in FINISHED_STATUSES:
+                self._done_callbacks.setdefault(saga_id, []).append(callback)
+                return
+        callback(self.get(saga_id))
+
+    def remove_done_callback(self, saga_id: str, callback: Callable[[dict], Any]):
+        with self._lock:
+            callbacks = self._done_callbacks.get(saga_id)
+            if callbacks and callback in callbacks:
+                callbacks.remove(callback)
+                if not callbacks:
+                    del self._done_callbacks[saga_id]
+
+    def _untrack(self, saga_id: str):
+        state = self._sagas.pop(saga_id, None)
+        if state is None:
+            return
+        self._finished.pop(saga_id, None)
+        status = state[0]
+        self._by_status[status].discard(saga_id)
+        if saga_id in self._stuck.get(status, ()):
+            self._stuck[status].discard(saga_id)
+
+    def _apply(self, event: dict) -> bool:
+        saga_id = event["saga_id"]
+        status = event["status"]
+        at = float(event.get("time") or time.time())
+        previous = self._sagas.get(saga_id)
+        step_name = event.get("step_name") or (previous[1] if previous else None)
+        self._untrack(saga_id)
+        self._transitions += 1
+        self._sagas[saga_id] = (
+            status,
+            step_name,
+            event.get("step_status"),
+            at,
+            self._transitions,
+        )
+        self._by_status.setdefault(status, set()).add(saga_id)
+        if status in FINISHED_STATUSES:
+            self._finished[saga_id] = None
+            if self._max_finished is not None:
+                while len(self._finished) > self._max_finished:
+                    self._untrack(next(iter(self._finished)))
+            return True
+        deadline = self._step_deadlines.get(step_name, self._default_deadline)
+        if deadline is not None:
+            heapq.heappush(self._deadlines, (at + deadline, saga_id, self._transitions))
+        return False
+
+    def get(self, saga_id: str) -> Optional[dict]:
+        state = self._sagas.get(saga_id)
+        if state is None:
+            return None
+        status, step_name, step_status, at, _ = state
+        return {
+            "saga_id": saga_id,
+            "status": status,
+            "step_name": step_name,
+            "step_status": step_status,
+            "time": at,
+        }
+
+    def count(self, status: Optional[str] = None) -> int:
+        if status is None:
+            return len(self._sagas)
+        return len(self._by_status.get(status, ()))
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {status: len(ids) for status, ids in self._by_status.items() if ids}
+
+    def sagas(self, status: str) -> List[str]:
+        with self._lock:
+            return list(self._by_status.get(status, ()))
+
+    def stuck_sagas(
+        self, status: Optional[str] = None, now: Optional[float] = None
+    ) -> List[str]:
+        now = time.time() if now is None else now
+        with self._lock:
+            # only deadlines that passed since the last call are looked at
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, saga_id, transition = heapq.heappop(self._deadlines)
+                state = self._sagas.get(saga_id)
+                if state is None or state[4] != transition:
+                    continue
+                self._stuck.setdefault(state[0], set()).add(saga_id)
+            if status is not None:
+                return list(self._stuck.get(status, ()))
+            return [saga_id for ids in self._stuck.values() for saga_id in ids]
+
+    def forget(self, saga_id: str):
+        with self._lock:
+            self._untrack(saga_id)
+
+
+class SagaHandle:
+    def __init__(self, saga_id: str, watcher: Optional[SagaWatcher] = None):
+        self.saga_id = saga_id
+        self._watcher = watcher
+
+    def _get_watcher(self) -> SagaWatcher:
+        if self._watcher is None:
+            raise RuntimeError("Saga handles need a SagaWatcher to follow sagas")
+        return self._watcher
+
+    def status(self) -> Optional[dict]:
+        return self._get_watcher().get(self.saga_id)
+
+    def done(self) -> bool:
+        state = self.status()
+        return state is not None and state["status"] in FINISHED_STATUSES
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[dict]:
+        finished = threading.Event()
+        watcher = self._get_watcher()
+
+        def done(_):
+            finished.set()
+
+        watcher.add_done_callback(self.saga_id, done)
+        try:
+            if not finished.wait(timeout):
+                raise TimeoutError(f"[{self.saga_id}]Saga did not finish in time")
+        finally:
+            watcher.remove_done_callback(self.saga_id, done)
+        return self.status()
+
+    def __await__(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(state):
+            if not future.done():
+                future.set_result(state)
+
+        # the watcher may be fed from another thread
+        self._get_watcher().add_done_callback(
+            self.saga_id, lambda state: loop.call_soon_threadsafe(resolve, state)
+        )
+        return future.__await__()
 
 
 class SagaIgniter:
-    pass
+    def __init__(
+        self,
+        saga_state_repository: SagaStateRepository,
+        watcher: Optional[SagaWatcher] = None,
+        batch_size: int = 1000,
+        claim_check=None,
+    ):
+        self._state_repository = saga_state_repository
+        # handles can only be waited on when this watcher sees the events of
+        # the controllers running the sagas
+        self._watcher = watcher
+        self._batch_size = batch_size
+        self._claim_check = claim_check
+
+    def _send_commands(self, payloads: List[dict]):
+        raise NotImplementedError()
+
+    def start(self, saga: Saga, payload, saga_id: Optional[str] = None) -> SagaHandle:
+        saga_ids = [saga_id] if saga_id is not None else None
+        return self.start_many(saga, [payload], saga_ids)[0]
+
+    def start_many(
+        self,
+        saga: Saga,
+        payloads: Iterable,
+        saga_ids: Optional[Iterable[str]] = None,
+    ) -> List[SagaHandle]:
+        step = saga.first_step()
+        # a saga starting with a group starts all of its members
+        members = step.steps if isinstance(step, SagaStepGroup) else [step]
+        payloads = list(payloads)
+        if saga_ids is None:
+            saga_ids = [uuid.uuid4().hex for _ in payloads]
+        saga_ids = list(saga_ids)
+        if len(saga_ids) != len(payloads):
+            raise ValueError(
+                f"Got {len(saga_ids)} saga ids for {len(payloads)} payloads"
+            )
+        for start in range(0, len(payloads), self._batch_size):
+            chunk = list(
+                zip(
+                    saga_ids[start : start + self._batch_size],
+                    payloads[start : start + self._batch_size],
+                )
+            )
+            with self._state_repository.batch():
+                for saga_id, _ in chunk:
+                    self._state_repository.saga_started(saga_id, saga.name, step.name)
+            # sagas are recorded before anything can run them
+            self._state_repository.flush()
+            # wall time, so whichever controller finishes the saga can time it
+            started_at = time.time()
+            commands = [
+                {
+                    "saga_id": saga_id,
+                    "saga_name": saga.name,
+                    "step_name": member.name,
+                    "step_type": "action",
+                    "payload": payload,
+                    "started_at": started_at,
+                }
+                for saga_id, payload in chunk
+                for member in members
+            ]
+            self._send_commands(commands)
+        return [SagaHandle(saga_id, self._watcher) for saga_id in saga_ids]
+
+
+class RabbitMQSagaIgniter(SagaIgniter):
+    def __init__(
+        self,
+        saga_state_repository: SagaStateRepository,
+        rabbitmq_connection: pika.BlockingConnection,
+        exchange: str,
+        queue: str,
+        watcher: Optional[SagaWatcher] = None,
+        batch_size: int = 1000,
+        confirm_delivery: bool = False,
+        codec: Optional[MessageCodec] = None,
+        claim_check=None,
+        partitions: int = 0,
+    ):
+        super().__init__(saga_state_repository, watcher, batch_size, claim_check)
+        self._rabbitmq_connection = rabbitmq_connection
+        self._exchange = exchange
+        self._queue = queue
+        # must match the partitions of the controllers
+        self._partitions = partitions
+        self._confirm_delivery = confirm_delivery
+        self._codec = codec or MessageCodec()
+        self._channel = None
+
+    def _get_channel(self):
+        if self._channel is None or self._channel.is_closed:
+            self._channel = self._rabbitmq_connection.channel()
+            if self._confirm_delivery:
+                self._channel.tx_select()
+        return self._channel
+
+    def _send_commands(self, payloads: List[dict]):
+        channel = self._get_channel()
+        for payload in payloads:
+            body, content_type, content_encoding = encode_command(
+                self._codec, payload, self._claim_check
+            )
+            queue = self._queue
+            if self._partitions:
+                queue = partition_queue(
+                    queue, partition_for(payload["saga_id"], self._partitions)
+                )
+            channel.basic_publish(
+                exchange=self._exchange,
+                routing_key=queue,
+                body=body,
+                properties=pika.BasicProperties(
+                    content_type=content_type,
+                    content_encoding=content_encoding,
+                    headers=sent_at_headers(),
+                ),
+            )
+        if self._confirm_delivery:
+            channel.tx_commit()
 
 
 class SagaExecutionController:
-    def __init__(self, saga_state_repository: SagaStateRepository):
+    def __init__(
+        self,
+        saga_state_repository: SagaStateRepository,
+        inline_local_steps: bool = False,
+        claim_check=None,
+        journal=None,
+        metrics: Optional[SagaMetrics] = None,
+        tracer: Optional[SagaTracer] = None,
+        timeout_workers: int = 4,
+    ):
+        self._metrics = metrics
+        self._tracer = tracer
+        if metrics is not None or tracer is not None:
+            saga_state_repository = InstrumentedSagaStateRepository(
+                saga_state_repository, metrics, tracer
+            )
         self._state_repository = saga_state_repository
         self._sagas = {}
+        self._inline_local_steps = inline_local_steps
+        self._timeout_executor = None
+        self._timeout_workers = timeout_workers
+        self._claim_check = claim_check
+        self._journal = journal
+        if claim_check is not None:
+            # the claim check drops the payloads of sagas as they finish
+            self._state_repository = CompositeSagaStateRepository(
+                [saga_state_repository, claim_check]
+            )
 
     def add_saga(self, saga: Saga):
         self._sagas[saga.name] = saga
@@ -102,90 +854,405 @@ class SagaExecutionController:
     def _send_compensation_command(self, payload):
         raise NotImplementedError()
 
+    def _settled(self, handled: List[dict]):
+        # the delivery that brought these messages was acked
+        if self._journal is not None:
+            self._journal.commands_settled(handled)
+
+    def _send_delayed_command(self, payload, delay: float):
+        # hands the command back to the transport to be redelivered after
+        # delay seconds, without holding up the consumer in the meantime
+        raise NotImplementedError()
+
+    def _forward_delayed(self, payload, delay: float):
+        self._send_delayed_command(self._prepare_command(payload, delay), delay)
+
+    def _prepare_command(self, payload, delay: Optional[float] = None):
+        # every command sent goes through here
+        if self._tracer is not None and self._tracer.sampled(payload["saga_id"]):
+            payload = dict(payload, trace=self._tracer.new_flow())
+        if self._journal is not None:
+            _sent.get().append({"command": payload, "delay": delay})
+        return payload
+
+    def _dispatch(self, send: Callable, *args):
+        send(*args)
+
+    def _resend(self, sent: List[dict]) -> List[dict]:
+        # sends again what handling a command sent before the controller
+        # stopped, and returns the commands it ran inline
+        forwarded = []
+        for entry in sent:
+            command = entry["command"]
+            if entry.get("inline"):
+                forwarded.append(command)
+            elif entry["delay"] is not None:
+                self._dispatch(self._send_delayed_command, command, entry["delay"])
+            elif command["step_type"] == "compensation":
+                self._dispatch(self._send_compensation_command, command)
+            else:
+                self._dispatch(self._send_next_step_command, command)
+        return forwarded
+
+    @staticmethod
+    def _started_at(message) -> dict:
+        # the start of the saga goes along with its commands
+        started_at = message.get("started_at")
+        return {} if started_at is None else {"started_at": started_at}
+
+    def _saga_finished(self, message, status: str):
+        started_at = message.get("started_at")
+        if self._metrics is not None and started_at is not None:
+            self._metrics.saga_finished(
+                message["saga_name"], status, max(0.0, time.time() - started_at)
+            )
+
+    @staticmethod
+    def _carried_payload(message):
+        # the payload as it was received, a claimed payload stays a reference
+        return dict.__getitem__(message, "payload")
+
+    def _retry(self, step: SagaStep, message, e: Exception) -> bool:
+        policy = step.retry_policy
+        attempt = message.get("attempt", 1)
+        if policy is None or not policy.should_retry(attempt, e):
+            return False
+        self._state_repository.step_retried(
+            message["saga_id"],
+            step.name,
+            message["step_type"],
+            attempt,
+            error_type=type(e).__name__,
+            error=str(e),
+        )
+        self._forward_delayed(dict(message, attempt=attempt + 1), policy.delay(attempt))
+        return True
+
+    def _execute(self, step: SagaStep, function: Callable, message):
+        if not step.timeout:
+            return function(message)
+        # a step that hangs cannot be stopped, but the consumer stops waiting
+        # for it. timed out work keeps running and holds one of the
+        # timeout_workers threads until it returns; once all of them are held,
+        # timed steps wait for a thread and time out without being started
+        if self._timeout_executor is None:
+            self._timeout_executor = ThreadPoolExecutor(self._timeout_workers)
+        future = self._timeout_executor.submit(function, message)
+        try:
+            return future.result(step.timeout)
+        except FutureTimeoutError:
+            # only cancels a step that was still waiting for a thread
+            future.cancel()
+            raise StepTimeoutError(
+                f"[{message['saga_id']}]Step {step.name} timed out after "
+                f"{step.timeout}s"
+            )
+
+    def _run_step(self, step: SagaStep, function: Callable, message):
+        if self._metrics is None and self._tracer is None:
+            return self._execute(step, function, message)
+        self._step_started(message)
+        outcome = "failed"
+        start = time.perf_counter()
+        try:
+            result = self._execute(step, function, message)
+            outcome = "succeeded"
+            return result
+        finally:
+            self._step_finished(step, message, outcome, start)
+
+    def _step_started(self, message):
+        if self._metrics is not None:
+            self._metrics.step_started(message["saga_name"], message["step_type"])
+
+    def _step_finished(self, step: SagaStep, message, outcome: str, start: float):
+        elapsed = time.perf_counter() - start
+        saga_id, step_type = message["saga_id"], message["step_type"]
+        if self._metrics is not None:
+            self._metrics.step_finished(
+                message["saga_name"], step.name, step_type, outcome, elapsed
+            )
+        if self._tracer is not None and self._tracer.sampled(saga_id):
+            self._tracer.record(
+                saga_id,
+                f"{step_type} {step.name}",
+                "step",
+                start,
+                elapsed,
+                args={"outcome": outcome, "attempt": message.get("attempt", 1)},
+                flow_in=message.get("trace"),
+            )
+
+    def _forward(self, step, payload, send: Callable) -> List[dict]:
+        if isinstance(step, SagaStepGroup):
+            return self._fan_out(step, step.steps, payload, send)
+        return self._forward_step(step, payload, send)
+
+    def _forward_step(self, step: SagaStep, payload, send: Callable) -> List[dict]:
+        if self._inline_local_steps and not step.remote:
+            return [payload]
+        send(self._prepare_command(payload))
+        return []
+
+    def _fan_out(
+        self, group: SagaStepGroup, members: List[SagaStep], payload, send: Callable
+    ) -> List[dict]:
+        # every member gets its own command, so they run independently
+        messages = []
+        for member in members:
+            member_payload = dict(payload, step_name=member.name)
+            if payload["step_type"] == "compensation":
+                member_payload["group_members"] = [m.name for m in members]
+            messages.extend(self._forward_step(member, member_payload, send))
+        return messages
+
     def _run_action_command(self, step: SagaStep, message):
-        saga_id = message["saga_id"]
-        self._state_repository.action_started(saga_id, step.name)
+        self._state_repository.action_started(message["saga_id"], step.name)
         try:
-            result = step.action(message)
+            result = self._run_step(step, step.action, message)
         except Exception as e:
-            self._state_repository.action_failed(
-                saga_id, step.name, error_type=type(e).__name__, error=str(e)
-            )
-            payload = {
-                "saga_id": message["saga_id"],
-                "saga_name": message["saga_name"],
-                "step_name": step.name,
-                "step_type": "compensation",
-                "payload": message["payload"],
+            return self._action_failed(step, message, e)
+        else:
+            return self._action_succeeded(step, message, result)
+
+    def _action_failed(self, step: SagaStep, message, e: Exception) -> List[dict]:
+        if self._retry(step, message, e):
+            return []
+        saga_id = message["saga_id"]
+        self._state_repository.action_failed(
+            saga_id, step.name, error_type=type(e).__name__, error=str(e)
+        )
+        if step.group is not None:
+            outcome = {
+                "status": "failed",
                 "error_type": type(e).__name__,
                 "error": str(e),
             }
-            self._send_compensation_command(payload)
-        else:
+            return self._group_step_finished(step, message, "action", outcome)
+        payload = {
+            "saga_id": message["saga_id"],
+            "saga_name": message["saga_name"],
+            **self._started_at(message),
+            "step_name": step.name,
+            "step_type": "compensation",
+            "payload": self._carried_payload(message),
+            "error_type": type(e).__name__,
+            "error": str(e),
+        }
+        return self._forward(step, payload, self._send_compensation_command)
+
+    def _action_succeeded(self, step: SagaStep, message, result) -> List[dict]:
+        saga_id = message["saga_id"]
+        if step.group is not None:
             self._state_repository.action_succeeded(saga_id, step.name)
-            if not step.next_step:
+            outcome = {"status": "succeeded", "result": result}
+            return self._group_step_finished(step, message, "action", outcome)
+        if not step.next_step:
+            with self._state_repository.batch():
+                self._state_repository.action_succeeded(saga_id, step.name)
                 self._state_repository.saga_completed(saga_id)
-            else:
-                payload = {
-                    "saga_id": message["saga_id"],
-                    "saga_name": message["saga_name"],
-                    "step_name": step.next_step.name,
-                    "step_type": "action",
-                    "payload": result,
-                }
-                self._send_next_step_command(payload)
+            self._saga_finished(message, "completed")
+            return []
+        self._state_repository.action_succeeded(saga_id, step.name)
+        return self._run_next(step, message, result)
+
+    def _run_next(self, step, message, result) -> List[dict]:
+        if not step.next_step:
+            self._state_repository.saga_completed(message["saga_id"])
+            self._saga_finished(message, "completed")
+            return []
+        payload = {
+            "saga_id": message["saga_id"],
+            "saga_name": message["saga_name"],
+            **self._started_at(message),
+            "step_name": step.next_step.name,
+            "step_type": "action",
+            "payload": result,
+        }
+        return self._forward(step.next_step, payload, self._send_next_step_command)
 
     def _run_compensation_command(self, step: SagaStep, message):
-        saga_id = message["saga_id"]
-        self._state_repository.compensation_started(saga_id, step.name)
+        self._state_repository.compensation_started(message["saga_id"], step.name)
         try:
-            result = step.compensation(message)
+            result = self._run_step(step, step.compensation, message)
         except Exception as e:
-            self._state_repository.saga_compensate_failed(
-                saga_id, step.name, error_type=type(e).__name__, error=str(e)
-            )
+            return self._compensation_failed(step, message, e)
         else:
+            return self._compensation_succeeded(step, message, result)
+
+    def _compensation_failed(self, step: SagaStep, message, e: Exception) -> List[dict]:
+        if self._retry(step, message, e):
+            return []
+        if step.group is not None:
+            self._state_repository.compensation_failed(
+                message["saga_id"],
+                step.name,
+                error_type=type(e).__name__,
+                error=str(e),
+            )
+            outcome = {
+                "status": "failed",
+                "error_type": type(e).__name__,
+                "error": str(e),
+            }
+            return self._group_step_finished(step, message, "compensation", outcome)
+        self._state_repository.saga_compensate_failed(
+            message["saga_id"], step.name, error_type=type(e).__name__, error=str(e)
+        )
+        self._saga_finished(message, "compensation_failed")
+        return []
+
+    def _compensation_succeeded(self, step: SagaStep, message, result) -> List[dict]:
+        saga_id = message["saga_id"]
+        if step.group is not None:
             self._state_repository.compensation_succeeded(saga_id, step.name)
-            if not step.previous_step:
+            outcome = {"status": "succeeded", "result": result}
+            return self._group_step_finished(step, message, "compensation", outcome)
+        if not step.previous_step:
+            with self._state_repository.batch():
+                self._state_repository.compensation_succeeded(saga_id, step.name)
                 self._state_repository.saga_failed(
                     saga_id,
                     step.name,
                     error_type=message["error_type"],
                     error=message["error"],
                 )
-            else:
-                payload = {
-                    "saga_id": message["saga_id"],
-                    "saga_name": message["saga_name"],
-                    "step_name": step.previous_step.name,
-                    "step_type": "compensation",
-                    "payload": result,
-                    "error_type": message["error_type"],
-                    "error": message["error"],
-                }
-                self._send_compensation_command(payload)
+            self._saga_finished(message, "failed")
+            return []
+        self._state_repository.compensation_succeeded(saga_id, step.name)
+        return self._compensate_previous(step, message, result)
+
+    def _compensate_previous(self, step, message, result) -> List[dict]:
+        if not step.previous_step:
+            self._state_repository.saga_failed(
+                message["saga_id"],
+                step.name,
+                error_type=message["error_type"],
+                error=message["error"],
+            )
+            self._saga_finished(message, "failed")
+            return []
+        payload = {
+            "saga_id": message["saga_id"],
+            "saga_name": message["saga_name"],
+            **self._started_at(message),
+            "step_name": step.previous_step.name,
+            "step_type": "compensation",
+            "payload": result,
+            "error_type": message["error_type"],
+            "error": message["error"],
+        }
+        return self._forward(
+            step.previous_step, payload, self._send_compensation_command
+        )
+
+    def _group_step_finished(
+        self, step: SagaStep, message, phase: str, outcome: dict
+    ) -> List[dict]:
+        group = step.group
+        outcomes = self._state_repository.group_step_finished(
+            message["saga_id"], group.name, phase, step.name, outcome
+        )
+        if outcomes is None:
+            # a redelivered command, whoever recorded it first moved on
+            return []
+        members = message.get("group_members") or [m.name for m in group.steps]
+        if len(outcomes) < len(members):
+            return []
+        # only the member finishing last sees every outcome
+        failed = [name for name in members if outcomes[name]["status"] == "failed"]
+        if phase == "action":
+            if not failed:
+                results = {name: outcomes[name]["result"] for name in members}
+                return self._run_next(group, message, results)
+            payload = {
+                "saga_id": message["saga_id"],
+                "saga_name": message["saga_name"],
+                **self._started_at(message),
+                "step_name": group.name,
+                "step_type": "compensation",
+                "payload": self._carried_payload(message),
+                "error_type": outcomes[failed[0]]["error_type"],
+                "error": outcomes[failed[0]]["error"],
+            }
+            # like a failed linear step, failed members are compensated too
+            return self._forward(group, payload, self._send_compensation_command)
+        if failed:
+            self._state_repository.saga_compensate_failed(
+                message["saga_id"],
+                failed[0],
+                error_type=outcomes[failed[0]]["error_type"],
+                error=outcomes[failed[0]]["error"],
+            )
+            self._saga_finished(message, "compensation_failed")
+            return []
+        results = {name: outcomes[name]["result"] for name in members}
+        return self._compensate_previous(group, message, results)
+
+    def _handle_message(self, message) -> List[dict]:
+        # steps forwarded inline are run back-to-back in this process instead of
+        # being published and consumed again; returns every message handled
+        pending = [message]
+        handled = []
+        while pending:
+            message = pending.pop()
+            handled.append(message)
+            pending.extend(self._handle_step_message(message))
+        return handled
 
-    def _handle_message(self, message):
+    def _get_step(self, message) -> SagaStep:
         saga_id = message["saga_id"]
         saga_name = message["saga_name"]
         step_name = message["step_name"]
-        step_type = message["step_type"]
         saga = self._sagas.get(saga_name)
         if not saga:
             raise LookupError(f"[{saga_id}]Saga {saga_name} not found")
         step = saga.get_step(step_name)
         if not step:
             raise LookupError(f"[{saga_id}]Step {step_name} not found")
+        return step
+
+    def _handle_step_message(self, message) -> List[dict]:
+        if self._claim_check is not None:
+            message = self._claim_check.wrap(message)
+        step = self._get_step(message)
+        if self._journal is None:
+            return self._run_command(step, message)
+        sent = self._journal.replay(message)
+        if sent is not None:
+            # handled before the controller stopped, without being acked
+            return self._resend(sent)
+        sent = []
+        token = _sent.set(sent)
+        try:
+            forwarded = self._run_command(step, message)
+        finally:
+            _sent.reset(token)
+        inline = [{"command": m, "inline": True} for m in forwarded]
+        self._journal.command_handled(message, sent + inline)
+        return forwarded
+
+    def _run_command(self, step: SagaStep, message) -> List[dict]:
+        step_type = message["step_type"]
         if step_type == "action":
-            self._run_action_command(step, message)
+            return self._run_action_command(step, message)
         elif step_type == "compensation":
-            self._run_compensation_command(step, message)
+            return self._run_compensation_command(step, message)
         else:
-            raise ValueError(f"[{saga_id}]Unknown step type {step_type}")
+            raise ValueError(f"[{message['saga_id']}]Unknown step type {step_type}")
 
     def run(self):
         raise NotImplementedError()
 
+    def _shutdown(self):
+        # steps still running past their timeout are not waited for
+        if self._timeout_executor is not None:
+            self._timeout_executor.shutdown(wait=False)
+            self._timeout_executor = None
+        if self._tracer is not None:
+            # writes the spans still buffered
+            self._tracer.close()
+
 
 class RabbitMQSagaExecutionController(SagaExecutionController):
     def __init__(
@@ -194,42 +1261,278 @@ class RabbitMQSagaExecutionController(SagaExecutionController):
         rabbitmq_connection: pika.BlockingConnection,
         exchange: str,
         queue: str,
+        inline_local_steps: bool = False,
+        confirm_delivery: bool = False,
+        confirm_batch_size: int = 100,
+        confirm_batch_interval: float = 0.05,
+        prefetch_count: Optional[int] = None,
+        codec: Optional[MessageCodec] = None,
+        claim_check=None,
+        partitions: int = 0,
+        membership: Optional[PartitionMembership] = None,
+        member_id: Optional[str] = None,
+        rebalance_interval: float = 5.0,
+        idempotency_guard: Optional[IdempotencyGuard] = None,
+        journal=None,
+        metrics: Optional[SagaMetrics] = None,
+        tracer: Optional[SagaTracer] = None,
+        timeout_workers: int = 4,
     ):
-        super().__init__(saga_state_repository)
+        super().__init__(
+            saga_state_repository,
+            inline_local_steps,
+            claim_check,
+            journal,
+            metrics,
+            tracer,
+            timeout_workers,
+        )
+        self._codec = codec or MessageCodec()
         self._rabbitmq_connection = rabbitmq_connection
         self._exchange = exchange
         self._queue = queue
+        self._confirm_delivery = confirm_delivery
+        self._confirm_batch_size = confirm_batch_size
+        self._confirm_batch_interval = confirm_batch_interval
+        if prefetch_count is None:
+            # a batch can only fill up if that many deliveries are outstanding
+            prefetch_count = confirm_batch_size if confirm_delivery else 1
+        self._prefetch_count = prefetch_count
+        self._publish_channel = None
+        self._delay_queues = set()
+        self._pending_publishes = []
+        self._pending_acks = []
+        self._flush_timer = None
+        # with partitions, sagas are spread over queue.0 .. queue.N-1 by saga
+        # id and each controller consumes the partitions assigned to it among
+        # the members it finds through membership (all of them without one)
+        self._partitions = partitions
+        self._membership = membership
+        self._member_id = member_id or uuid.uuid4().hex
+        self._rebalance_interval = rebalance_interval
+        self._consume_channel = None
+        self._consumers = {}
+        self._idempotency_guard = idempotency_guard
 
-    def _send_next_step_command(self, payload):
-        channel = self._rabbitmq_connection.channel()
-        channel.basic_publish(
-            exchange=self._exchange,
-            routing_key=self._queue,
-            body=json.dumps(payload),
+    def _get_publish_channel(self):
+        if self._publish_channel is None or self._publish_channel.is_closed:
+            self._publish_channel = self._rabbitmq_connection.channel()
+            self._delay_queues = set()
+            if self._confirm_delivery:
+                # a blocking channel in confirm mode waits for every single
+                # confirm, so batches are committed as one transaction instead:
+                # tx_commit returns once the broker has taken the whole batch
+                self._publish_channel.tx_select()
+        return self._publish_channel
+
+    def _queue_for(self, saga_id: str) -> str:
+        if not self._partitions:
+            return self._queue
+        return partition_queue(self._queue, partition_for(saga_id, self._partitions))
+
+    def _publish(self, payload, delay_ms: Optional[int] = None):
+        saga_id = payload["saga_id"]
+        traced = self._tracer is not None and self._tracer.sampled(saga_id)
+        start = time.perf_counter()
+        body, content_type, content_encoding = encode_command(
+            self._codec, payload, self._claim_check
+        )
+        if traced:
+            self._tracer.record(
+                saga_id,
+                "encode",
+                "codec",
+                start,
+                time.perf_counter() - start,
+                args={"bytes": len(body)},
+                flow_out=payload.get("trace"),
+            )
+        properties = pika.BasicProperties(
+            content_type=content_type,
+            content_encoding=content_encoding,
+            expiration=str(delay_ms) if delay_ms else None,
+            headers=sent_at_headers((delay_ms or 0) / 1000),
+        )
+        publish = (self._queue_for(saga_id), body, properties, delay_ms)
+        if self._confirm_delivery:
+            # published with the rest of the batch, not traced per saga
+            self._pending_publishes.append(publish)
+            return
+        self._state_repository.flush()
+        start = time.perf_counter()
+        self._basic_publish(self._get_publish_channel(), *publish)
+        if traced:
+            self._tracer.record(
+                saga_id, "publish", "publish", start, time.perf_counter() - start
+            )
+
+    def _basic_publish(
+        self, channel, queue: str, body: bytes, properties, delay_ms: Optional[int]
+    ):
+        if self._metrics is None:
+            self._publish_command(channel, queue, body, properties, delay_ms)
+            return
+        start = time.perf_counter()
+        self._publish_command(channel, queue, body, properties, delay_ms)
+        self._metrics.publish_seconds.observe(
+            time.perf_counter() - start, ("delayed" if delay_ms else "command",)
         )
-        channel.close()
 
-    def _send_compensation_command(self, payload):
-        channel = self._rabbitmq_connection.channel()
+    def _publish_command(
+        self, channel, queue: str, body: bytes, properties, delay_ms: Optional[int]
+    ):
+        if not delay_ms:
+            channel.basic_publish(
+                exchange=self._exchange,
+                routing_key=queue,
+                body=body,
+                properties=properties,
+            )
+            return
+        # the command waits in a queue without consumers until it expires and
+        # is dead-lettered back to its saga queue. a queue only expires its
+        # head, so delays are bucketed by power of two: a command never waits
+        # behind one with more than twice its delay
+        delay_queue = f"{queue}.delay.{1 << (delay_ms - 1).bit_length()}"
+        if delay_queue not in self._delay_queues:
+            channel.queue_declare(
+                queue=delay_queue,
+                arguments={
+                    "x-dead-letter-exchange": self._exchange,
+                    "x-dead-letter-routing-key": queue,
+                },
+            )
+            self._delay_queues.add(delay_queue)
+        # delay queues are written to directly through the default exchange
         channel.basic_publish(
-            exchange=self._exchange,
-            routing_key=self._queue,
-            body=json.dumps(payload),
+            exchange="", routing_key=delay_queue, body=body, properties=properties
         )
-        channel.close()
+
+    def _send_delayed_command(self, payload, delay: float):
+        self._publish(payload, delay_ms=max(1, int(delay * 1000)))
+
+    def _send_next_step_command(self, payload):
+        self._publish(payload)
+
+    def _send_compensation_command(self, payload):
+        self._publish(payload)
+
+    def _flush(self):
+        if self._flush_timer is not None:
+            self._rabbitmq_connection.remove_timeout(self._flush_timer)
+            self._flush_timer = None
+        if self._pending_publishes:
+            # one state flush covers every saga in the batch
+            self._state_repository.flush()
+            channel = self._get_publish_channel()
+            for publish in self._pending_publishes:
+                self._basic_publish(channel, *publish)
+            start = time.perf_counter()
+            channel.tx_commit()
+            if self._metrics is not None:
+                self._metrics.publish_seconds.observe(
+                    time.perf_counter() - start, ("commit",)
+                )
+            self._pending_publishes = []
+        if self._pending_acks:
+            self._record_handled([key for _, _, key, _ in self._pending_acks])
+            # deliveries are handled in order, so one multiple-ack covers the
+            # whole batch once the commands they produced are committed
+            ch, delivery_tag, _, _ = self._pending_acks[-1]
+            ch.basic_ack(delivery_tag=delivery_tag, multiple=True)
+            self._settled(
+                [m for _, _, _, handled in self._pending_acks for m in handled]
+            )
+            self._pending_acks = []
+
+    def _record_handled(self, keys: List[Optional[str]]):
+        # between publishing what a message produced and acking it, so a
+        # redelivery after a crash is recognized
+        if self._idempotency_guard is None:
+            return
+        for key in keys:
+            self._idempotency_guard.record(key)
 
     def _callback(self, ch, method, properties, body):
-        message = json.loads(body)
-        self._handle_message(message)
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        if self._metrics is not None:
+            self._metrics.consumed(method.routing_key, properties.headers)
+        message = self._codec.decode(
+            body, properties.content_type, properties.content_encoding
+        )
+        key = message_key(message) if self._idempotency_guard else None
+        if key is not None and self._idempotency_guard.seen(key, method.redelivered):
+            if self._metrics is not None:
+                self._metrics.duplicates.inc((method.routing_key,))
+            key = None
+            handled = []
+        else:
+            handled = self._handle_message(message)
+        if not self._confirm_delivery:
+            self._record_handled([key])
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            self._settled(handled)
+            return
+        self._pending_acks.append((ch, method.delivery_tag, key, handled))
+        if len(self._pending_acks) >= self._confirm_batch_size:
+            self._flush()
+        elif self._flush_timer is None:
+            self._flush_timer = self._rabbitmq_connection.call_later(
+                self._confirm_batch_interval, self._flush
+            )
+
+    def _declare_queue(self, channel, queue: str, arguments=None):
+        channel.queue_declare(queue=queue, arguments=arguments)
+        channel.queue_bind(exchange=self._exchange, queue=queue, routing_key=queue)
+
+    def _rebalance(self):
+        if self._membership is None:
+            owned = set(range(self._partitions))
+        else:
+            self._membership.heartbeat(self._member_id)
+            assignment = assign_partitions(self._partitions, self._membership.members())
+            owned = set(assignment.get(self._member_id, []))
+        lost = self._consumers.keys() - owned
+        gained = owned - self._consumers.keys()
+        if lost:
+            # settle what was handled before giving partitions away
+            self._flush()
+        for partition in lost:
+            self._consume_channel.basic_cancel(self._consumers.pop(partition))
+        for partition in gained:
+            self._consumers[partition] = self._consume_channel.basic_consume(
+                partition_queue(self._queue, partition), self._callback
+            )
+        if lost or gained:
+            print(" [x] Consuming partitions %r" % sorted(owned))
+        if self._membership is not None:
+            self._rabbitmq_connection.call_later(
+                self._rebalance_interval, self._rebalance
+            )
 
     def run(self):
         channel = self._rabbitmq_connection.channel()
-        channel.queue_declare(queue=self._queue)
         channel.exchange_declare(exchange=self._exchange)
-        channel.queue_bind(
-            exchange=self._exchange, queue=self._queue, routing_key=self._queue
-        )
-        channel.basic_qos(prefetch_count=1)
-        channel.basic_consume(self._queue, self._callback)
-        channel.start_consuming()
+        channel.basic_qos(prefetch_count=self._prefetch_count)
+        self._consume_channel = channel
+        if not self._partitions:
+            self._declare_queue(channel, self._queue)
+            channel.basic_consume(self._queue, self._callback)
+        else:
+            for partition in range(self._partitions):
+                # a single active consumer per partition keeps the steps of a
+                # saga in order, also while a partition moves to another
+                # controller
+                self._declare_queue(
+                    channel,
+                    partition_queue(self._queue, partition),
+                    {"x-single-active-consumer": True},
+                )
+            self._rebalance()
+        try:
+            channel.start_consuming()
+        finally:
+            if self._rabbitmq_connection.is_open:
+                self._flush()
+            if self._membership is not None:
+                self._membership.leave(self._member_id)
+            self._shutdown()
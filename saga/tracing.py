@@ -0,0 +1,197 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from typing import List, Optional
+
+
+def _track(saga_id: str) -> int:
+    # every saga is a process in the trace viewer, so its spans from all
+    # controllers line up on one track
+    return zlib.crc32(saga_id.encode()) & 0x7FFFFFFF
+
+
+class SagaTracer:
+    # records spans for a sample of sagas as chrome trace events. whether a
+    # saga is sampled only depends on its id, so every process traces the
+    # same sagas; commands carry a trace header that links the span that
+    # produced them to the step they start in the next process
+    def __init__(
+        self,
+        folder: str,
+        sample_rate: float = 0.01,
+        process_name: str = "controller",
+        flush_every: int = 1000,
+        flush_interval: Optional[float] = 5.0,
+    ):
+        self._sample_rate = sample_rate
+        self._process_name = process_name
+        # buffered events are written every flush_every events and at least
+        # every flush_interval seconds, so a quiet process still writes them
+        self._flush_every = flush_every
+        self._tid = os.getpid()
+        # perf_counter for durations, wall time so processes line up
+        self._offset = time.time() - time.perf_counter()
+        self._lock = threading.Lock()
+        self._events = []
+        self._tracks = set()
+        os.makedirs(folder, exist_ok=True)
+        self.path = os.path.join(folder, f"trace-{process_name}-{self._tid}.json")
+        self._file = open(self.path, "a")
+        if self._file.tell() == 0:
+            # the array format may be left unclosed, so events can be appended
+            self._file.write("[\n")
+        self._closed = threading.Event()
+        self._flush_thread = None
+        if flush_interval:
+            self._flush_thread = threading.Thread(
+                target=self._flush_periodically, args=(flush_interval,), daemon=True
+            )
+            self._flush_thread.start()
+
+    def sampled(self, saga_id: str) -> bool:
+        if self._sample_rate >= 1:
+            return True
+        digest = hashlib.blake2b(saga_id.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big") < self._sample_rate * 2**64
+
+    def new_flow(self) -> dict:
+        # the trace header of a command
+        return {"flow": random.getrandbits(52)}
+
+    def _metadata(self, pid: int, saga_id: str) -> List[dict]:
+        if pid in self._tracks:
+            return []
+        self._tracks.add(pid)
+        return [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": f"saga {saga_id}"},
+            },
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": self._tid,
+                "args": {"name": f"{self._process_name} ({self._tid})"},
+            },
+        ]
+
+    def record(
+        self,
+        saga_id: str,
+        name: str,
+        category: str,
+        start: float,
+        duration: float,
+        args: Optional[dict] = None,
+        flow_in: Optional[dict] = None,
+        flow_out: Optional[dict] = None,
+    ):
+        # start is a time.perf_counter() value, duration is in seconds
+        pid = _track(saga_id)
+        ts = (start + self._offset) * 1e6
+        events = [
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": ts,
+                "dur": duration * 1e6,
+                "pid": pid,
+                "tid": self._tid,
+                "args": dict(args or {}, saga_id=saga_id),
+            }
+        ]
+        flow = {"name": "command", "cat": "flow", "pid": pid, "tid": self._tid}
+        if flow_in:
+            events.append(dict(flow, ph="f", bp="e", id=flow_in["flow"], ts=ts))
+        if flow_out:
+            # inside the span so the viewer binds the arrow to it
+            ts_out = ts + duration * 1e6 / 2
+            events.append(dict(flow, ph="s", id=flow_out["flow"], ts=ts_out))
+        with self._lock:
+            self._events.extend(self._metadata(pid, saga_id))
+            self._events.extend(events)
+            if len(self._events) >= self._flush_every:
+                self._flush()
+
+    def _flush(self):
+        if not self._events or self._file is None:
+            return
+        self._file.write("".join(json.dumps(e) + ",\n" for e in self._events))
+        self._file.flush()
+        self._events = []
+        if len(self._tracks) > 100000:
+            # repeated metadata is harmless, an unbounded set is not
+            self._tracks = set()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush_periodically(self, interval: float):
+        while not self._closed.wait(interval):
+            self.flush()
+
+    def close(self):
+        self._closed.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join()
+        with self._lock:
+            self._flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def load_trace(path: str) -> List[dict]:
+    with open(path) as f:
+        data = f.read().strip()
+    if data.startswith("{"):
+        return json.loads(data)["traceEvents"]
+    # an unclosed array, possibly with a trailing comma or a torn last event
+    lines = [
+        line.rstrip(",")
+        for line in data.splitlines()[1:]
+        if line.strip() not in ("", "]")
+    ]
+    events = []
+    for line in lines:
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            break
+    return events
+
+
+def merge_traces(paths: List[str], output: str, saga_id: Optional[str] = None) -> int:
+    # one file for the trace viewer from the files of several processes,
+    # optionally only the spans of one saga
+    events = [event for path in paths for event in load_trace(path)]
+    if saga_id is not None:
+        pid = _track(saga_id)
+        events = [event for event in events if event.get("pid") == pid]
+    with open(output, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return len(events)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge saga traces")
+    parser.add_argument("output")
+    parser.add_argument("traces", nargs="+")
+    parser.add_argument("--saga", help="only keep the spans of this saga")
+    arguments = parser.parse_args()
+    count = merge_traces(arguments.traces, arguments.output, arguments.saga)
+    print(f"{count} events written to {arguments.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,45 @@
 import json
 import os
+from typing import Dict, Iterable, List, Optional
+
+from common.atomic import write_json_atomic
+from common.cache import LRUCache
+from common.logstore import LogStore
+from common.sqlite import SqliteConnectionPool
 
 from .repo import Subscription, SubscriptionRepository
 
 
+def _file_version(stat: os.stat_result):
+    # changes made by other processes show up as a new inode, mtime or size
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
 class JsonSubscriptionAdapter(SubscriptionRepository):
-    def __init__(self, folder):
+    def __init__(self, folder, cache_size: int = 0, sync: bool = False):
         self.folder = folder
+        self._cache = LRUCache(cache_size) if cache_size else None
+        self._sync = sync
 
     def _get_file_name(self, sub_id):
         return self.folder + f"/{sub_id}.json"
 
+    def _write(self, subscription: Subscription):
+        file_name = self._get_file_name(subscription.id)
+        write_json_atomic(file_name, subscription.dict(), self._sync)
+        if self._cache is not None:
+            version = _file_version(os.stat(file_name))
+            self._cache.put(subscription.id, subscription.copy(), version)
+
     def save(self, subscription: Subscription):
-        with open(self._get_file_name(subscription.id), "w") as f:
-            json.dump(subscription.dict(), f)
+        self._write(subscription)
 
     def update(self, subscription: Subscription):
-        with open(self._get_file_name(subscription.id), "w") as f:
-            json.dump(subscription.dict(), f)
+        self._write(subscription)
 
     def find(self, sub_id):
+        if self._cache is not None:
+            return self._find_cached(sub_id)
         # check if not exist file
         if not os.path.exists(self._get_file_name(sub_id)):
             return None
@@ -27,3 +47,135 @@ class JsonSubscriptionAdapter(SubscriptionRepository):
         with open(self._get_file_name(sub_id), "r") as f:
             data = json.load(f)
             return Subscription(**data)
+
+    def _find_cached(self, sub_id):
+        file_name = self._get_file_name(sub_id)
+        try:
+            version = _file_version(os.stat(file_name))
+        except FileNotFoundError:
+            self._cache.pop(sub_id)
+            return None
+        sub = self._cache.get(sub_id, version)
+        if sub is None:
+            with open(file_name, "r") as f:
+                sub = Subscription(**json.load(f))
+            self._cache.put(sub_id, sub.copy(), version)
+            return sub
+        return sub.copy()
+
+    def cache_stats(self) -> Optional[dict]:
+        return self._cache.stats() if self._cache is not None else None
+
+
+class LogSubscriptionAdapter(SubscriptionRepository):
+    def __init__(self, folder: str, **store_options):
+        self._store = LogStore(folder, **store_options)
+
+    def _write(self, subscription: Subscription):
+        self._store.put(subscription.id, json.dumps(subscription.dict()).encode())
+
+    def save(self, subscription: Subscription):
+        self._write(subscription)
+
+    def update(self, subscription: Subscription):
+        self._write(subscription)
+
+    def find(self, sub_id):
+        data = self._store.get(sub_id)
+        if data is None:
+            return None
+        return Subscription(**json.loads(data))
+
+    def close(self):
+        self._store.close()
+
+
+_CREATE_SUBSCRIPTIONS = (
+    "CREATE TABLE IF NOT EXISTS subscriptions ("
+    "id TEXT PRIMARY KEY, account_id TEXT NOT NULL, price REAL NOT NULL, "
+    "state TEXT NOT NULL)"
+)
+_CREATE_SUBSCRIPTIONS_ACCOUNT_INDEX = (
+    "CREATE INDEX IF NOT EXISTS subscriptions_account_id "
+    "ON subscriptions (account_id)"
+)
+_UPSERT_SUBSCRIPTION = (
+    "INSERT INTO subscriptions (id, account_id, price, state) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(id) DO UPDATE SET account_id = excluded.account_id, "
+    "price = excluded.price, state = excluded.state"
+)
+_SELECT_SUBSCRIPTION = (
+    "SELECT id, account_id, price, state FROM subscriptions WHERE id = ?"
+)
+_SELECT_ACCOUNT_SUBSCRIPTIONS = (
+    "SELECT id, account_id, price, state FROM subscriptions WHERE account_id = ?"
+)
+# sqlite limits the number of bound parameters per statement
+_FIND_MANY_CHUNK = 500
+
+
+def _subscription_row(subscription: Subscription):
+    return (
+        subscription.id,
+        subscription.account_id,
+        subscription.price,
+        subscription.state,
+    )
+
+
+def _subscription_from_row(row) -> Subscription:
+    return Subscription(id=row[0], account_id=row[1], price=row[2], state=row[3])
+
+
+class SqliteSubscriptionRepository(SubscriptionRepository):
+    def __init__(self, path: str):
+        self._pool = SqliteConnectionPool(path)
+        connection = self._pool.connection()
+        connection.execute(_CREATE_SUBSCRIPTIONS)
+        connection.execute(_CREATE_SUBSCRIPTIONS_ACCOUNT_INDEX)
+
+    def save(self, subscription: Subscription):
+        self._pool.connection().execute(
+            _UPSERT_SUBSCRIPTION, _subscription_row(subscription)
+        )
+
+    def update(self, subscription: Subscription):
+        self.save(subscription)
+
+    def find(self, sub_id):
+        row = (
+            self._pool.connection().execute(_SELECT_SUBSCRIPTION, (sub_id,)).fetchone()
+        )
+        if row is None:
+            return None
+        return _subscription_from_row(row)
+
+    def save_many(self, subscriptions: List[Subscription]):
+        with self._pool.transaction() as connection:
+            connection.executemany(
+                _UPSERT_SUBSCRIPTION, [_subscription_row(s) for s in subscriptions]
+            )
+
+    def find_many(self, sub_ids: Iterable[str]) -> Dict[str, Subscription]:
+        sub_ids = list(sub_ids)
+        connection = self._pool.connection()
+        subscriptions = {}
+        for start in range(0, len(sub_ids), _FIND_MANY_CHUNK):
+            chunk = sub_ids[start : start + _FIND_MANY_CHUNK]
+            rows = connection.execute(
+                "SELECT id, account_id, price, state FROM subscriptions "
+                "WHERE id IN (%s)" % ",".join("?" * len(chunk)),
+                chunk,
+            )
+            for row in rows:
+                subscriptions[row[0]] = _subscription_from_row(row)
+        return subscriptions
+
+    def find_by_account(self, account_id: str) -> List[Subscription]:
+        rows = self._pool.connection().execute(
+            _SELECT_ACCOUNT_SUBSCRIPTIONS, (account_id,)
+        )
+        return [_subscription_from_row(row) for row in rows]
+
+    def close(self):
+        self._pool.close()
@@ -1,8 +1,6 @@
 import pydantic
-from config import settings
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 
-from .adapter import JsonSubscriptionAdapter
 from .model import Subscription
 from .service import CreateSubscriptionCommand, SubscriptionService
 
@@ -14,10 +12,14 @@ class CreateSubscriptionAPIRequest(pydantic.BaseModel):
     price: float = pydantic.Field(..., ge=0)
 
 
+def get_subscription_service(request: Request) -> SubscriptionService:
+    return request.app.state.container.get("subscription_service")
+
+
 @router.get("/{sub_id}", response_model=Subscription)
-def get_subscription(sub_id: str):
-    repo = JsonSubscriptionAdapter(settings.subscription_database_folder)
-    service = SubscriptionService(repo)
+def get_subscription(
+    sub_id: str, service: SubscriptionService = Depends(get_subscription_service)
+):
     sub = service.get(sub_id)
     if not sub:
         raise HTTPException(
@@ -27,9 +29,10 @@ def get_subscription(sub_id: str):
 
 
 @router.post("/", response_model=Subscription)
-def create_subscription(command: CreateSubscriptionAPIRequest):
-    repo = JsonSubscriptionAdapter(settings.subscription_database_folder)
-    service = SubscriptionService(repo)
+def create_subscription(
+    command: CreateSubscriptionAPIRequest,
+    service: SubscriptionService = Depends(get_subscription_service),
+):
     command = CreateSubscriptionCommand(
         account_id=command.account_id, price=command.price
     )
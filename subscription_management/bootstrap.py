@@ -0,0 +1,42 @@
+import os
+
+from common.container import Container, close_resource
+from config import settings
+
+from .adapter import (
+    JsonSubscriptionAdapter,
+    LogSubscriptionAdapter,
+    SqliteSubscriptionRepository,
+)
+from .repo import SubscriptionRepository
+from .service import SubscriptionService
+
+
+def build_subscription_repository() -> SubscriptionRepository:
+    if settings.subscription_database_backend == "log":
+        return LogSubscriptionAdapter(
+            settings.subscription_database_folder,
+            compaction_interval=settings.log_store_compaction_interval,
+        )
+    if settings.subscription_database_backend == "sqlite":
+        return SqliteSubscriptionRepository(
+            os.path.join(settings.subscription_database_folder, "subscriptions.sqlite3")
+        )
+    return JsonSubscriptionAdapter(
+        settings.subscription_database_folder,
+        cache_size=settings.subscription_cache_size,
+    )
+
+
+def register_subscription_services(container: Container):
+    container.register(
+        "subscription_repository",
+        lambda c: build_subscription_repository(),
+        close=close_resource,
+    )
+    container.register(
+        "subscription_service",
+        lambda c: SubscriptionService(
+            subscription_repository=c.get("subscription_repository")
+        ),
+    )
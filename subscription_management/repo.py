@@ -1,4 +1,4 @@
-from typing import Union
+from typing import Dict, Iterable, List, Union
 from .model import CreateSubscriptionSagaState, Subscription
 
 
@@ -12,6 +12,18 @@ class SubscriptionRepository:
     def update(self, subscription: Subscription):
         raise NotImplementedError()
 
+    def save_many(self, subscriptions: List[Subscription]):
+        for subscription in subscriptions:
+            self.save(subscription)
+
+    def find_many(self, sub_ids: Iterable[str]) -> Dict[str, Subscription]:
+        subscriptions = {}
+        for sub_id in sub_ids:
+            subscription = self.find(sub_id)
+            if subscription is not None:
+                subscriptions[sub_id] = subscription
+        return subscriptions
+
 
 class CreateSubscriptionSagaStateRepo:
     def save(self, state: CreateSubscriptionSagaState):
@@ -1,21 +1,21 @@
 import pika
 
-from common.publisher import RabbitMQPublisher
+from common.container import Container
+from common.publisher import register_publisher
 from common.worker.rabbitmq_worker import RabbitmqWorker
 from config import settings
-from subscription_management.adapter import JsonSubscriptionAdapter
-from subscription_management.service import (
-    CreateSubscriptionCommand,
-    SubscriptionService,
-)
+from saga.codec import create_codec
+from saga.idempotency import create_idempotency_guard
+from saga.metrics import WorkerMetrics, serve_metrics
+from subscription_management.bootstrap import register_subscription_services
+from subscription_management.service import CreateSubscriptionCommand
 
 
-def subscribe_factory(publisher_connection, exchange, queue):
-    publisher = RabbitMQPublisher(publisher_connection)
+def subscribe_factory(container, exchange, queue):
+    service = container.get("subscription_service")
+    publisher = container.get("publisher")
 
     def create_sub_handler(message: dict):
-        repo = JsonSubscriptionAdapter(settings.subscription_database_folder)
-        service = SubscriptionService(subscription_repository=repo)
         command_id = message.get("command_id")
         command = CreateSubscriptionCommand(
             account_id=message["account_id"], price=message["price"]
@@ -45,12 +45,11 @@ def subscribe_factory(publisher_connection, exchange, queue):
     return create_sub_handler
 
 
-def accept_subscribe_factory(publisher_connection, exchange, queue):
-    publisher = RabbitMQPublisher(publisher_connection)
+def accept_subscribe_factory(container, exchange, queue):
+    service = container.get("subscription_service")
+    publisher = container.get("publisher")
 
     def accept_subscribe_handler(message: dict):
-        repo = JsonSubscriptionAdapter(settings.subscription_database_folder)
-        service = SubscriptionService(subscription_repository=repo)
         command_id = message.get("command_id")
         sub_id = message["subscription_id"]
         try:
@@ -78,12 +77,11 @@ def accept_subscribe_factory(publisher_connection, exchange, queue):
     return accept_subscribe_handler
 
 
-def reject_subscribe_factory(publisher_connection, exchange, queue):
-    publisher = RabbitMQPublisher(publisher_connection)
+def reject_subscribe_factory(container, exchange, queue):
+    service = container.get("subscription_service")
+    publisher = container.get("publisher")
 
     def reject_subscribe_handler(message: dict):
-        repo = JsonSubscriptionAdapter(settings.subscription_database_folder)
-        service = SubscriptionService(subscription_repository=repo)
         command_id = message.get("command_id")
         sub_id = message["subscription_id"]
         try:
@@ -115,18 +113,32 @@ def main():
     connection = pika.BlockingConnection(
         pika.URLParameters(settings.subscription_worker_amqp_uri)
     )
-    publisher_connection = pika.BlockingConnection(
-        pika.URLParameters(settings.saga_amqp_uri)
-    )
+    container = Container()
+    register_subscription_services(container)
+    codec = create_codec(settings.message_codec, settings.message_compress_threshold)
+    register_publisher(container, settings.saga_amqp_uri, codec)
+    metrics = None
+    if settings.subscription_worker_metrics_port:
+        serve_metrics(settings.subscription_worker_metrics_port)
+        metrics = WorkerMetrics()
     worker = RabbitmqWorker(
         connection,
         settings.subscription_worker_exchange,
         settings.subscription_worker_queue,
+        prefetch_count=settings.subscription_worker_prefetch_count,
+        max_workers=settings.subscription_worker_concurrency,
+        ordering_key="subscription_id",
+        container=container,
+        codec=codec,
+        idempotency_guard=create_idempotency_guard(
+            settings.idempotency_capacity, settings.idempotency_redis_url
+        ),
+        metrics=metrics,
     )
     worker.register_callback(
         "subscribe",
         subscribe_factory(
-            publisher_connection,
+            container,
             exchange=settings.saga_exchange,
             queue=settings.saga_queue,
         ),
@@ -134,7 +146,7 @@ def main():
     worker.register_callback(
         "accept_subscribe",
         accept_subscribe_factory(
-            publisher_connection,
+            container,
             settings.saga_exchange,
             settings.saga_queue,
         ),
@@ -142,7 +154,7 @@ def main():
     worker.register_callback(
         "reject_subscribe",
         reject_subscribe_factory(
-            publisher_connection,
+            container,
             settings.saga_exchange,
             settings.saga_queue,
         ),
@@ -3,6 +3,7 @@ import json
 import pika
 
 from config import settings
+from saga.metrics import SagaMetrics, serve_metrics
 from saga.saga import (
     RabbitMQSagaExecutionController,
     Saga,
@@ -20,6 +21,15 @@ class SagaStateRepositoryMock(SagaStateRepository):
         with open(self._file_name, "a") as f:
             f.write(json.dumps(data) + "\n")
 
+    def saga_started(self, saga_id: str, saga_name: str, step_name: str):
+        data = {
+            "status": "started",
+            "saga_id": saga_id,
+            "saga_name": saga_name,
+            "step_name": step_name,
+        }
+        self.save(data)
+
     def action_started(self, saga_id: str, step_name: str):
         data = {
             "status": "running",
@@ -106,6 +116,45 @@ class SagaStateRepositoryMock(SagaStateRepository):
         }
         self.save(data)
 
+    def step_retried(
+        self,
+        saga_id: str,
+        step_name: str,
+        step_type: str,
+        attempt: int,
+        error_type: str,
+        error: str,
+    ):
+        data = {
+            "status": "running" if step_type == "action" else "compensation",
+            "step_status": f"{step_type}_retried",
+            "saga_id": saga_id,
+            "step_name": step_name,
+            "attempt": attempt,
+            "error_type": error_type,
+            "error": error,
+        }
+        self.save(data)
+
+    def group_step_finished(
+        self, saga_id: str, group_name: str, phase: str, step_name: str, outcome: dict
+    ):
+        outcomes = self._state.setdefault((saga_id, group_name, phase), {})
+        if step_name in outcomes:
+            return None
+        outcomes[step_name] = outcome
+        data = {
+            "status": "running" if phase == "action" else "compensation",
+            "step_status": "group_step_finished",
+            "saga_id": saga_id,
+            "group_name": group_name,
+            "phase": phase,
+            "step_name": step_name,
+            "outcome": outcome,
+        }
+        self.save(data)
+        return dict(outcomes)
+
 
 def error_func(x):
     raise Exception(f"ERROR + {x}")
@@ -126,11 +175,16 @@ def main():
     rabbitmq_connection = pika.BlockingConnection(
         pika.URLParameters(settings.saga_amqp_uri)
     )
+    metrics = None
+    if settings.saga_controller_metrics_port:
+        serve_metrics(settings.saga_controller_metrics_port)
+        metrics = SagaMetrics()
     rabbitmq_sec = RabbitMQSagaExecutionController(
         saga_state_repository=saga_state_repository,
         rabbitmq_connection=rabbitmq_connection,
         exchange=settings.saga_exchange,
         queue=settings.saga_queue,
+        metrics=metrics,
     )
     saga = Saga(name="saga")
     step1 = SagaStep(
@@ -157,4 +211,5 @@ def main():
     rabbitmq_sec.run()
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+import pytest
+
+
+@pytest.fixture
+def settings_env(monkeypatch, tmp_path):
+    # the settings config.py needs, for tests that import it
+    for name in (
+        "account_worker_amqp_uri",
+        "account_worker_queue",
+        "account_withdraw_response_exchange",
+        "account_withdraw_response_queue",
+        "subscription_worker_amqp_uri",
+        "subscription_worker_queue",
+        "saga_amqp_uri",
+        "saga_queue",
+    ):
+        monkeypatch.setenv(name, "test")
+    monkeypatch.setenv("account_database_folder", str(tmp_path / "accounts"))
+    monkeypatch.setenv("subscription_database_folder", str(tmp_path / "subs"))
@@ -0,0 +1,105 @@
+import pytest
+
+from account_management.logic import AccountService, BalanceOperation
+from account_management.model import Account
+from account_management.repo import AccountRepository
+from common.container import Container
+
+
+class MemoryAccountRepository(AccountRepository):
+    def __init__(self, accounts, broken=()):
+        self.accounts = {a.id: a.copy() for a in accounts}
+        self._broken = set(broken)
+
+    def find(self, account_id):
+        account = self.accounts.get(account_id)
+        return account.copy() if account else None
+
+    def update(self, account):
+        if account.id in self._broken:
+            raise IOError(f"cannot write {account.id}")
+        self.accounts[account.id] = account.copy()
+
+
+class Publisher:
+    def __init__(self):
+        self.published = []
+
+    def publish_many(self, messages, exchange, queue):
+        self.published.extend(messages)
+
+
+def operation(type, account_id, amount, command_id):
+    return BalanceOperation(
+        type=type, account_id=account_id, amount=amount, command_id=command_id
+    )
+
+
+def test_batch_applies_operations_per_account_in_order():
+    repository = MemoryAccountRepository([Account(id="a", balance=10)])
+    results = AccountService(repository).apply_batch(
+        [
+            operation("withdraw", "a", 15, "1"),
+            operation("deposit", "a", 10, "2"),
+            operation("withdraw", "a", 15, "3"),
+            operation("deposit", "missing", 1, "4"),
+        ]
+    )
+    assert [r.status for r in results] == ["failed", "succeeded", "succeeded", "failed"]
+    assert [r.account.balance for r in results[1:3]] == [20, 5]
+    assert repository.accounts["a"].balance == 5
+
+
+def test_write_failure_only_fails_its_account():
+    repository = MemoryAccountRepository(
+        [Account(id="a", balance=10), Account(id="b", balance=10)], broken={"a"}
+    )
+    results = AccountService(repository).apply_batch(
+        [
+            operation("deposit", "a", 5, "1"),
+            operation("deposit", "b", 5, "2"),
+            operation("withdraw", "a", 1, "3"),
+        ]
+    )
+    assert [r.status for r in results] == ["failed", "succeeded", "failed"]
+    assert results[0].reason == "cannot write a"
+    assert results[1].account.balance == 15
+    assert repository.accounts["a"].balance == 10
+    assert repository.accounts["b"].balance == 15
+
+
+def test_worker_replies_to_every_command_of_the_batch(settings_env):
+    from account_worker import apply_balance_batch_factory
+
+    repository = MemoryAccountRepository(
+        [Account(id="a", balance=10), Account(id="b", balance=10)], broken={"a"}
+    )
+    publisher = Publisher()
+    container = Container()
+    container.register("account_service", lambda c: AccountService(repository))
+    container.register("publisher", lambda c: publisher)
+    apply_balance_batch = apply_balance_batch_factory(container, "saga", "replies")
+    apply_balance_batch(
+        [
+            {
+                "type": "deposit_account_balance",
+                "account_id": "a",
+                "amount": 1,
+                "command_id": "1",
+            },
+            {
+                "type": "withdraw_account_balance",
+                "account_id": "b",
+                "amount": 4,
+                "command_id": "2",
+            },
+        ]
+    )
+    assert publisher.published == [
+        {"command_id": "1", "status": "failed", "reason": "cannot write a"},
+        {
+            "command_id": "2",
+            "status": "succeeded",
+            "account": {"id": "b", "balance": 6},
+        },
+    ]
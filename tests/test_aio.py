@@ -0,0 +1,189 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from saga.aio import AioPikaSagaExecutionController, AsyncSagaExecutionController
+from saga.codec import MessageCodec
+from saga.recovery import RecoveryJournal
+from saga.saga import EventSagaStateRepository, Saga, SagaStep
+
+
+class ThreadRecordingRepository(EventSagaStateRepository):
+    def __init__(self):
+        super().__init__()
+        self.events = []
+        self.threads = set()
+
+    def _record(self, events):
+        self.threads.add(threading.get_ident())
+        self.events.extend(events)
+
+
+class ListSagaExecutionController(AsyncSagaExecutionController):
+    def __init__(self, repository, **options):
+        super().__init__(repository, **options)
+        self.sent = []
+
+    async def _send_next_step_command(self, payload):
+        self.sent.append(payload)
+
+    async def _send_compensation_command(self, payload):
+        self.sent.append(payload)
+
+
+def make_saga():
+    async def withdraw(message):
+        await asyncio.sleep(0)
+        return message["payload"]
+
+    def fail(message):
+        raise ValueError("no such account")
+
+    saga = Saga("transfer")
+    saga.add_step(SagaStep("withdraw", withdraw, lambda message: None))
+    saga.add_step(SagaStep("deposit", fail, lambda message: None))
+    return saga
+
+
+def command(step_name, saga_id="s1", step_type="action"):
+    return {
+        "saga_id": saga_id,
+        "saga_name": "transfer",
+        "step_name": step_name,
+        "step_type": step_type,
+        "payload": {"amount": 1},
+    }
+
+
+@pytest.mark.parametrize("offload", [True, False])
+def test_repository_calls_run_off_the_loop(offload):
+    repository = ThreadRecordingRepository()
+    controller = ListSagaExecutionController(repository, offload_repository=offload)
+    controller.add_saga(make_saga())
+
+    async def run():
+        await controller.submit(command("withdraw"))
+        await controller.join()
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert [e.get("step_status") for e in repository.events] == [
+        "action_started",
+        "action_succeeded",
+    ]
+    assert [c["step_name"] for c in controller.sent] == ["deposit"]
+    assert (loop_thread in repository.threads) != offload
+
+
+def test_hung_timed_steps_do_not_hold_up_repository_calls():
+    release = threading.Event()
+    saga = Saga("transfer")
+    saga.add_step(
+        SagaStep("withdraw", lambda m: release.wait(5), lambda m: None, timeout=0.05)
+    )
+    quick = Saga("quick")
+    quick.add_step(SagaStep("withdraw", lambda m: m["payload"], lambda m: None))
+    repository = ThreadRecordingRepository()
+    controller = ListSagaExecutionController(repository, timeout_workers=2)
+    controller.add_saga(saga)
+    controller.add_saga(quick)
+
+    async def run():
+        # the repository calls share the loop's executor, kept small here
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(2))
+        try:
+            for index in range(4):
+                await controller.submit(command("withdraw", saga_id=f"hung{index}"))
+            await asyncio.sleep(0.2)
+            task = await controller.submit(dict(command("withdraw"), saga_name="quick"))
+            await asyncio.wait_for(task, 2)
+        finally:
+            release.set()
+        await controller.join()
+
+    try:
+        asyncio.run(run())
+    finally:
+        controller._shutdown()
+    assert {"saga_id": "s1", "status": "completed"} in [
+        {"saga_id": e["saga_id"], "status": e.get("status")} for e in repository.events
+    ]
+
+
+def test_redelivered_command_sends_what_it_sent_before(tmp_path):
+    withdrawals = []
+    saga = Saga("transfer")
+    saga.add_step(SagaStep("withdraw", lambda m: withdrawals.append(1), lambda m: None))
+    saga.add_step(SagaStep("deposit", lambda m: None, lambda m: None))
+
+    def handle(journal, settle):
+        controller = ListSagaExecutionController(
+            ThreadRecordingRepository(), journal=journal
+        )
+        controller.add_saga(saga)
+        if not settle:
+            controller._settled = lambda handled: None
+
+        async def run():
+            await controller.submit(command("withdraw"))
+            await controller.join()
+
+        asyncio.run(run())
+        return controller
+
+    # never settled, as if the controller died before acking
+    first = handle(RecoveryJournal(tmp_path), settle=False)
+    second = handle(RecoveryJournal(tmp_path), settle=True)
+    assert withdrawals == [1]
+    assert second.sent == first.sent
+    assert [c["step_name"] for c in second.sent] == ["deposit"]
+    assert RecoveryJournal(tmp_path).handled_commands() == {}
+
+
+class FakeExchange:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, message, routing_key):
+        self.published.append((routing_key, message))
+
+
+class FakeIncomingMessage:
+    def __init__(self, payload):
+        codec = MessageCodec()
+        self.body, self.content_type, self.content_encoding = codec.encode(payload)
+        self.headers = {}
+        self.redelivered = False
+        self.routing_key = "saga"
+        self.settled = []
+
+    async def ack(self):
+        self.settled.append("ack")
+
+    async def reject(self, requeue=False):
+        self.settled.append(("reject", requeue))
+
+
+def test_failed_command_is_dead_lettered():
+    pytest.importorskip("aio_pika")
+    repository = ThreadRecordingRepository()
+    controller = AioPikaSagaExecutionController(repository, None, "saga", "saga")
+    controller.add_saga(make_saga())
+    exchange = FakeExchange()
+    controller._channel = SimpleNamespace(default_exchange=exchange)
+    # a saga the controller does not know
+    message = FakeIncomingMessage(dict(command("withdraw"), saga_name="unknown"))
+
+    async def run():
+        await controller._callback(message)
+        await controller.join()
+
+    asyncio.run(run())
+    assert message.settled == ["ack"]
+    [(queue, dead)] = exchange.published
+    assert queue == "saga.dead"
+    assert dead.body == message.body
+    assert dead.headers["x-error-type"] == "LookupError"
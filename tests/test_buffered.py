@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+from saga.buffered import BufferedSagaStateRepository
+from saga.saga import EventSagaStateRepository
+
+
+class RecordingRepository(EventSagaStateRepository):
+    def __init__(self, failures=0):
+        super().__init__()
+        self.batches = []
+        self._failures = failures
+
+    def _record(self, events):
+        if self._failures:
+            self._failures -= 1
+            raise IOError("disk full")
+        self.batches.append(events)
+
+    @property
+    def events(self):
+        return [event for batch in self.batches for event in batch]
+
+
+def buffered(repository, **options):
+    # no background flushes unless a test asks for them
+    options.setdefault("flush_interval", 60)
+    return BufferedSagaStateRepository(repository, **options)
+
+
+def test_calls_are_written_on_flush_in_one_batch():
+    repository = RecordingRepository()
+    state = buffered(repository)
+    state.saga_started("s1", "order", "reserve")
+    state.action_started("s1", "reserve")
+    state.action_succeeded("s1", "reserve")
+    assert repository.events == []
+    state.flush()
+    assert len(repository.batches) == 1
+    assert [e.get("step_status") for e in repository.events] == [
+        None,
+        "action_started",
+        "action_succeeded",
+    ]
+    state.close()
+
+
+def test_full_batch_is_written_in_the_background():
+    repository = RecordingRepository()
+    state = buffered(repository, max_batch_size=10, flush_interval=0.01)
+    for index in range(10):
+        state.saga_started(f"s{index}", "order", "reserve")
+    written = threading.Event()
+    for _ in range(500):
+        if len(repository.events) == 10:
+            written.set()
+            break
+        written.wait(0.01)
+    assert written.is_set()
+    state.close()
+
+
+def test_concurrent_flushes_share_writes():
+    repository = RecordingRepository()
+    state = buffered(repository)
+    barrier = threading.Barrier(8)
+    missing = []
+
+    def write(writer):
+        barrier.wait()
+        for index in range(50):
+            saga_id = f"{writer}-{index}"
+            state.saga_started(saga_id, "order", "reserve")
+            state.flush()
+            # a flush returns once what was queued before it is written
+            if saga_id not in {e["saga_id"] for e in repository.events}:
+                missing.append(saga_id)
+
+    threads = [threading.Thread(target=write, args=(w,)) for w in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert missing == []
+    assert len(repository.events) == 400
+    assert len(repository.batches) <= 400
+    state.close()
+
+
+def test_failed_write_is_retried_by_the_next_flush():
+    repository = RecordingRepository(failures=1)
+    state = buffered(repository)
+    state.saga_started("s1", "order", "reserve")
+    with pytest.raises(IOError):
+        state.flush()
+    state.saga_completed("s1")
+    state.flush()
+    assert [e["status"] for e in repository.events] == ["started", "completed"]
+    state.close()
+
+
+def test_close_flushes_and_rejects_later_calls():
+    repository = RecordingRepository()
+    state = buffered(repository)
+    state.saga_started("s1", "order", "reserve")
+    state.close()
+    assert len(repository.events) == 1
+    with pytest.raises(RuntimeError):
+        state.saga_completed("s1")
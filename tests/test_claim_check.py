@@ -0,0 +1,51 @@
+from saga.claim_check import ClaimCheck, ClaimedMessage, FileBlobStore, is_reference
+from saga.codec import JsonCodec, MessageCodec
+from saga.saga import encode_command
+
+
+class CountingCodec(JsonCodec):
+    def __init__(self):
+        self.encoded = 0
+
+    def encode(self, message):
+        self.encoded += 1
+        return super().encode(message)
+
+
+def command(payload):
+    return {
+        "saga_id": "s1",
+        "saga_name": "transfer",
+        "step_name": "withdraw",
+        "step_type": "action",
+        "payload": payload,
+    }
+
+
+def test_small_command_is_encoded_once(tmp_path):
+    codec = CountingCodec()
+    claim_check = ClaimCheck(FileBlobStore(str(tmp_path)), threshold=1024)
+    body, _, _ = encode_command(
+        MessageCodec(codec), command({"amount": 1}), claim_check
+    )
+    assert codec.encoded == 1
+    assert MessageCodec().decode(body)["payload"] == {"amount": 1}
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_large_payload_is_checked_in_and_loaded_lazily(tmp_path):
+    claim_check = ClaimCheck(FileBlobStore(str(tmp_path)), threshold=1024)
+    payload = {"items": ["x" * 100] * 50}
+    body, _, _ = encode_command(MessageCodec(), command(payload), claim_check)
+    assert len(body) < 1024
+    sent = MessageCodec().decode(body)
+    assert is_reference(sent["payload"])
+
+    message = claim_check.wrap(sent)
+    assert isinstance(message, ClaimedMessage)
+    # passed on as the reference, without loading it
+    assert is_reference(dict(message)["payload"])
+    assert message["payload"] == payload
+
+    claim_check.saga_completed("s1")
+    assert not (tmp_path / "s1").exists()
@@ -0,0 +1,58 @@
+import pytest
+
+from saga.saga import Saga, SagaStep, SagaStepGroup
+from tests.test_steps import Steps, run_saga  # noqa: F401
+
+
+def grouped(steps):
+    saga = Saga("order")
+    saga.add_step(steps.step("reserve"))
+    saga.add_step(
+        SagaStepGroup("notify", [steps.step(n) for n in ("email", "sms", "push")])
+    )
+    saga.add_step(steps.step("ship"))
+    return saga
+
+
+@pytest.mark.parametrize("inline", [False, True])
+def test_group_results_are_joined(run_saga, inline):
+    steps = Steps()
+    results = []
+    saga = grouped(steps)
+    saga.add_step(
+        SagaStep("collect", lambda m: results.append(m["payload"]), lambda m: None)
+    )
+    status, _ = run_saga(saga, inline_local_steps=inline)
+    assert status == "completed"
+    group = [name for kind, name in steps.log if name in ("email", "sms", "push")]
+    assert sorted(group) == ["email", "push", "sms"]
+    assert steps.log.index(("action", "ship")) > steps.log.index(("action", "push"))
+    assert results == [{"ship": {n: {n: {"reserve": 1}} for n in group}}]
+
+
+def test_group_failure_compensates_members_then_previous_steps(run_saga):
+    steps = Steps(fail={"sms"})
+    status, _ = run_saga(grouped(steps))
+    assert status == "failed"
+    compensated = [name for kind, name in steps.log if kind == "compensation"]
+    # every member is compensated, the failed one included, before reserve
+    assert sorted(compensated[:3]) == ["email", "push", "sms"]
+    assert compensated[3:] == ["reserve"]
+    assert ("action", "ship") not in steps.log
+
+
+def test_failure_after_group_compensates_every_member(run_saga):
+    steps = Steps(fail={"ship"})
+    status, _ = run_saga(grouped(steps))
+    assert status == "failed"
+    compensated = [name for kind, name in steps.log if kind == "compensation"]
+    assert compensated[0] == "ship"
+    assert sorted(compensated[1:4]) == ["email", "push", "sms"]
+    assert compensated[4:] == ["reserve"]
+
+
+def test_group_member_compensation_failure(run_saga):
+    steps = Steps(fail={"ship"}, fail_compensation={"sms"})
+    status, _ = run_saga(grouped(steps))
+    assert status == "compensation_failed"
+    assert ("compensation", "reserve") not in steps.log
@@ -0,0 +1,188 @@
+import os
+import threading
+
+import pydantic
+import pytest
+
+from common.logstore import LogStore
+
+
+def segments(folder, suffix=".log"):
+    return sorted(name for name in os.listdir(folder) if name.endswith(suffix))
+
+
+def test_reopen_restores_values_and_deletes(tmp_path):
+    store = LogStore(str(tmp_path))
+    store.put("a", b"1")
+    store.put_many([("b", b"2"), ("c", b"3")])
+    store.put("a", b"4")
+    store.delete("b")
+    store.close()
+
+    store = LogStore(str(tmp_path))
+    assert store.get("a") == b"4"
+    assert store.get("b") is None
+    assert store.get("c") == b"3"
+    assert sorted(store.keys()) == ["a", "c"]
+    store.close()
+
+
+def test_folder_is_owned_by_one_store(tmp_path):
+    store = LogStore(str(tmp_path))
+    with pytest.raises(RuntimeError):
+        LogStore(str(tmp_path))
+    store.close()
+    LogStore(str(tmp_path)).close()
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    store = LogStore(str(tmp_path))
+    store.put("a", b"1")
+    store.put("b", b"2")
+    store.close()
+    path = tmp_path / segments(tmp_path)[-1]
+    size = os.path.getsize(path)
+    with open(path, "ab") as f:
+        # half of a record header
+        f.write(b"\x00\x01\x02\x03\x00")
+
+    store = LogStore(str(tmp_path))
+    assert os.path.getsize(path) == size
+    assert store.get("a") == b"1" and store.get("b") == b"2"
+    store.put("c", b"3")
+    store.close()
+    store = LogStore(str(tmp_path))
+    assert store.get("c") == b"3"
+    store.close()
+
+
+def test_corrupt_record_drops_the_rest_of_the_segment(tmp_path):
+    store = LogStore(str(tmp_path))
+    store.put("a", b"1")
+    store.put("b", b"2")
+    store.close()
+    path = tmp_path / segments(tmp_path)[-1]
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b"x")
+
+    store = LogStore(str(tmp_path))
+    assert store.get("a") == b"1"
+    assert store.get("b") is None
+    store.close()
+
+
+def test_sealed_segments_reload_from_hints(tmp_path):
+    store = LogStore(str(tmp_path), max_segment_size=64)
+    for index in range(50):
+        store.put(f"key-{index % 10}", f"value-{index}".encode())
+    store.delete("key-3")
+    store.close()
+    # the active segment has no hint yet
+    assert len(segments(tmp_path, ".hint")) == len(segments(tmp_path)) - 1
+
+    store = LogStore(str(tmp_path), max_segment_size=64)
+    expected = {f"key-{i}": f"value-{40 + i}".encode() for i in range(10)}
+    del expected["key-3"]
+    assert {key: store.get(key) for key in store.keys()} == expected
+    store.close()
+
+
+def test_stale_hint_is_ignored(tmp_path):
+    store = LogStore(str(tmp_path), max_segment_size=64)
+    for index in range(20):
+        store.put(f"key-{index}", b"value")
+    store.close()
+    # a hint written for another version of its segment
+    hint = tmp_path / segments(tmp_path, ".hint")[0]
+    with open(hint, "r+b") as f:
+        f.write(b"\xff" * 8)
+
+    store = LogStore(str(tmp_path), max_segment_size=64)
+    assert len(store) == 20
+    assert all(store.get(f"key-{index}") == b"value" for index in range(20))
+    store.close()
+
+
+def test_compaction_keeps_latest_values(tmp_path):
+    store = LogStore(str(tmp_path), max_segment_size=128)
+    for index in range(200):
+        store.put(f"key-{index % 20}", f"value-{index}".encode())
+    for index in range(0, 20, 4):
+        store.delete(f"key-{index}")
+    before = len(segments(tmp_path))
+    store.compact()
+    assert len(segments(tmp_path)) < before
+    expected = {f"key-{i}": f"value-{180 + i}".encode() for i in range(20) if i % 4}
+    assert {key: store.get(key) for key in store.keys()} == expected
+    store.close()
+
+    store = LogStore(str(tmp_path), max_segment_size=128)
+    assert {key: store.get(key) for key in store.keys()} == expected
+    store.close()
+
+
+def test_compaction_racing_writers(tmp_path):
+    store = LogStore(str(tmp_path), max_segment_size=256)
+    expected = {}
+    stop = threading.Event()
+
+    def write(writer):
+        index = 0
+        while not stop.is_set() or index < 500:
+            key = f"{writer}-{index % 50}"
+            if index % 7 == 0:
+                store.delete(key)
+                expected.pop(key, None)
+            else:
+                value = f"{writer}-{index}".encode()
+                store.put(key, value)
+                expected[key] = value
+            index += 1
+
+    writers = [threading.Thread(target=write, args=(w,)) for w in range(4)]
+    for thread in writers:
+        thread.start()
+    for _ in range(20):
+        store.compact()
+    stop.set()
+    for thread in writers:
+        thread.join()
+    store.compact()
+
+    assert {key: store.get(key) for key in store.keys()} == expected
+    store.close()
+    store = LogStore(str(tmp_path), max_segment_size=256)
+    assert {key: store.get(key) for key in store.keys()} == expected
+    store.close()
+
+
+def test_unfinished_compaction_is_discarded(tmp_path):
+    store = LogStore(str(tmp_path), max_segment_size=64)
+    for index in range(20):
+        store.put(f"key-{index}", b"value")
+    store.close()
+    leftover = tmp_path / (segments(tmp_path)[0] + ".compact")
+    leftover.write_bytes(b"partial")
+
+    store = LogStore(str(tmp_path), max_segment_size=64)
+    assert not leftover.exists()
+    assert len(store) == 20
+    store.close()
+
+
+@pytest.fixture
+def settings_class(settings_env):
+    from config import Settings
+
+    return Settings
+
+
+@pytest.mark.parametrize(
+    "backend", ["account_database_backend", "subscription_database_backend"]
+)
+def test_settings_reject_log_backend_shared_by_processes(settings_class, backend):
+    with pytest.raises(pydantic.ValidationError, match="single process"):
+        settings_class(**{backend: "log"})
+    settings = settings_class(**{backend: "log", "log_store_single_process": True})
+    assert getattr(settings, backend) == "log"
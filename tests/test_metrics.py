@@ -0,0 +1,67 @@
+import time
+
+from saga.metrics import MetricsRegistry, SagaMetrics
+from saga.saga import (
+    EventSagaStateRepository,
+    Saga,
+    SagaExecutionController,
+    SagaIgniter,
+    SagaStep,
+)
+
+
+class NullSagaStateRepository(EventSagaStateRepository):
+    def _record(self, events):
+        pass
+
+
+class ListSagaExecutionController(SagaExecutionController):
+    def __init__(self, metrics):
+        super().__init__(NullSagaStateRepository(), metrics=metrics)
+        self.sent = []
+
+    def _send_next_step_command(self, payload):
+        self.sent.append(payload)
+
+    def _send_compensation_command(self, payload):
+        self.sent.append(payload)
+
+    def run(self):
+        while self.sent:
+            self._handle_message(self.sent.pop(0))
+
+
+class ListSagaIgniter(SagaIgniter):
+    def __init__(self, controller):
+        super().__init__(NullSagaStateRepository())
+        self._controller = controller
+
+    def _send_commands(self, payloads):
+        self._controller.sent.extend(payloads)
+
+
+def fail(message):
+    raise ValueError("no such account")
+
+
+def test_saga_duration_by_outcome():
+    registry = MetricsRegistry()
+    controller = ListSagaExecutionController(SagaMetrics(registry))
+    saga = Saga("transfer")
+    saga.add_step(SagaStep("withdraw", lambda m: m["payload"], lambda m: None))
+    saga.add_step(
+        SagaStep("deposit", lambda m: fail(m) if m["payload"] else 1, lambda m: None)
+    )
+    controller.add_saga(saga)
+    igniter = ListSagaIgniter(controller)
+    igniter.start_many(saga, [0, 0, 1])
+    # the start travels with the commands
+    assert all(c["started_at"] <= time.time() for c in controller.sent)
+    controller.run()
+
+    rendered = registry.render()
+    assert (
+        'saga_duration_seconds_count{saga="transfer",status="completed"} 2' in rendered
+    )
+    assert 'saga_duration_seconds_count{saga="transfer",status="failed"} 1' in rendered
+    assert 'saga_finished_total{status="failed"} 1' in rendered
@@ -0,0 +1,187 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from common.worker.rabbitmq_worker import RabbitmqWorker
+from saga.codec import MessageCodec
+from saga.idempotency import IdempotencyGuard
+from saga.metrics import MetricsRegistry, WorkerMetrics
+
+codec = MessageCodec()
+
+
+class FakeChannel:
+    def __init__(self, connection):
+        self._connection = connection
+        self.acked = []
+        self.published = []
+        self.declared = []
+        self._consumer = None
+
+    def exchange_declare(self, **kwargs):
+        pass
+
+    def queue_declare(self, queue, **kwargs):
+        self.declared.append(queue)
+
+    def queue_bind(self, **kwargs):
+        pass
+
+    def basic_qos(self, **kwargs):
+        pass
+
+    def basic_consume(self, queue, callback):
+        self._consumer = callback
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append((routing_key, body, properties))
+
+    def start_consuming(self):
+        for tag, message in enumerate(self._connection.deliveries, 1):
+            body, content_type, content_encoding = codec.encode(message)
+            self._consumer(
+                self,
+                SimpleNamespace(
+                    delivery_tag=tag, redelivered=False, routing_key="queue"
+                ),
+                SimpleNamespace(
+                    content_type=content_type,
+                    content_encoding=content_encoding,
+                    headers=None,
+                ),
+                body,
+            )
+
+
+class FakeConnection:
+    # runs callbacks added from other threads only when events are processed,
+    # like pika's BlockingConnection
+    def __init__(self, deliveries):
+        self.deliveries = deliveries
+        self.is_open = True
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self.channel_ = FakeChannel(self)
+
+    def channel(self):
+        return self.channel_
+
+    def add_callback_threadsafe(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def process_data_events(self, time_limit=0):
+        with self._lock:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def call_later(self, delay, callback):
+        return callback
+
+    def remove_timeout(self, timer):
+        pass
+
+
+def message(index, account_id="a"):
+    return {"type": "deposit", "account_id": account_id, "index": index}
+
+
+def run_worker(deliveries, handler, **options):
+    connection = FakeConnection(deliveries)
+    worker = RabbitmqWorker(connection, "exchange", "queue", **options)
+    worker.register_callback("deposit", handler)
+    worker.start()
+    return connection.channel_
+
+
+def failing_on(index):
+    def handle(message):
+        if message["index"] == index:
+            raise ValueError("no such account")
+
+    return handle
+
+
+@pytest.mark.parametrize("max_workers", [0, 4])
+def test_every_delivery_is_acked(max_workers):
+    handled = []
+    channel = run_worker(
+        [message(i, account_id=str(i % 3)) for i in range(20)],
+        lambda m: handled.append(m["index"]),
+        max_workers=max_workers,
+        ordering_key="account_id",
+    )
+    assert sorted(handled) == list(range(20))
+    # the pool's acks are sent before the worker stops
+    assert sorted(channel.acked) == list(range(1, 21))
+    assert channel.published == []
+
+
+@pytest.mark.parametrize("max_workers", [0, 4])
+def test_failed_message_is_dead_lettered(max_workers):
+    channel = run_worker(
+        [message(i) for i in range(5)], failing_on(2), max_workers=max_workers
+    )
+    assert "queue.dead" in channel.declared
+    # the consumer goes on after the failure in both modes
+    assert sorted(channel.acked) == [1, 2, 3, 4, 5]
+    [(queue, body, properties)] = channel.published
+    assert queue == "queue.dead"
+    assert codec.decode(body, properties.content_type, None) == message(2)
+    assert properties.headers == {
+        "x-error-type": "ValueError",
+        "x-error": "no such account",
+    }
+
+
+def test_messages_of_a_key_stay_in_order():
+    handled = {}
+    lock = threading.Lock()
+
+    def handle(message):
+        with lock:
+            handled.setdefault(message["account_id"], []).append(message["index"])
+
+    run_worker(
+        [message(i, account_id=str(i % 4)) for i in range(200)],
+        handle,
+        max_workers=8,
+        ordering_key="account_id",
+    )
+    for account_id, indexes in handled.items():
+        assert indexes == sorted(indexes)
+        assert len(indexes) == 50
+
+
+def test_failed_batch_is_dead_lettered():
+    connection = FakeConnection([message(i) for i in range(3)])
+    worker = RabbitmqWorker(connection, "exchange", "queue", batch_size=10)
+
+    def handle_batch(messages):
+        raise RuntimeError("database is down")
+
+    worker.register_batch_callback(["deposit"], handle_batch)
+    worker.start()
+    channel = connection.channel_
+    assert sorted(channel.acked) == [1, 2, 3]
+    assert [queue for queue, _, _ in channel.published] == ["queue.dead"] * 3
+
+
+def test_duplicates_are_counted_quietly(capsys):
+    handled = []
+    metrics = WorkerMetrics(MetricsRegistry())
+    channel = run_worker(
+        [dict(message(i % 2), command_id=str(i % 2)) for i in range(6)],
+        lambda m: handled.append(m["index"]),
+        idempotency_guard=IdempotencyGuard(),
+        metrics=metrics,
+    )
+    assert handled == [0, 1]
+    assert sorted(channel.acked) == list(range(1, 7))
+    assert metrics.duplicates.get(("queue",)) == 4
+    assert "duplicate" not in capsys.readouterr().out
@@ -0,0 +1,199 @@
+import json
+import os
+from collections import Counter, deque
+
+import pytest
+
+from saga.recovery import SNAPSHOT_FILE, RecoveryJournal
+from saga.saga import (
+    EventSagaStateRepository,
+    Saga,
+    SagaExecutionController,
+    SagaStep,
+)
+
+
+class Crash(BaseException):
+    # the process dying in the middle of a step, nothing gets to handle it
+    pass
+
+
+class NullSagaStateRepository(EventSagaStateRepository):
+    def _record(self, events):
+        pass
+
+
+class Broker:
+    # keeps deliveries until they are acked and hands the unacked ones out
+    # again when their consumer goes away
+    def __init__(self):
+        self.queue = deque()
+        self.unacked = {}
+        self._tags = 0
+
+    def publish(self, message):
+        self.queue.append(message)
+
+    def deliver(self):
+        self._tags += 1
+        message = self.queue.popleft()
+        self.unacked[self._tags] = message
+        return self._tags, message
+
+    def ack(self, tag):
+        del self.unacked[tag]
+
+    def consumer_lost(self):
+        for tag in sorted(self.unacked):
+            self.queue.appendleft(self.unacked.pop(tag))
+
+
+class BrokerSagaExecutionController(SagaExecutionController):
+    def __init__(self, broker, journal, crash_before_publish=False):
+        super().__init__(NullSagaStateRepository(), journal=journal)
+        self._broker = broker
+        self._unpublished = []
+        # dies once after handling a delivery, before what it sent is published
+        self._crash_before_publish = crash_before_publish
+
+    def _send_next_step_command(self, payload):
+        self._unpublished.append(payload)
+
+    def _send_compensation_command(self, payload):
+        self._unpublished.append(payload)
+
+    def run(self):
+        while self._broker.queue:
+            tag, message = self._broker.deliver()
+            handled = self._handle_message(message)
+            if self._crash_before_publish:
+                raise Crash()
+            # published and confirmed before the delivery is acked
+            for payload in self._unpublished:
+                self._broker.publish(payload)
+            self._unpublished = []
+            self._broker.ack(tag)
+            self._settled(handled)
+
+
+def make_saga(runs, crash_in):
+    def action(name):
+        def run(message):
+            if name in crash_in:
+                crash_in.remove(name)
+                raise Crash()
+            runs[name] += 1
+            return message["payload"]
+
+        return run
+
+    saga = Saga("transfer")
+    for name in ("withdraw", "deposit", "notify"):
+        saga.add_step(SagaStep(name, action(name), lambda message: None))
+    return saga
+
+
+def start(broker, saga_id):
+    broker.publish(
+        {
+            "saga_id": saga_id,
+            "saga_name": "transfer",
+            "step_name": "withdraw",
+            "step_type": "action",
+            "payload": {"amount": 10},
+        }
+    )
+
+
+def restart(broker, folder, saga):
+    broker.consumer_lost()
+    controller = BrokerSagaExecutionController(broker, RecoveryJournal(folder))
+    controller.add_saga(saga)
+    return controller
+
+
+def test_crashed_step_runs_again(tmp_path):
+    runs = Counter()
+    saga = make_saga(runs, crash_in={"deposit"})
+    broker = Broker()
+    controller = BrokerSagaExecutionController(broker, RecoveryJournal(tmp_path))
+    controller.add_saga(saga)
+    for index in range(3):
+        start(broker, f"saga-{index}")
+    with pytest.raises(Crash):
+        controller.run()
+
+    # the deposit had no outcome, the broker brings it back and it runs
+    controller = restart(broker, tmp_path, saga)
+    controller.run()
+    assert runs == {"withdraw": 3, "deposit": 3, "notify": 3}
+    assert not broker.queue and not broker.unacked
+    assert RecoveryJournal(tmp_path).handled_commands() == {}
+
+
+def test_restart_sends_what_was_not_published(tmp_path):
+    runs = Counter()
+    saga = make_saga(runs, crash_in=set())
+    broker = Broker()
+    controller = BrokerSagaExecutionController(
+        broker, RecoveryJournal(tmp_path), crash_before_publish=True
+    )
+    controller.add_saga(saga)
+    start(broker, "saga-0")
+    with pytest.raises(Crash):
+        controller.run()
+    assert runs == {"withdraw": 1} and not broker.queue
+
+    # the withdraw is delivered again, the journal sends its deposit
+    # instead of withdrawing a second time
+    controller = restart(broker, tmp_path, saga)
+    controller.run()
+    assert runs == {"withdraw": 1, "deposit": 1, "notify": 1}
+    assert not broker.queue and not broker.unacked
+    assert RecoveryJournal(tmp_path).handled_commands() == {}
+
+
+def command(saga_id, step_name="withdraw"):
+    return {
+        "saga_id": saga_id,
+        "saga_name": "transfer",
+        "step_name": step_name,
+        "step_type": "action",
+        "payload": {},
+    }
+
+
+def test_replay_reads_snapshot_and_tail(tmp_path):
+    journal = RecoveryJournal(tmp_path, snapshot_interval=10)
+    for index in range(20):
+        message = command(f"saga-{index}")
+        sent = {"command": command(message["saga_id"], "deposit"), "delay": None}
+        journal.command_handled(message, [sent])
+        if index % 2:
+            journal.commands_settled([message])
+    # later segments only
+    assert len(os.listdir(tmp_path)) <= 3
+    with open(tmp_path / SNAPSHOT_FILE) as f:
+        assert json.load(f)["segment"] > 0
+
+    reloaded = RecoveryJournal(tmp_path)
+    assert reloaded.handled_commands() == journal.handled_commands()
+    assert len(reloaded.handled_commands()) == 10
+    [sent] = reloaded.replay(command("saga-0"))
+    assert sent["command"] == command("saga-0", "deposit")
+    assert reloaded.replay(command("saga-1")) is None
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    journal = RecoveryJournal(tmp_path)
+    message = command("saga-0")
+    sent = [{"command": command("saga-0", "deposit"), "delay": None}]
+    journal.command_handled(message, sent)
+    segment = max(n for n in os.listdir(tmp_path) if n.endswith(".log"))
+    with open(tmp_path / segment, "ab") as f:
+        f.write(b'{"saga_id": "saga-0", "sett')
+
+    reloaded = RecoveryJournal(tmp_path)
+    assert reloaded.replay(message) == sent
+    reloaded.commands_settled([message])
+    assert RecoveryJournal(tmp_path).handled_commands() == {}
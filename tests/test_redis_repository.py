@@ -0,0 +1,72 @@
+import os
+import uuid
+
+import pytest
+import redis
+
+from saga.redis_repository import RedisSagaStateRepository
+
+
+@pytest.fixture
+def client():
+    # a local redis-server when REDIS_URL is set, fakeredis otherwise
+    url = os.getenv("REDIS_URL")
+    if url:
+        client = redis.Redis.from_url(url)
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        client = fakeredis.FakeRedis()
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def repository(client):
+    return RedisSagaStateRepository(client, prefix=f"test-{uuid.uuid4().hex}")
+
+
+def test_status_is_the_latest_event(repository):
+    repository.saga_started("s1", "transfer", "withdraw")
+    repository.action_started("s1", "withdraw")
+    repository.step_retried("s1", "withdraw", "action", 1, "IOError", "timed out")
+    with repository.batch():
+        repository.action_succeeded("s1", "withdraw")
+        repository.saga_completed("s1")
+
+    status = repository.get_status("s1")
+    assert status["status"] == "completed"
+    # nothing left over from the retry
+    assert "error" not in status and "step_status" not in status
+    assert [e.get("step_status") for e in repository.get_events("s1")] == [
+        None,
+        "action_started",
+        "action_retried",
+        "action_succeeded",
+        None,
+    ]
+
+
+def test_finished_sagas_expire(client):
+    repository = RedisSagaStateRepository(
+        client, prefix=f"test-{uuid.uuid4().hex}", finished_ttl=60
+    )
+    repository.saga_started("s1", "transfer", "withdraw")
+    repository.saga_started("s2", "transfer", "withdraw")
+    repository.saga_failed("s1", "withdraw", "ValueError", "no such account")
+    assert 0 < client.ttl(repository._status_key("s1")) <= 60
+    assert 0 < client.ttl(repository._events_key("s1")) <= 60
+    assert client.ttl(repository._status_key("s2")) == -1
+
+
+def test_group_members_are_recorded_once(repository):
+    outcome = {"status": "succeeded", "result": 1}
+    assert repository.group_step_finished("s1", "g", "action", "a", outcome) == {
+        "a": outcome
+    }
+    assert repository.group_step_finished("s1", "g", "action", "a", outcome) is None
+    outcomes = repository.group_step_finished("s1", "g", "action", "b", outcome)
+    assert outcomes == {"a": outcome, "b": outcome}
+    # other phases are kept apart
+    assert repository.group_step_finished("s1", "g", "compensation", "a", {}) == {
+        "a": {}
+    }
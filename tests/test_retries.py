@@ -0,0 +1,41 @@
+import threading
+
+from saga.saga import RetryPolicy, Saga, SagaStep
+from tests.test_steps import run_saga  # noqa: F401
+
+
+def test_retries_are_delayed_before_compensating(run_saga):
+    attempts = []
+
+    def flaky(message):
+        attempts.append(message.get("attempt", 1))
+        if len(attempts) < 3:
+            raise ConnectionError("try again")
+        return message["payload"]
+
+    saga = Saga("order")
+    saga.add_step(
+        SagaStep(
+            "charge",
+            flaky,
+            lambda m: None,
+            retry_policy=RetryPolicy(max_attempts=3, initial_delay=1, jitter=0),
+        )
+    )
+    status, controller = run_saga(saga)
+    assert status == "completed"
+    assert attempts == [1, 2, 3]
+    assert controller.delays == [1, 2]
+
+
+def test_timed_out_step_fails(run_saga):
+    release = threading.Event()
+    saga = Saga("order")
+    saga.add_step(
+        SagaStep("charge", lambda m: release.wait(5), lambda m: None, timeout=0.05)
+    )
+    try:
+        status, _ = run_saga(saga)
+    finally:
+        release.set()
+    assert status == "failed"
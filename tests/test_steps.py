@@ -0,0 +1,136 @@
+from collections import deque
+
+import pytest
+
+from saga.file_repository import FileSagaStateRepository
+from saga.saga import (
+    CompositeSagaStateRepository,
+    Saga,
+    SagaExecutionController,
+    SagaIgniter,
+    SagaStep,
+    SagaWatcher,
+)
+
+
+class QueueSagaExecutionController(SagaExecutionController):
+    # commands go through a deque, delayed ones are counted and queued too
+    def __init__(self, repository, **options):
+        super().__init__(repository, **options)
+        self.queue = deque()
+        self.sent = 0
+        self.delays = []
+
+    def _send_next_step_command(self, payload):
+        self.sent += 1
+        self.queue.append(payload)
+
+    def _send_compensation_command(self, payload):
+        self.sent += 1
+        self.queue.append(payload)
+
+    def _send_delayed_command(self, payload, delay):
+        self.delays.append(delay)
+        self.queue.append(payload)
+
+    def run(self):
+        while self.queue:
+            self._handle_message(self.queue.popleft())
+
+
+class QueueSagaIgniter(SagaIgniter):
+    def __init__(self, repository, watcher, controller):
+        super().__init__(repository, watcher)
+        self._controller = controller
+
+    def _send_commands(self, payloads):
+        self._controller.queue.extend(payloads)
+
+
+class Steps:
+    # actions and compensations that log their calls and fail on demand
+    def __init__(self, fail=(), fail_compensation=()):
+        self.log = []
+        self._fail = set(fail)
+        self._fail_compensation = set(fail_compensation)
+
+    def step(self, name, **options):
+        def action(message):
+            self.log.append(("action", name))
+            if name in self._fail:
+                raise ValueError(f"{name} failed")
+            return {name: message["payload"]}
+
+        def compensation(message):
+            self.log.append(("compensation", name))
+            if name in self._fail_compensation:
+                raise ValueError(f"{name} compensation failed")
+            return message["payload"]
+
+        return SagaStep(name, action, compensation, **options)
+
+
+@pytest.fixture
+def run_saga(tmp_path):
+    def run(saga, **options):
+        # the file repository keeps the state of step groups
+        storage = FileSagaStateRepository(str(tmp_path / "state.log"))
+        watcher = SagaWatcher()
+        repository = CompositeSagaStateRepository([storage, watcher])
+        controller = QueueSagaExecutionController(repository, **options)
+        controller.add_saga(saga)
+        handle = QueueSagaIgniter(repository, watcher, controller).start(saga, 1)
+        controller.run()
+        storage.close()
+        return handle.status()["status"], controller
+
+    return run
+
+
+def linear(steps, names=("reserve", "charge", "ship")):
+    saga = Saga("order")
+    for name in names:
+        saga.add_step(steps.step(name))
+    return saga
+
+
+def test_steps_run_in_order(run_saga):
+    steps = Steps()
+    status, controller = run_saga(linear(steps))
+    assert status == "completed"
+    assert steps.log == [("action", n) for n in ("reserve", "charge", "ship")]
+    assert controller.sent == 2
+
+
+def test_failure_compensates_previous_steps_in_reverse(run_saga):
+    steps = Steps(fail={"ship"})
+    status, _ = run_saga(linear(steps))
+    assert status == "failed"
+    assert steps.log == [
+        ("action", "reserve"),
+        ("action", "charge"),
+        ("action", "ship"),
+        ("compensation", "ship"),
+        ("compensation", "charge"),
+        ("compensation", "reserve"),
+    ]
+
+
+def test_failed_compensation_stops_the_saga(run_saga):
+    steps = Steps(fail={"ship"}, fail_compensation={"charge"})
+    status, _ = run_saga(linear(steps))
+    assert status == "compensation_failed"
+    assert steps.log[-1] == ("compensation", "charge")
+
+
+def test_inline_local_steps_are_not_sent(run_saga):
+    steps = Steps()
+    saga = Saga("order")
+    saga.add_step(steps.step("reserve"))
+    saga.add_step(steps.step("charge", remote=True))
+    saga.add_step(steps.step("ship"))
+    status, controller = run_saga(saga, inline_local_steps=True)
+    assert status == "completed"
+    # only the remote step goes through the broker
+    assert controller.sent == 1
+    assert [name for _, name in steps.log] == ["reserve", "charge", "ship"]
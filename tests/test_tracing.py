@@ -0,0 +1,37 @@
+import time
+
+from saga.tracing import SagaTracer, load_trace
+
+
+def spans(path):
+    return [e for e in load_trace(path) if e["ph"] == "X"]
+
+
+def test_quiet_tracer_flushes_on_interval(tmp_path):
+    tracer = SagaTracer(str(tmp_path), sample_rate=1, flush_interval=0.05)
+    tracer.record("s1", "action withdraw", "step", time.perf_counter(), 0.001)
+    deadline = time.time() + 5
+    while not spans(tracer.path) and time.time() < deadline:
+        time.sleep(0.01)
+    assert [e["name"] for e in spans(tracer.path)] == ["action withdraw"]
+    tracer.close()
+
+
+def test_close_writes_buffered_spans(tmp_path):
+    tracer = SagaTracer(str(tmp_path), sample_rate=1, flush_interval=None)
+    for index in range(10):
+        tracer.record(f"s{index}", "publish", "publish", time.perf_counter(), 0)
+    assert spans(tracer.path) == []
+    tracer.close()
+    assert len(spans(tracer.path)) == 10
+
+
+def test_sampling_depends_on_the_saga_id_only(tmp_path):
+    first = SagaTracer(str(tmp_path / "a"), sample_rate=0.5, flush_interval=None)
+    second = SagaTracer(str(tmp_path / "b"), sample_rate=0.5, flush_interval=None)
+    ids = [f"saga-{index}" for index in range(1000)]
+    sampled = [i for i in ids if first.sampled(i)]
+    assert sampled == [i for i in ids if second.sampled(i)]
+    assert 400 < len(sampled) < 600
+    first.close()
+    second.close()
@@ -0,0 +1,69 @@
+import pytest
+
+from saga.saga import Saga, SagaIgniter, SagaStep, SagaWatcher
+
+
+class RecordingIgniter(SagaIgniter):
+    def __init__(self, watcher):
+        super().__init__(watcher, watcher)
+        self.sent = []
+
+    def _send_commands(self, payloads):
+        self.sent.extend(payloads)
+
+
+def make_saga():
+    saga = Saga("transfer")
+    saga.add_step(SagaStep("withdraw", lambda m: None, lambda m: None))
+    return saga
+
+
+def test_tracks_status_and_stuck_sagas():
+    watcher = SagaWatcher(step_deadlines={"withdraw": 10})
+    watcher.apply(
+        {"saga_id": "s1", "status": "started", "step_name": "withdraw", "time": 1}
+    )
+    watcher.apply({"saga_id": "s2", "status": "started", "step_name": "withdraw"})
+    assert watcher.counts() == {"started": 2}
+    assert watcher.stuck_sagas(now=6) == []
+    assert watcher.stuck_sagas("started", now=11) == ["s1"]
+    watcher.apply({"saga_id": "s1", "status": "completed", "time": 12})
+    assert watcher.get("s1")["status"] == "completed"
+    assert watcher.stuck_sagas("started", now=12) == []
+
+
+def test_finished_sagas_are_evicted_beyond_max_finished():
+    watcher = SagaWatcher(max_finished=2)
+    for index in range(5):
+        watcher.apply({"saga_id": f"s{index}", "status": "started"})
+    for index in range(4):
+        watcher.apply({"saga_id": f"s{index}", "status": "completed"})
+    assert sorted(watcher.sagas("completed")) == ["s2", "s3"]
+    assert watcher.get("s0") is None
+    # running sagas are never evicted
+    assert watcher.sagas("started") == ["s4"]
+    assert watcher.count() == 3
+
+
+def test_wait_timeout_removes_its_callback():
+    watcher = SagaWatcher()
+    igniter = RecordingIgniter(watcher)
+    handle = igniter.start(make_saga(), {"amount": 1}, saga_id="s1")
+    for _ in range(3):
+        with pytest.raises(TimeoutError):
+            handle.wait(0.01)
+    assert watcher._done_callbacks == {}
+
+    watcher.apply({"saga_id": "s1", "status": "completed"})
+    assert handle.wait(0.01)["status"] == "completed"
+    assert handle.done()
+
+
+def test_start_many_needs_an_id_per_payload():
+    igniter = RecordingIgniter(SagaWatcher())
+    with pytest.raises(ValueError):
+        igniter.start_many(make_saga(), [{}, {}], saga_ids=["s1"])
+    assert igniter.sent == []
+    handles = igniter.start_many(make_saga(), [{}, {}], saga_ids=["s1", "s2"])
+    assert [h.saga_id for h in handles] == ["s1", "s2"]
+    assert [c["saga_id"] for c in igniter.sent] == ["s1", "s2"]